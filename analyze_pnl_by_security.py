@@ -1,64 +1,121 @@
+import numpy as np
 import pandas as pd
+from lot_engine import load_trades, replay, SELL_TYPES
+from position_store import PositionStore
+from result_cache import ResultCache
 
 # 文件路径
 trade_file = '202506对账单.csv'
 pos_file = '股票持仓模板.csv'
 out_file = '202506对账单_盈亏统计.csv'
+detail_file = '202506对账单_逐笔盈亏.csv'
 
-# 读取交易流水
-raw = pd.read_csv(trade_file, dtype=str)
-raw = raw[raw['业务名称'].isin(['证券买入', '证券卖出'])]
-for col in ['成交金额','成交数量','手续费','印花税','过户费','交易所清算费','附加费']:
-    raw[col] = pd.to_numeric(raw[col], errors='coerce').fillna(0)
-
-# 读取持仓表
-pos = pd.read_csv(pos_file, dtype=str, encoding='gbk')
-for col in ['持仓数量','平均持仓成本','当前价格']:
-    pos[col] = pd.to_numeric(pos[col], errors='coerce').fillna(0)
-
-# 分组统计已实现部分
-summary = []
-for (code, name), group in raw.groupby(['证券代码','证券名称']):
-    buy = group[group['业务名称']=='证券买入']
-    sell = group[group['业务名称']=='证券卖出']
-    buy_amt = buy['成交金额'].sum()
-    sell_amt = sell['成交金额'].sum()
-    buy_qty = buy['成交数量'].sum()
-    sell_qty = sell['成交数量'].sum()
-    buy_fee = buy['手续费'].sum()
-    sell_fee = sell['手续费'].sum()
-    sell_tax = sell['印花税'].sum()
-    sell_transfer = sell['过户费'].sum()
-    sell_clear = sell['交易所清算费'].sum()
-    sell_extra = sell['附加费'].sum()
-    total_fee = buy_fee + sell_fee + sell_tax + sell_transfer + sell_clear + sell_extra
-    realized_pnl = sell_amt - buy_amt - total_fee
-    # 查找当前持仓
-    pos_row = pos[(pos['股票代码'].astype(str)==str(code)) & (pos['股票名称']==name)]
-    if not pos_row.empty:
-        cur_qty = int(round(pos_row.iloc[0]['持仓数量']))
-        cur_price = pos_row.iloc[0]['当前价格']
-        avg_cost = pos_row.iloc[0]['平均持仓成本']
-        # 未实现盈亏 = 当前持仓数量 * (当前价格 - 平均持仓成本)
-        unrealized_pnl = cur_qty * (cur_price - avg_cost)
-    else:
-        cur_qty = 0
-        cur_price = 0
-        avg_cost = 0
-        unrealized_pnl = 0
-    total_pnl = realized_pnl + unrealized_pnl
-    total_yield = (total_pnl / buy_amt * 100) if buy_amt != 0 else 0
-    summary.append([
-        code, name,
-        int(round(buy_amt)), int(round(sell_amt)), int(round(buy_qty)), int(round(sell_qty)),
-        int(round(buy_fee)), int(round(sell_fee)), int(round(sell_tax)), int(round(sell_transfer)),
-        int(round(sell_clear)), int(round(sell_extra)), int(round(realized_pnl)), int(round(unrealized_pnl)),
-        int(round(total_pnl)), int(round(total_yield)), int(round(cur_qty)), int(round(cur_price)), int(round(avg_cost))
-    ])
-
-# 输出
-header = ['证券代码','证券名称','买入总额','卖出总额','买入数量','卖出数量','买入手续费','卖出手续费','卖出印花税','卖出过户费','卖出清算费','卖出附加费','已实现盈亏','未实现盈亏','总盈亏','总收益率(%)','当前持仓数量','当前价格','平均持仓成本']
-df_out = pd.DataFrame(summary, columns=header)
-df_out.to_csv(out_file, index=False, encoding='utf-8-sig')
-
-print('已完成详细盈亏统计（含未实现部分，数字已取整），结果已写入', out_file) 
\ No newline at end of file
+# 持仓表可能是模板格式，也可能是券商导出的原始格式
+POSITION_COLUMNS = {'证券代码': '股票代码', '证券名称': '股票名称', '参考持股': '持仓数量',
+                    '成本价': '平均持仓成本', '当前价': '当前价格'}
+
+header = ['证券代码','证券名称','买入总额','卖出总额','买入数量','卖出数量','买入手续费','卖出手续费','卖出印花税','卖出过户费','卖出清算费','卖出附加费','已实现盈亏','未实现盈亏','总盈亏','总收益率(%)','当前持仓数量','当前价格','平均持仓成本','已实现盈亏(均价法)','持仓核对']
+
+
+def load_positions(path):
+    """读取持仓表，返回 {证券代码: (持仓数量, 当前价格, 平均持仓成本)} 的哈希索引"""
+    for encoding in ['utf-8-sig', 'gbk']:
+        try:
+            pos = pd.read_csv(path, dtype=str, encoding=encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    pos = pos.rename(columns={k: v for k, v in POSITION_COLUMNS.items() if v not in pos})
+    for col in ['持仓数量', '平均持仓成本', '当前价格']:
+        pos[col] = pd.to_numeric(pos[col], errors='coerce').fillna(0)
+    pos = pos[pos['持仓数量'] > 0]
+    return {str(code): (qty, price, cost) for code, qty, price, cost
+            in zip(pos['股票代码'], pos['持仓数量'], pos['当前价格'], pos['平均持仓成本'])}
+
+
+def snapshot_positions(snapshots):
+    """
+    各资金帐号的持仓快照 {资金帐号: Snapshot} -> 与 load_positions 相同格式的哈希索引，不再解析 CSV
+    同一证券在多个帐号都有持仓时合并：数量相加，平均持仓成本按数量加权
+    """
+    rec = np.concatenate([snap.records for snap in snapshots.values()])
+    pos = pd.DataFrame({'code': rec['code'], 'qty': rec['qty'], 'price': np.nan_to_num(rec['price']),
+                        'cost': rec['qty'] * rec['cost_price']})
+    pos = pos.groupby('code').agg(qty=('qty', 'sum'), price=('price', 'last'), cost=('cost', 'sum'))
+    return {code: (qty, price, cost / qty if qty else 0.0) for code, qty, price, cost
+            in zip(pos.index, pos['qty'], pos['price'], pos['cost'])}
+
+
+def summarize(detail, positions):
+    """
+    按证券汇总逐笔明细
+    持仓数量、剩余批次成本是每个资金帐号各自回放的结果，先取每个 (资金帐号, 证券代码) 的最后一笔再按证券相加
+    已实现盈亏按 FIFO 批次计算；持仓数量与对账单回放一致时，未实现盈亏 = 市值 - 剩余批次成本，
+    不一致时（持仓表里有对账单以外转入的股份）退回用持仓表的平均持仓成本，并在持仓核对列标出
+    """
+    detail = detail.assign(卖出=detail['业务名称'].isin(SELL_TYPES))
+    sums = detail.pivot_table(index='证券代码', columns='卖出', aggfunc='sum', fill_value=0,
+                              values=['成交金额', '成交数量', '手续费', '印花税', '过户费', '交易所清算费', '附加费',
+                                      '已实现盈亏_FIFO', '已实现盈亏_均价'])
+    sums = sums.reindex(columns=pd.MultiIndex.from_product([sums.columns.levels[0], [False, True]]), fill_value=0)
+    held = (detail.groupby(['资金帐号', '证券代码'])[['持仓数量', '持仓成本_FIFO']].last()
+            .groupby(level='证券代码').sum())
+    names = detail.groupby('证券代码')['证券名称'].last()
+
+    summary = []
+    for code in sums.index:
+        s = sums.loc[code]
+        buy_amt, sell_amt = s[('成交金额', False)], s[('成交金额', True)]
+        realized = s[('已实现盈亏_FIFO', True)]
+        realized_avg = s[('已实现盈亏_均价', True)]
+        held_qty, held_cost = held.loc[code, '持仓数量'], held.loc[code, '持仓成本_FIFO']
+        cur_qty, cur_price, avg_cost = positions.get(str(code), (0, 0, 0))
+        if round(cur_qty) == round(held_qty):
+            # 持仓表与回放一致（包括都为 0）
+            check = '一致'
+            if held_qty > 0:
+                avg_cost = held_cost / held_qty
+            unrealized = cur_qty * cur_price - held_cost
+        else:
+            check = f'对账单持仓 {held_qty:.0f}'
+            unrealized = cur_qty * (cur_price - avg_cost)
+        total_pnl = realized + unrealized
+        total_yield = (total_pnl / buy_amt * 100) if buy_amt != 0 else 0
+        summary.append([
+            code, names.loc[code],
+            buy_amt, sell_amt, s[('成交数量', False)], s[('成交数量', True)],
+            s[('手续费', False)], s[('手续费', True)], s[('印花税', True)], s[('过户费', True)],
+            s[('交易所清算费', True)], s[('附加费', True)], realized, unrealized,
+            total_pnl, total_yield, cur_qty, cur_price, avg_cost, realized_avg, check,
+        ])
+    return pd.DataFrame(summary, columns=header)
+
+
+def run(snapshots=None):
+    detail, _ = replay(load_trades(trade_file))
+    detail.to_csv(detail_file, index=False, encoding='utf-8-sig')
+
+    positions = snapshot_positions(snapshots) if snapshots else load_positions(pos_file)
+    df_out = summarize(detail, positions)
+    # 数字取整
+    numeric = df_out.columns[2:-1]
+    df_out[numeric] = df_out[numeric].round().astype('int64')
+    df_out.to_csv(out_file, index=False, encoding='utf-8-sig')
+    return df_out
+
+
+def main():
+    # 优先用持仓快照仓库中各资金帐号最新的券商快照，没有时读持仓表
+    snapshots = PositionStore().snapshots()
+    positions = [snap.records for snap in snapshots.values()] if snapshots else [pos_file]
+    # 对账单和持仓都没变时直接用上次的结果
+    df_out, hit = ResultCache().memoize('pnl_by_security', lambda: run(snapshots), inputs=[trade_file, *positions],
+                                        outputs=[out_file, detail_file])
+    if hit:
+        print('对账单和持仓表未变化，使用缓存结果')
+    print(df_out[['证券代码', '证券名称', '已实现盈亏', '已实现盈亏(均价法)', '未实现盈亏', '总盈亏', '持仓核对']].to_string())
+    print('已完成详细盈亏统计（含未实现部分，数字已取整），结果已写入', out_file, '逐笔明细已写入', detail_file)
+
+
+if __name__ == '__main__':
+    main()
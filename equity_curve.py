@@ -0,0 +1,189 @@
+"""
+每日账户净值、时间加权收益率（TWR）和回撤
+
+数据来源：
+  202506对账单.csv  资金本次余额（每日收盘现金）、证券买卖（每日持仓数量）、
+                    银行转存/转取（外部资金流）、质押回购、证券理财、新股申购（在途资金）
+  我的资金流水.csv  银行端的转账记录，用来核对对账单中的外部资金流
+  K线仓库          持仓证券的每日收盘价；仓库里没有的证券用最近一笔成交价估值
+
+账户净值 = 现金 + Σ 持仓数量 × 收盘价 + 在途资金（回购、理财、新股按成本计）
+日收益率 = 当日净值 / (前一日净值 + 当日外部资金流) - 1（资金流视为开盘前到账）
+所有计算都在 日期 × 证券 的矩阵上一次完成
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from lot_engine import prepare_trades, replay
+from fee_model import FX_PATTERN, HK_DEFAULT_RATE
+from bar_store import bar_path, load_bars
+
+trade_file = '202506对账单.csv'
+bank_file = '我的资金流水.csv'
+out_file = '202506对账单_每日净值.csv'
+
+EXTERNAL_FLOWS = ['银行转存', '银行转取']
+
+# 在途资金：现金已经划出但还不是持仓证券的部分，按成本计入净值
+PENDING = {
+    '质押回购拆出': '回购', '拆出质押购回': '回购',
+    '证券理财申购确认': '理财', '证券理财认购确认': '理财', '证券理财定时定额投资确认': '理财', '证券理财赎回确认': '理财',
+    '新股申购': '新股', '申购返款': '新股', '市值申购中签扣款': '新股', '市值申购中签扣款回冲': '新股',
+    '新股申购确认缴款': '新股', '新股入帐': '新股',
+}
+
+MARKETS = {'上海': ('A', 'sh.'), '深圳': ('A', 'sz.'), '沪HK': ('HK', ''), '深HK': ('HK', '')}
+
+
+def load_statement(path=trade_file, store=False):
+    """
+    读取整份对账单（保持原始行序），数值列转成 float，日期转成 datetime
+    store=True 时从 statement_store 归档的全部对账单读取，path 不再使用
+    """
+    if store:
+        from statement_store import StatementStore
+        raw = StatementStore().load('对账单')
+    else:
+        raw = pd.read_csv(path, dtype=str)
+    for col in ['成交价格', '成交数量', '成交金额', '发生金额', '资金本次余额']:
+        raw[col] = pd.to_numeric(raw[col], errors='coerce').fillna(0)
+    raw['date'] = pd.to_datetime(raw['发生日期'], format='%Y%m%d')
+    return raw
+
+
+def load_bank_flows(path=bank_file):
+    """读取银行流水帐，只保留成功的银行转存/转取，转取为负数"""
+    raw = pd.read_csv(path, dtype=str, header=None, skiprows=5)
+    # 表头比数据错开一列，按数据行的位置取列
+    raw = raw[[0, 6, 7, 9]].set_axis(['转账日期', '业务名称', '发生金额', '业务状态'], axis=1)
+    for col in raw:
+        raw[col] = raw[col].str.strip()
+    raw = raw[raw['业务名称'].isin(EXTERNAL_FLOWS) & (raw['业务状态'] == '成功')].copy()
+    raw['date'] = pd.to_datetime(raw['转账日期'], format='%Y%m%d')
+    raw['amount'] = pd.to_numeric(raw['发生金额']) * np.where(raw['业务名称'] == '银行转取', -1, 1)
+    return raw[['date', '业务名称', 'amount']].reset_index(drop=True)
+
+
+def check_bank_flows(statement_flows, bank_flows):
+    """按 (日期, 金额) 核对两边的外部资金流，返回只在一边出现的记录"""
+    a = statement_flows.assign(n=statement_flows.groupby(['date', 'amount']).cumcount())
+    b = bank_flows.assign(n=bank_flows.groupby(['date', 'amount']).cumcount())
+    merged = a.merge(b, on=['date', 'amount', 'n'], how='outer', indicator=True)
+    # 只核对两份文件都覆盖的日期范围
+    start, end = max(a['date'].min(), b['date'].min()), min(a['date'].max(), b['date'].max())
+    merged = merged[(merged['date'] >= start) & (merged['date'] <= end) & (merged['_merge'] != 'both')]
+    merged['来源'] = merged['_merge'].map({'left_only': '仅对账单', 'right_only': '仅银行流水'})
+    return merged[['date', 'amount', '来源']].reset_index(drop=True)
+
+
+def floored_cumsum(flows):
+    """
+    逐列累加，余额不低于 0（超出成本收回的部分视为收益，已经体现在现金里）
+    b_t = max(0, b_{t-1} + x_t) 的向量化写法：S_t - min(0, min_{s<=t} S_s)
+    """
+    total = flows.cumsum()
+    return total - np.minimum.accumulate(np.minimum(total, 0), axis=0)
+
+
+def load_closes(codes, markets, dates, root=None):
+    """从 K线仓库读取收盘价（不联网），返回 日期 × 证券 矩阵；仓库里没有的列为 NaN"""
+    closes = pd.DataFrame(np.nan, index=dates, columns=codes)
+    for code, market_name in zip(codes, markets):
+        market, prefix = MARKETS.get(market_name, ('A', ''))
+        symbol = prefix + code
+        if not os.path.exists(bar_path(symbol, market, root)):
+            continue
+        bars = load_bars(symbol, market, dates[0], dates[-1], root)
+        closes[code] = bars['close'].astype('float64').reindex(dates, method='ffill')
+    return closes
+
+
+def equity_curve(statement, root=None):
+    """
+    计算每日净值，返回 (daily, holdings)
+    daily：现金、证券市值、在途资金、外部资金流、净值、日收益率、累计收益率（TWR）、回撤
+    holdings：每日每只证券的市值
+    """
+    statement = statement.copy()
+    dates = pd.DatetimeIndex(sorted(set(pd.bdate_range(statement['date'].min(), statement['date'].max()))
+                                    | set(statement['date'])))
+
+    # 现金：每个资金帐号每天最后一行的资金本次余额，多个帐号相加
+    cash = statement.pivot_table(index='date', columns='资金帐号', values='资金本次余额', aggfunc='last')
+    cash = cash.reindex(dates).ffill().fillna(0).sum(axis=1)
+
+    # 外部资金流
+    flows = statement.loc[statement['业务名称'].isin(EXTERNAL_FLOWS), ['date', '发生金额']]
+    external = flows.groupby('date')['发生金额'].sum().reindex(dates, fill_value=0.0)
+
+    # 在途资金：新股入帐时现金已在申购时划出，入帐的市值转到持仓
+    pending_rows = statement[statement['业务名称'].isin(PENDING)]
+    pending_flow = np.where(pending_rows['业务名称'] == '新股入帐',
+                            -pending_rows['成交价格'] * pending_rows['成交数量'].abs(), -pending_rows['发生金额'])
+    pending = pd.DataFrame({'date': pending_rows['date'], 'kind': pending_rows['业务名称'].map(PENDING),
+                            'flow': pending_flow})
+    pending = pending.pivot_table(index='date', columns='kind', values='flow', aggfunc='sum')
+    pending = floored_cumsum(pending.reindex(dates).fillna(0.0))
+
+    # 持仓数量：回放买卖记录，每个资金帐号每天取最后的持仓，再按证券相加
+    trades, _ = replay(prepare_trades(statement))
+    trades['date'] = pd.to_datetime(trades['发生日期'], format='%Y%m%d')
+    qty = trades.pivot_table(index='date', columns=['资金帐号', '证券代码'], values='持仓数量', aggfunc='last')
+    qty = qty.reindex(dates).ffill().fillna(0).T.groupby(level='证券代码').sum().T
+
+    # 价格：港股通汇率取对账单备注中最近一次的汇率
+    fx = pd.to_numeric(statement['备注'].str.extract(FX_PATTERN)[0], errors='coerce')
+    fx = fx.groupby(statement['date']).last().reindex(dates).ffill().bfill().fillna(HK_DEFAULT_RATE)
+    markets = trades.groupby('证券代码')['交易市场'].last().reindex(qty.columns)
+    is_hk = markets.str.contains('HK').to_numpy()
+    closes = load_closes(list(qty.columns), list(markets), dates, root)
+    closes.loc[:, is_hk] = closes.loc[:, is_hk].mul(fx, axis=0)
+    # 没有K线的用最近一笔成交的人民币单价（港股通的成交金额已按汇率折算）
+    unit = (trades['成交金额'] / trades['成交数量'].abs()).where(trades['成交数量'] != 0)
+    last_trade = trades.assign(unit=unit).pivot_table(index='date', columns='证券代码', values='unit', aggfunc='last')
+    closes = closes.fillna(last_trade.reindex(dates).ffill())
+
+    holdings = (qty * closes).fillna(0)
+    daily = pd.DataFrame({'现金': cash, '证券市值': holdings.sum(axis=1)}, index=dates)
+    for kind in ['回购', '理财', '新股']:
+        daily[kind] = pending[kind] if kind in pending else 0.0
+    daily['净值'] = daily[['现金', '证券市值', '回购', '理财', '新股']].sum(axis=1)
+    daily['外部资金流'] = external
+
+    # 时间加权收益率：资金流在开盘前到账
+    base = daily['净值'].shift(1).fillna(0) + daily['外部资金流']
+    returns = (daily['净值'] / base.where(base > 0) - 1).fillna(0)
+    daily['日收益率'] = returns
+    index = (1 + returns).cumprod()
+    daily['累计收益率'] = index - 1
+    daily['回撤'] = index / index.cummax() - 1
+    daily.index.name = '日期'
+    return daily, holdings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对账单 -> 每日净值、时间加权收益率和回撤")
+    parser.add_argument('--statement', default=trade_file)
+    parser.add_argument('--store', action='store_true', help="使用 statement_store 归档的全部对账单")
+    parser.add_argument('--bank', default=bank_file)
+    parser.add_argument('--output', default=out_file)
+    args = parser.parse_args()
+
+    statement = load_statement(args.statement, args.store)
+    daily, holdings = equity_curve(statement)
+    daily.to_csv(args.output, encoding='utf-8-sig', float_format='%.4f')
+
+    if os.path.exists(args.bank):
+        flows = statement.loc[statement['业务名称'].isin(EXTERNAL_FLOWS), ['date', '发生金额']]
+        diff = check_bank_flows(flows.rename(columns={'发生金额': 'amount'}), load_bank_flows(args.bank))
+        print('外部资金流与银行流水一致' if diff.empty else f"外部资金流与银行流水不一致：\n{diff.to_string()}")
+
+    last = daily.iloc[-1]
+    print(f"期末净值 {last['净值']:.2f}，累计净转入 {daily['外部资金流'].sum():.2f}")
+    print(f"时间加权收益率 {last['累计收益率']:.2%}，最大回撤 {daily['回撤'].min():.2%}（{daily['回撤'].idxmin():%Y-%m-%d}）")
+    print('每日净值已写入', args.output)
+
+
+if __name__ == '__main__':
+    main()
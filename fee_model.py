@@ -0,0 +1,221 @@
+"""
+交易费用模型（按表计算，对数组向量化）
+
+费率表 FEE_TABLE 根据 202506对账单.csv 中的实际扣费反推：
+  A股股票：佣金万2.354（2025-02 起万1.5），最低5元；卖出印花税0.05%；沪市过户费0.001%
+  场内ETF：佣金万2.5（2025-02 起万1.5），最低5元；债券ETF万0.5无最低；货币ETF免佣
+  可转债：沪市万5、深市千1，最低1元
+  港股通：佣金0.06%，最低5元；印花税0.1%双边（不足1港元按1港元）；
+          过户费(股份交收费)0.002%，最低2港元最高100港元；
+          交易所清算费 = 交易费0.00565% + 交易征费0.0027% + 会财局征费0.00015% + 换汇尾差
+港股通费用按港元计算后用对账单备注中的汇率折算成人民币
+用 verify_statement() 可以逐笔核对对账单
+"""
+import numpy as np
+import pandas as pd
+
+# 每一类证券的费率；start 为生效日期（含），同一类别按日期取最近的一条
+FEE_TABLE = [
+    # category,  start,      commission, min_commission, stamp_sell, stamp_buy, transfer
+    ('stock_sh', '19000101', 0.0002354, 5.0, 0.0005, 0.0, 0.00001),
+    ('stock_sh', '20250201', 0.00015, 5.0, 0.0005, 0.0, 0.00001),
+    ('stock_sz', '19000101', 0.0002354, 5.0, 0.0005, 0.0, 0.0),
+    ('stock_sz', '20250201', 0.00015, 5.0, 0.0005, 0.0, 0.0),
+    ('etf', '19000101', 0.00025, 5.0, 0.0, 0.0, 0.0),
+    ('etf', '20250201', 0.00015, 5.0, 0.0, 0.0, 0.0),
+    ('bond_etf', '19000101', 0.00005, 0.0, 0.0, 0.0, 0.0),
+    ('money_etf', '19000101', 0.0, 0.0, 0.0, 0.0, 0.0),
+    ('cbond_sh', '19000101', 0.0005, 1.0, 0.0, 0.0, 0.0),
+    ('cbond_sz', '19000101', 0.001, 1.0, 0.0, 0.0, 0.0),
+    ('hk', '19000101', 0.0006, 5.0, 0.001, 0.001, 0.00002),
+]
+FEE_COLUMNS = ['commission', 'min_commission', 'stamp_sell', 'stamp_buy', 'transfer']
+
+# 港股通的港元费用（费率, 最低, 最高）
+HK_SETTLEMENT = (0.00002, 2.0, 100.0)
+HK_TRADING_FEE = 0.0000565
+HK_SFC_LEVY = 0.000027
+HK_AFRC_LEVY = 0.0000015
+HK_FX_SPREAD = 0.03  # 换汇尾差的估计值（人民币）
+HK_DEFAULT_RATE = 0.93
+
+# 货币ETF代码
+MONEY_ETFS = ('511990', '511880', '511660', '511690', '159001')
+
+# 对账单中的交易市场名称
+MARKET_NAMES = {'上海': 'SH', '深圳': 'SZ', '沪HK': 'HK', '深HK': 'HK'}
+
+FX_PATTERN = r'汇率[:：](\d+\.?\d*)'
+
+_rules = pd.DataFrame(FEE_TABLE, columns=['category', 'start'] + FEE_COLUMNS)
+_rules['start'] = pd.to_datetime(_rules['start'])
+_rules = _rules.sort_values(['category', 'start']).reset_index(drop=True)
+
+
+def _round2(x):
+    """四舍五入到分"""
+    return np.floor(np.asarray(x, dtype='f8') * 100 + 0.5) / 100
+
+
+def _to_dates(dates, n):
+    """YYYYMMDD 字符串或日期 -> datetime64 数组；为空时取最新费率"""
+    if dates is None:
+        return np.full(n, np.datetime64('2100-01-01', 'ns'))
+    d = pd.Series(dates)
+    if not pd.api.types.is_datetime64_any_dtype(d):
+        d = pd.to_datetime(d.astype(str).str.replace('-', '').str[:8], format='%Y%m%d')
+    return d.to_numpy(dtype='M8[ns]')
+
+
+def classify(codes, markets):
+    """
+    按代码前缀和市场分类，返回类别数组
+    markets 可以是 SH/SZ/HK，也可以是对账单中的 上海/深圳/沪HK
+    """
+    codes = pd.Series(codes, dtype=str).str.zfill(6).to_numpy()
+    markets = pd.Series(markets, dtype=str).map(lambda m: MARKET_NAMES.get(m, m)).to_numpy()
+    head2 = np.array([c[:2] for c in codes])
+    head3 = np.array([c[:3] for c in codes])
+    sh, sz = markets == 'SH', markets == 'SZ'
+    conditions = [
+        markets == 'HK',
+        np.isin(codes, MONEY_ETFS),
+        sh & (head3 == '511'),
+        sh & np.isin(head2, ['51', '56', '58']),
+        sz & (head2 == '15'),
+        sh & (head2 == '11'),
+        sz & (head2 == '12'),
+        sh,
+    ]
+    choices = ['hk', 'money_etf', 'bond_etf', 'etf', 'etf', 'cbond_sh', 'cbond_sz', 'stock_sh']
+    return np.select(conditions, choices, default='stock_sz')
+
+
+def rule_params(categories, dates=None):
+    """按类别和日期查出费率，返回 {费率名: 数组}"""
+    categories = np.asarray(categories)
+    n = len(categories)
+    dates = _to_dates(dates, n)
+    out = {col: np.zeros(n) for col in FEE_COLUMNS}
+    for category, rules in _rules.groupby('category'):
+        mask = categories == category
+        if not mask.any():
+            continue
+        idx = np.searchsorted(rules['start'].to_numpy(), dates[mask], side='right') - 1
+        idx = np.clip(idx, 0, len(rules) - 1)
+        for col in FEE_COLUMNS:
+            out[col][mask] = rules[col].to_numpy()[idx]
+    return out
+
+
+def _fx_rates(fx_rates, n):
+    fx = np.full(n, HK_DEFAULT_RATE) if fx_rates is None else np.asarray(fx_rates, dtype='f8')
+    return np.where(np.isnan(fx), HK_DEFAULT_RATE, fx)
+
+
+def _fee_parts(amounts, is_sell, p, hk, fx):
+    """
+    按已经查好的费率计算各项费用（纯 NumPy），返回 (手续费, 印花税, 过户费, 交易所清算费)
+    amounts 为非负成交金额；p、hk、fx 与 amounts 可以广播
+    """
+    commission = np.where(amounts > 0, np.maximum(_round2(amounts * p['commission']), p['min_commission']), 0.0)
+    stamp_rate = np.where(is_sell, p['stamp_sell'], p['stamp_buy'])
+    stamp = _round2(amounts * stamp_rate)
+    transfer = _round2(amounts * p['transfer'])
+    clearing = np.zeros(np.shape(amounts))
+
+    if np.any(hk):
+        hkd = amounts / fx
+        # 港股印花税不足1港元按1港元计
+        hk_stamp = _round2(np.ceil(hkd * stamp_rate - 1e-9) * fx)
+        rate, low, high = HK_SETTLEMENT
+        hk_transfer = _round2(np.clip(hkd * rate, low, high) * fx)
+        hk_clearing = (_round2(hkd * HK_TRADING_FEE * fx) + _round2(hkd * HK_SFC_LEVY * fx)
+                       + _round2(hkd * HK_AFRC_LEVY * fx) + HK_FX_SPREAD)
+        stamp = np.where(hk, hk_stamp, stamp)
+        transfer = np.where(hk, hk_transfer, transfer)
+        clearing = np.where(hk, hk_clearing, clearing)
+    return commission, stamp, transfer, _round2(clearing)
+
+
+def compute_fees(codes, markets, amounts, is_sell, dates=None, fx_rates=None):
+    """
+    批量计算费用（人民币）
+    amounts: 成交金额（人民币，港股通为折算后的金额）
+    is_sell: 布尔数组；dates: YYYYMMDD 或日期；fx_rates: 港股通汇率（港元->人民币）
+    返回 DataFrame，列名与对账单一致：手续费、印花税、过户费、交易所清算费、附加费、合计
+    """
+    amounts = np.abs(np.asarray(amounts, dtype='f8'))
+    is_sell = np.asarray(is_sell, dtype=bool)
+    categories = classify(codes, markets)
+    p = rule_params(categories, dates)
+    hk = categories == 'hk'
+    fx = _fx_rates(fx_rates, len(amounts)) if hk.any() else None
+    commission, stamp, transfer, clearing = _fee_parts(amounts, is_sell, p, hk, fx)
+
+    fees = pd.DataFrame({
+        '手续费': commission,
+        '印花税': stamp,
+        '过户费': transfer,
+        '交易所清算费': clearing,
+        '附加费': 0.0,
+    })
+    fees['合计'] = fees.sum(axis=1)
+    return fees
+
+
+def make_fee_fn(code, market, date=None, fx_rate=None):
+    """
+    给回测引擎用的费用函数：fee_fn(amounts, is_sell) -> 费用数组
+    code/market 可以是单个值，也可以是每只股票一个值（与 amounts 的最后一维对应）
+    费率、类别和汇率只在这里查一次，fee_fn 里只做 NumPy 运算（回测、模拟盘每根K线都会调用）
+    成交金额为 0 的位置费用为 0
+    """
+    codes = np.atleast_1d(np.asarray(code, dtype=str))
+    markets = np.broadcast_to(np.asarray(market, dtype=str), codes.shape)
+    categories = classify(codes, markets)
+    p = rule_params(categories, [date] * len(codes) if date else None)
+    hk = categories == 'hk'
+    fx = _fx_rates(None if fx_rate is None else np.full(len(codes), fx_rate), len(codes))
+
+    def fee_fn(amounts, is_sell):
+        amounts = np.abs(np.nan_to_num(np.asarray(amounts, dtype='f8')))
+        total = sum(_fee_parts(amounts, is_sell, p, hk, fx))
+        return np.where(amounts > 0, total, 0.0)
+
+    fee_fn.categories = categories
+    return fee_fn
+
+
+def verify_statement(trade_file='202506对账单.csv', tolerance=0.02):
+    """
+    用费用模型重新计算对账单里每一笔证券买卖的费用并与实际扣费比较
+    返回逐笔比较结果，打印每类证券、每项费用的吻合率
+    """
+    raw = pd.read_csv(trade_file, dtype=str)
+    raw = raw[raw['业务名称'].isin(['证券买入', '证券卖出'])].reset_index(drop=True)
+    fee_cols = ['手续费', '印花税', '过户费', '交易所清算费', '附加费']
+    for col in ['成交金额'] + fee_cols:
+        raw[col] = pd.to_numeric(raw[col], errors='coerce').fillna(0)
+    fx = pd.to_numeric(raw['备注'].str.extract(FX_PATTERN)[0], errors='coerce')
+    pred = compute_fees(raw['证券代码'], raw['交易市场'], raw['成交金额'],
+                        raw['业务名称'] == '证券卖出', raw['发生日期'], fx)
+    result = raw[['发生日期', '证券代码', '证券名称', '业务名称', '交易市场', '成交金额']].copy()
+    result['类别'] = classify(raw['证券代码'], raw['交易市场'])
+    ok = pd.Series(True, index=raw.index)
+    for col in fee_cols:
+        result[col] = raw[col]
+        result[f'{col}_模型'] = pred[col]
+        diff = (raw[col] - pred[col]).abs() <= tolerance + 1e-9
+        result[f'{col}_吻合'] = diff
+        ok &= diff
+    result['全部吻合'] = ok
+    summary = result.groupby('类别')[[f'{col}_吻合' for col in fee_cols] + ['全部吻合']].mean()
+    summary.insert(0, '笔数', result.groupby('类别').size())
+    print(summary.round(3).to_string())
+    print(f"共 {len(result)} 笔，全部费用吻合 {ok.mean():.1%}")
+    return result
+
+
+if __name__ == '__main__':
+    verify_statement()
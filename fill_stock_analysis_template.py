@@ -1,74 +1,102 @@
-import pandas as pd
 import re
+import argparse
+import pandas as pd
 
 # 文件路径
 input_file = '20250612/历史成交505-612.csv'
 output_file = '股票交易分析模板.csv'
 
-# 读取原始成交数据
-raw = pd.read_csv(input_file, dtype=str)
-
 # 只保留证券买入和证券卖出
-raw = raw[(raw['买卖标志'] == '证券买入') | (raw['买卖标志'] == '证券卖出')]
-
-# 结果列表
-results = []
-
-# 费用提取函数
-def extract_fee(text, key):
-    if pd.isna(text):
-        return 0.0
-    # 交易费、印花税等格式如: 交易费:1.29;印花税:0.61
-    match = re.search(rf'{key}[：:](\d+\.?\d*)', text)
-    if match:
-        return float(match.group(1))
-    return 0.0
-
-def extract_multiple_fees(text, keys):
-    total = 0.0
-    for key in keys:
-        total += extract_fee(text, key)
-    return total
-
-for _, row in raw.iterrows():
-    code = row['证券代码']
-    name = row['证券名称']
-    date = row['成交日期']
-    trade_type = row['买卖标志']
-    price = row['成交价格']
-    qty = row['成交数量']
-    amount = row['成交金额']
-    remark = row['备注'] if '备注' in row else ''
-    clear_amt = row['清算金额'] if '清算金额' in row else ''
-
-    # 提取手续费和印花税
-    fee = extract_multiple_fees(remark, ['交易费', '交易征费', '会财局征费', '换汇尾差'])
-    stamp = extract_fee(remark, '印花税')
-    # 有些买入/卖出没有备注费用，默认0
-    fee = float(fee)
-    stamp = float(stamp)
-    total_fee = fee + stamp
-
-    # 计算净收益
-    try:
-        clear_amt_f = float(clear_amt)
-        amount_f = float(amount)
-    except:
-        clear_amt_f = 0.0
-        amount_f = 0.0
-    if trade_type == '证券卖出':
-        net = clear_amt_f - amount_f
-    else:
-        net = -total_fee
-
-    results.append([
-        code, name, date, trade_type, price, qty, amount,
-        f'{fee:.2f}', f'{stamp:.2f}', f'{total_fee:.2f}', f'{net:.2f}'
-    ])
-
-# 写入模板
-header = ['股票代码','股票名称','交易日期','交易类型','交易价格','交易数量','交易金额','手续费','印花税','交易费用合计','净收益']
-df_out = pd.DataFrame(results, columns=header)
-df_out.to_csv(output_file, index=False, encoding='utf-8-sig')
-
-print('已完成数据提取与转换，结果已写入', output_file) 
\ No newline at end of file
+TRADE_TYPES = ['证券买入', '证券卖出']
+
+# 备注中的费用，格式如: 交易费:1.29;交易征费:0.61;印花税:0.61
+FEE_KEYS = ['交易费', '交易征费', '会财局征费', '换汇尾差']
+STAMP_KEY = '印花税'
+FEE_PATTERN = re.compile(rf"(?P<key>{'|'.join(FEE_KEYS + [STAMP_KEY])})[：:](?P<value>\d+\.?\d*)")
+
+# 需要读取的列和数值列
+USE_COLUMNS = ['成交日期', '证券代码', '证券名称', '买卖标志', '成交价格', '成交数量', '成交金额', '备注', '清算金额']
+NUMERIC_COLUMNS = ['成交价格', '成交数量', '成交金额', '清算金额']
+
+header = ['股票代码', '股票名称', '交易日期', '交易类型', '交易价格', '交易数量', '交易金额', '手续费', '印花税', '交易费用合计', '净收益']
+
+
+def parse_fees(remark):
+    """
+    一次正则扫描解析整列备注，返回每个费用项一列（float，没有的为 0）
+    同一费用项出现多次时取第一次，与逐行 re.search 的结果一致
+    """
+    keys = FEE_KEYS + [STAMP_KEY]
+    found = remark.str.extractall(FEE_PATTERN)
+    if found.empty:
+        return pd.DataFrame(0.0, index=remark.index, columns=keys)
+    found['value'] = found['value'].astype('float64')
+    fees = found.groupby([pd.Grouper(level=0), 'key'])['value'].first().unstack()
+    return fees.reindex(index=remark.index, columns=keys).fillna(0.0)
+
+
+def parse_chunk(raw):
+    """把一块历史成交数据转换成分析模板的格式，数值列为 float/int 类型"""
+    raw = raw[raw['买卖标志'].isin(TRADE_TYPES)]
+    for col in USE_COLUMNS:
+        if col not in raw:
+            raw = raw.assign(**{col: None})
+    numbers = raw[NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce').astype('float64')
+
+    # 提取手续费和印花税，有些买入/卖出没有备注费用，默认0
+    fees = parse_fees(raw['备注'].fillna('').astype(str))
+    fee = fees[FEE_KEYS].sum(axis=1).round(2)
+    stamp = fees[STAMP_KEY].round(2)
+    total_fee = (fee + stamp).round(2)
+
+    # 计算净收益：卖出为清算金额 - 成交金额，买入为负的交易费用；金额缺失时按 0 计
+    valid = numbers['清算金额'].notna() & numbers['成交金额'].notna()
+    sell_net = (numbers['清算金额'] - numbers['成交金额']).where(valid, 0.0)
+    net = sell_net.where(raw['买卖标志'] == '证券卖出', -total_fee).round(2) + 0.0  # 避免输出 -0.0
+
+    return pd.DataFrame({
+        '股票代码': raw['证券代码'],
+        '股票名称': raw['证券名称'],
+        '交易日期': raw['成交日期'],
+        '交易类型': raw['买卖标志'],
+        '交易价格': numbers['成交价格'],
+        '交易数量': numbers['成交数量'].astype('Int64'),
+        '交易金额': numbers['成交金额'],
+        '手续费': fee,
+        '印花税': stamp,
+        '交易费用合计': total_fee,
+        '净收益': net,
+    }, columns=header)
+
+
+def read_trades(path, chunksize=100000):
+    """分块读取历史成交文件，逐块产出转换后的结果，内存占用与文件大小无关"""
+    reader = pd.read_csv(path, dtype=str, usecols=lambda c: c in USE_COLUMNS, chunksize=chunksize)
+    for chunk in reader:
+        yield parse_chunk(chunk)
+
+
+def convert(input_path, output_path, chunksize=100000):
+    """流式转换：每处理一块就追加写入输出文件，返回总行数"""
+    rows = 0
+    for i, part in enumerate(read_trades(input_path, chunksize)):
+        part.to_csv(output_path, mode='w' if i == 0 else 'a', header=i == 0, index=False,
+                    encoding='utf-8-sig' if i == 0 else 'utf-8')
+        rows += len(part)
+    if rows == 0:
+        pd.DataFrame(columns=header).to_csv(output_path, index=False, encoding='utf-8-sig')
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="历史成交 -> 股票交易分析模板")
+    parser.add_argument('input', nargs='?', default=input_file)
+    parser.add_argument('output', nargs='?', default=output_file)
+    parser.add_argument('--chunksize', type=int, default=100000, help="每次读取的行数")
+    args = parser.parse_args()
+    rows = convert(args.input, args.output, args.chunksize)
+    print(f'已完成数据提取与转换，共 {rows} 笔，结果已写入', args.output)
+
+
+if __name__ == '__main__':
+    main()
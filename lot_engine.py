@@ -0,0 +1,171 @@
+"""
+持仓批次（lot）引擎：按时间顺序回放对账单中的买卖记录，计算每笔卖出的已实现盈亏
+
+同时给出两种成本口径：
+  先进先出（FIFO）：卖出时从最早买入的批次开始扣减
+  移动平均成本：卖出时按当前持仓的平均成本结转
+买入成本包含买入时的全部费用，卖出收入扣除卖出时的全部费用
+新股入帐（可转债、新股中签）按成交价格作为成本入账
+未平仓批次用 array 连续存储，每只证券一个队列；按 (资金帐号, 证券代码) 建哈希索引
+"""
+from array import array
+import numpy as np
+import pandas as pd
+
+BUY_TYPES = ['证券买入', '新股入帐']
+SELL_TYPES = ['证券卖出']
+FEE_COLUMNS = ['手续费', '印花税', '过户费', '交易所清算费', '附加费']
+
+TRADE_COLUMNS = ['发生日期', '成交时间', '资金帐号', '证券代码', '证券名称', '业务名称',
+                 '成交价格', '成交数量', '成交金额', '股份余额', '交易市场', '备注'] + FEE_COLUMNS
+
+
+class LotQueue:
+    """单只证券的未平仓批次：数量和每股成本（含费用）两个数组，head 之前的批次已平仓"""
+
+    __slots__ = ('qty', 'price', 'head', 'total_qty', 'total_cost')
+
+    def __init__(self):
+        self.qty = array('d')
+        self.price = array('d')
+        self.head = 0
+        self.total_qty = 0.0
+        self.total_cost = 0.0
+
+    def push(self, qty, cost):
+        self.qty.append(qty)
+        self.price.append(cost / qty)
+        self.total_qty += qty
+        self.total_cost += cost
+
+    def pop(self, qty):
+        """按先进先出扣减 qty 股，返回 (实际扣减数量, 扣减的成本)"""
+        matched = cost = 0.0
+        qtys, prices, i = self.qty, self.price, self.head
+        while qty > matched and i < len(qtys):
+            take = min(qtys[i], qty - matched)
+            matched += take
+            cost += take * prices[i]
+            qtys[i] -= take
+            if qtys[i] <= 0:
+                i += 1
+        self.head = i
+        # 已平仓的批次超过一半时整体前移，数组长度只与未平仓批次数有关
+        if i > 32 and i * 2 > len(qtys):
+            del qtys[:i]
+            del prices[:i]
+            self.head = 0
+        self.total_qty -= matched
+        self.total_cost = self.total_cost - cost if len(self) else 0.0
+        return matched, cost
+
+    def __len__(self):
+        return len(self.qty) - self.head
+
+
+class LotEngine:
+    """多账户、多证券的批次引擎"""
+
+    def __init__(self):
+        self.lots = {}  # (资金帐号, 证券代码) -> LotQueue，FIFO 口径
+        self.average = {}  # (资金帐号, 证券代码) -> [数量, 成本]，移动平均口径
+
+    def buy(self, key, qty, cost):
+        queue = self.lots.get(key)
+        if queue is None:
+            queue = self.lots[key] = LotQueue()
+            self.average[key] = [0.0, 0.0]
+        queue.push(qty, cost)
+        avg = self.average[key]
+        avg[0] += qty
+        avg[1] += cost
+
+    def sell(self, key, qty, proceeds):
+        """
+        卖出 qty 股，proceeds 为扣除费用后的净收入
+        返回 (FIFO 已实现盈亏, 平均成本已实现盈亏, 未匹配数量)
+        卖出数量超过持仓时（对账单开始前已有持仓），超出部分成本未知，不计入盈亏
+        """
+        queue = self.lots.get(key)
+        if queue is None:
+            return 0.0, 0.0, qty
+        matched, fifo_cost = queue.pop(qty)
+        avg = self.average[key]
+        avg_cost = avg[1] / avg[0] * matched if avg[0] > 0 else 0.0
+        avg[0] -= matched
+        avg[1] = avg[1] - avg_cost if avg[0] > 0 else 0.0
+        matched_proceeds = proceeds * matched / qty if qty else 0.0
+        return matched_proceeds - fifo_cost, matched_proceeds - avg_cost, qty - matched
+
+    def position(self, key):
+        """返回 (持仓数量, FIFO 剩余成本, 平均法剩余成本)"""
+        queue = self.lots.get(key)
+        if queue is None:
+            return 0.0, 0.0, 0.0
+        return queue.total_qty, queue.total_cost, self.average[key][1]
+
+    def positions(self):
+        rows = [(account, code) + self.position((account, code)) for account, code in self.lots]
+        return pd.DataFrame(rows, columns=['资金帐号', '证券代码', '持仓数量', '持仓成本_FIFO', '持仓成本_均价'])
+
+
+def _seconds(times):
+    """'9:08:44' -> 当天秒数"""
+    parts = times.fillna('0:0:0').str.split(':', expand=True).reindex(columns=[0, 1, 2]).fillna('0')
+    parts = parts.apply(pd.to_numeric, errors='coerce').fillna(0).astype('int64')
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def load_trades(trade_file='202506对账单.csv', trade_types=None):
+    """读取对账单中的买卖记录，转换数值列并按发生日期、成交时间排序（同一时间保持原顺序）"""
+    return prepare_trades(pd.read_csv(trade_file, dtype=str, usecols=lambda c: c in TRADE_COLUMNS), trade_types)
+
+
+def prepare_trades(raw, trade_types=None):
+    """从已经读入的对账单中取出买卖记录，处理同 load_trades"""
+    trade_types = trade_types or BUY_TYPES + SELL_TYPES
+    raw = raw.loc[raw['业务名称'].isin(trade_types), [c for c in TRADE_COLUMNS if c in raw]].copy()
+    if '资金帐号' not in raw:
+        raw['资金帐号'] = ''
+    raw['资金帐号'] = raw['资金帐号'].fillna('')
+    for col in ['成交价格', '成交数量', '成交金额', '股份余额'] + FEE_COLUMNS:
+        raw[col] = pd.to_numeric(raw[col], errors='coerce').fillna(0)
+    # 新股入帐的成交金额为 0，按成交价格 × 数量入账
+    deposit = (raw['业务名称'] == '新股入帐') & (raw['成交金额'] == 0)
+    raw.loc[deposit, '成交金额'] = raw.loc[deposit, '成交价格'] * raw.loc[deposit, '成交数量'].abs()
+    raw['费用'] = raw[FEE_COLUMNS].sum(axis=1)
+    raw['_seconds'] = _seconds(raw['成交时间'])
+    raw = raw.sort_values(['发生日期', '_seconds'], kind='mergesort').drop(columns='_seconds')
+    return raw.reset_index(drop=True)
+
+
+def replay(trades, engine=None):
+    """
+    按顺序回放买卖记录，返回逐笔明细（在 trades 上增加列）：
+      已实现盈亏_FIFO、已实现盈亏_均价、未匹配数量、持仓数量、持仓成本_FIFO、持仓成本_均价
+    engine 可以传入已有的 LotEngine 继续回放（增量处理新的对账单）
+    """
+    engine = engine or LotEngine()
+    n = len(trades)
+    out = {name: np.zeros(n) for name in ['已实现盈亏_FIFO', '已实现盈亏_均价', '未匹配数量',
+                                          '持仓数量', '持仓成本_FIFO', '持仓成本_均价']}
+    is_sell = trades['业务名称'].isin(SELL_TYPES).to_numpy()
+    qty = trades['成交数量'].abs().to_numpy(dtype='f8')
+    amount = trades['成交金额'].to_numpy(dtype='f8')
+    fees = trades['费用'].to_numpy(dtype='f8')
+    keys = zip(trades['资金帐号'], trades['证券代码'])
+    for i, key in enumerate(keys):
+        if qty[i] <= 0:
+            continue
+        if is_sell[i]:
+            fifo, avg, unmatched = engine.sell(key, qty[i], amount[i] - fees[i])
+            out['已实现盈亏_FIFO'][i] = fifo
+            out['已实现盈亏_均价'][i] = avg
+            out['未匹配数量'][i] = unmatched
+        else:
+            engine.buy(key, qty[i], amount[i] + fees[i])
+        out['持仓数量'][i], out['持仓成本_FIFO'][i], out['持仓成本_均价'][i] = engine.position(key)
+    result = trades.copy()
+    for name, values in out.items():
+        result[name] = values
+    return result, engine
@@ -0,0 +1,161 @@
+"""
+根据成交记录生成 TradingView Pine Script 买卖点标记脚本，每只证券一个 .pine 文件
+
+同一天的买入、卖出分别汇总：数量合计，价格取成交量加权均价（VWAP，按成交价格计算，港股为港币）
+Pine 的限制：
+  字符串常量最长 4096 字符 -> 每天一条 "日期,买量,买价,卖量,卖价" 记录，按 PINE_MAX_STRING 打包成多个字符串，
+                             脚本第一根K线时 str.split 解码进数组
+  标签最多 500 个         -> 三角形标记用 plotshape（没有数量限制），数量和价格的文字标签只保留最近 500 个
+  脚本长度                -> 每个脚本最多 MAX_DAYS_PER_SCRIPT 个交易日，超过时按日期拆成 _part2、_part3 ...
+"""
+import os
+import argparse
+import pandas as pd
+from lot_engine import prepare_trades, BUY_TYPES, SELL_TYPES
+from statement_store import STATEMENT_COLUMNS
+
+trade_file = '202506对账单.csv'
+PINE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pine')
+
+PINE_MAX_STRING = 4000
+PINE_MAX_LABELS = 500
+MAX_DAYS_PER_SCRIPT = 2500
+
+# 交易市场 -> TradingView 交易所前缀
+EXCHANGES = {'上海': 'SSE', '深圳': 'SZSE', '沪HK': 'HKEX', '深HK': 'HKEX'}
+
+
+def load_records(path=trade_file, store=False):
+    """读取对账单（兼容没有表头的 核电.csv），返回买卖记录"""
+    if store:
+        from statement_store import StatementStore
+        raw = StatementStore().load('对账单')
+    else:
+        raw = pd.read_csv(path, dtype=str)
+        if '业务名称' not in raw:
+            raw = pd.read_csv(path, dtype=str, header=None, names=STATEMENT_COLUMNS)
+    return prepare_trades(raw, BUY_TYPES + SELL_TYPES)
+
+
+def daily_summary(trades):
+    """按 (证券代码, 日期) 汇总：买量、买入均价、卖量、卖出均价"""
+    trades = trades[trades['成交数量'] != 0]
+    side = trades['业务名称'].isin(SELL_TYPES).map({False: 'buy', True: 'sell'})
+    qty = trades['成交数量'].abs()
+    df = pd.DataFrame({'code': trades['证券代码'], 'date': trades['发生日期'].astype('int64'), 'side': side,
+                       'qty': qty, 'value': qty * trades['成交价格']})
+    sums = df.pivot_table(index=['code', 'date'], columns='side', values=['qty', 'value'], aggfunc='sum',
+                          fill_value=0)
+    sums = sums.reindex(columns=pd.MultiIndex.from_product([['qty', 'value'], ['buy', 'sell']]), fill_value=0)
+    out = pd.DataFrame(index=sums.index)
+    for s in ['buy', 'sell']:
+        out[f'{s}_qty'] = sums[('qty', s)]
+        out[f'{s}_vwap'] = (sums[('value', s)] / sums[('qty', s)]).where(sums[('qty', s)] > 0, 0.0).round(4)
+    return out.reset_index()
+
+
+def _num(v):
+    """紧凑的数字格式：整数不带小数点，去掉末尾的 0"""
+    return f"{v:.4f}".rstrip('0').rstrip('.')
+
+
+def encode(days):
+    """把每日汇总编码成若干个不超过 PINE_MAX_STRING 的字符串"""
+    records = [f"{d},{_num(bq)},{_num(bp)},{_num(sq)},{_num(sp)}"
+               for d, bq, bp, sq, sp in zip(days['date'], days['buy_qty'], days['buy_vwap'],
+                                            days['sell_qty'], days['sell_vwap'])]
+    chunks, current = [], ''
+    for record in records:
+        if current and len(current) + 1 + len(record) > PINE_MAX_STRING:
+            chunks.append(current)
+            current = ''
+        current = f"{current};{record}" if current else record
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def render(code, name, exchange, days, part=None):
+    """生成一个脚本的源码"""
+    title = f"{name} 买卖点标记（每日数量和均价）" + (f" {part}" if part else '')
+    chunks = ',\n     '.join(f'"{chunk}"' for chunk in encode(days))
+    return f'''//@version=6
+// 自动生成，请不要手工修改；重新生成：python pine_script.py {code}
+// 图表：{exchange}:{code.lstrip('0') if exchange == 'HKEX' else code}，日K线
+// 区间：{days['date'].iloc[0]} - {days['date'].iloc[-1]}，{len(days)} 个交易日
+indicator("{title}", overlay=true, max_labels_count={PINE_MAX_LABELS})
+
+var dates      = array.new<int>()
+var buy_qtys   = array.new<float>()
+var buy_prices = array.new<float>()
+var sell_qtys  = array.new<float>()
+var sell_prices = array.new<float>()
+
+// 每条记录：日期(YYYYMMDD),买入数量,买入均价,卖出数量,卖出均价；记录之间用 ; 分隔
+var data = array.from(
+     {chunks})
+
+if barstate.isfirst
+    for chunk in data
+        for record in str.split(chunk, ";")
+            fields = str.split(record, ",")
+            array.push(dates, int(str.tonumber(array.get(fields, 0))))
+            array.push(buy_qtys, str.tonumber(array.get(fields, 1)))
+            array.push(buy_prices, str.tonumber(array.get(fields, 2)))
+            array.push(sell_qtys, str.tonumber(array.get(fields, 3)))
+            array.push(sell_prices, str.tonumber(array.get(fields, 4)))
+
+day = year * 10000 + month * 100 + dayofmonth
+i = array.binary_search(dates, day)
+bought = i >= 0 and array.get(buy_qtys, i) > 0
+sold = i >= 0 and array.get(sell_qtys, i) > 0
+
+plotshape(bought, title="买入", style=shape.triangleup, location=location.belowbar, color=color.green, size=size.small)
+plotshape(sold, title="卖出", style=shape.triangledown, location=location.abovebar, color=color.red, size=size.small)
+
+if bought
+    label.new(bar_index, low, "买 " + str.tostring(array.get(buy_qtys, i)) + "\\n@" + str.tostring(array.get(buy_prices, i)),
+         style=label.style_label_up, color=color.new(color.green, 20), textcolor=color.white, size=size.small)
+if sold
+    label.new(bar_index, high, "卖 " + str.tostring(array.get(sell_qtys, i)) + "\\n@" + str.tostring(array.get(sell_prices, i)),
+         style=label.style_label_down, color=color.new(color.red, 20), textcolor=color.white, size=size.small)
+'''
+
+
+def generate(trades, codes=None, output_dir=PINE_ROOT):
+    """为每只证券生成脚本，返回写入的文件列表"""
+    summary = daily_summary(trades)
+    names = trades.groupby('证券代码')['证券名称'].last()
+    markets = trades.groupby('证券代码')['交易市场'].last() if '交易市场' in trades else pd.Series(dtype=str)
+    if codes:
+        summary = summary[summary['code'].isin([str(c) for c in codes])]
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    for code, days in summary.groupby('code', sort=True):
+        days = days.sort_values('date').reset_index(drop=True)
+        exchange = EXCHANGES.get(markets.get(code), 'SSE' if code.startswith(('5', '6', '9')) else 'SZSE')
+        parts = [days.iloc[i:i + MAX_DAYS_PER_SCRIPT] for i in range(0, len(days), MAX_DAYS_PER_SCRIPT)]
+        for n, part in enumerate(parts, 1):
+            suffix = f"_part{n}" if len(parts) > 1 else ''
+            path = os.path.join(output_dir, f"{code}{suffix}.pine")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(render(code, names.get(code, code), exchange, part.reset_index(drop=True),
+                               f"{n}/{len(parts)}" if len(parts) > 1 else None))
+            written.append(path)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="成交记录 -> TradingView 买卖点标记脚本（每只证券一个）")
+    parser.add_argument('codes', nargs='*', help="证券代码，为空时生成全部")
+    parser.add_argument('--statement', default=trade_file, help="对账单文件（也可以是没有表头的 核电.csv）")
+    parser.add_argument('--store', action='store_true', help="使用 statement_store 归档的全部对账单")
+    parser.add_argument('--output-dir', default=PINE_ROOT)
+    args = parser.parse_args()
+
+    written = generate(load_records(args.statement, args.store), args.codes, args.output_dir)
+    print(f"已生成 {len(written)} 个脚本，保存在 {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
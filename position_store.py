@@ -0,0 +1,260 @@
+"""
+持仓快照仓库：每个 (日期, 资金帐号, 来源) 一份快照，写入时生成新版本，旧版本保留
+
+来源：
+  broker  券商导出的持仓表（613.csv、tableCZ.csv、股票持仓模板.csv），utf-8-sig / GBK 自动识别
+  ledger  按对账单回放买卖记录（lot_engine）得到的持仓，成本为 FIFO 剩余批次成本（含费用）
+快照是 NumPy 结构化数组（SNAPSHOT_DTYPE），读取后按证券代码建哈希索引，get(code) 为 O(1)
+
+仓库结构（positions/ 目录）：
+  {资金帐号}/{YYYYMMDD}_{来源}_v{版本}.npy
+  index.json  {资金帐号: {日期: {来源: [{version, file, rows, sha1, created}]}}}
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from lot_engine import prepare_trades, replay
+
+POSITION_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'positions')
+
+SNAPSHOT_DTYPE = np.dtype([
+    ('code', 'U12'),
+    ('name', 'U16'),
+    ('market', 'U8'),
+    ('qty', 'f8'),         # 参考持股 / 回放持仓数量
+    ('available', 'f8'),   # 可用股份
+    ('cost_price', 'f8'),  # 成本价
+    ('price', 'f8'),       # 当前价，回放快照为 NaN
+    ('cost', 'f8'),        # 持仓成本
+    ('value', 'f8'),       # 市值，回放快照为 NaN
+    ('pnl', 'f8'),         # 券商的浮动盈亏，原样保存，回放快照为 NaN
+    ('pnl_pct', 'f8'),     # 券商的盈亏比例(%)，原样保存，回放快照为 NaN
+])
+
+# 券商持仓表的列 -> 快照字段（股票持仓模板的旧列名也兼容）
+BROKER_COLUMNS = {
+    '证券代码': 'code', '证券名称': 'name', '交易市场': 'market', '参考持股': 'qty', '可用股份': 'available',
+    '成本价': 'cost_price', '当前价': 'price', '当前成本': 'cost', '最新市值': 'value',
+    '浮动盈亏': 'pnl', '盈亏比例(%)': 'pnl_pct',
+    '股票代码': 'code', '股票名称': 'name', '持仓数量': 'qty', '平均持仓成本': 'cost_price', '当前价格': 'price',
+    '持仓成本': 'cost', '持仓市值': 'value', '未实现收益': 'pnl', '未实现收益率': 'pnl_pct',
+}
+# 非股票/ETF类资产
+EXCLUDED_NAMES = ['标准券']
+
+
+class Snapshot:
+    """一份持仓快照：结构化数组 + 证券代码哈希索引"""
+
+    def __init__(self, records, date=None, account=None, source=None, version=None):
+        self.records = records
+        self.date, self.account, self.source, self.version = date, account, source, version
+        self.index = {code: i for i, code in enumerate(records['code'])}
+
+    def get(self, code, default=None):
+        i = self.index.get(str(code))
+        return default if i is None else self.records[i]
+
+    def qty(self, code):
+        i = self.index.get(str(code))
+        return 0.0 if i is None else float(self.records['qty'][i])
+
+    def __contains__(self, code):
+        return str(code) in self.index
+
+    def __len__(self):
+        return len(self.records)
+
+    def codes(self):
+        return list(self.index)
+
+    def to_frame(self):
+        return pd.DataFrame(self.records)
+
+
+def to_records(df):
+    """DataFrame（快照字段名）-> 结构化数组，缺少的字段补 NaN / 空字符串，按代码排序"""
+    rec = np.empty(len(df), dtype=SNAPSHOT_DTYPE)
+    for field in SNAPSHOT_DTYPE.names:
+        kind = SNAPSHOT_DTYPE[field].kind
+        if field in df:
+            rec[field] = df[field].fillna('').astype(str) if kind == 'U' else pd.to_numeric(df[field], errors='coerce')
+        else:
+            rec[field] = '' if kind == 'U' else np.nan
+    return np.sort(rec, order='code')
+
+
+def read_broker_csv(path):
+    """读取券商持仓表：utf-8-sig 失败时按 GBK 读，返回 {资金帐号: DataFrame}"""
+    for encoding in ['utf-8-sig', 'gbk']:
+        try:
+            raw = pd.read_csv(path, dtype=str, encoding=encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    raw.columns = raw.columns.str.strip()
+    account = raw['资金帐户'] if '资金帐户' in raw else pd.Series('', index=raw.index)
+    df = raw.rename(columns={k: v for k, v in BROKER_COLUMNS.items() if k in raw})
+    df = df.loc[:, ~df.columns.duplicated()]
+    df = df[~df['name'].fillna('').str.contains('|'.join(EXCLUDED_NAMES))]
+    df = df[pd.to_numeric(df['qty'], errors='coerce').fillna(0) > 0]
+    return {acc: part for acc, part in df.groupby(account.reindex(df.index).fillna(''), sort=True)}
+
+
+def ledger_positions(trades, date=None):
+    """回放 date（含）之前的买卖记录，返回 {资金帐号: DataFrame}，只保留持仓数量大于 0 的证券"""
+    if date is not None:
+        trades = trades[trades['发生日期'] <= str(date)]
+    detail, engine = replay(trades.reset_index(drop=True))
+    pos = engine.positions()
+    pos = pos[pos['持仓数量'] > 0]
+    last = detail.groupby(['资金帐号', '证券代码'])[['证券名称', '交易市场']].last()
+    pos = pos.join(last, on=['资金帐号', '证券代码'])
+    df = pd.DataFrame({'code': pos['证券代码'], 'name': pos['证券名称'], 'market': pos['交易市场'],
+                       'qty': pos['持仓数量'], 'cost': pos['持仓成本_FIFO'],
+                       'cost_price': pos['持仓成本_FIFO'] / pos['持仓数量']})
+    return {acc: part for acc, part in df.groupby(pos['资金帐号'], sort=True)}
+
+
+def cross_check(broker, ledger, tolerance=0.5):
+    """
+    按证券代码对比券商快照和回放快照的持仓数量，返回不一致的行
+    对账单开始前已有的持仓、转托管等会出现在这里
+    """
+    codes = sorted(set(broker.codes()) | set(ledger.codes()))
+    rows = []
+    for code in codes:
+        b, l = broker.qty(code), ledger.qty(code)
+        if abs(b - l) > tolerance:
+            rec = broker.get(code) if code in broker else ledger.get(code)
+            rows.append([code, rec['name'], b, l, b - l])
+    return pd.DataFrame(rows, columns=['证券代码', '证券名称', '券商持仓', '回放持仓', '差额'])
+
+
+class PositionStore:
+    def __init__(self, root=None):
+        self.root = root or POSITION_ROOT
+        os.makedirs(self.root, exist_ok=True)
+        self.index_path = os.path.join(self.root, 'index.json')
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                self.index = json.load(f)
+        self._loaded = {}
+
+    def _save_index(self):
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.index_path)
+
+    def put(self, records, date, account, source):
+        """
+        保存一份快照；与最新版本内容相同时不生成新版本
+        返回版本号
+        """
+        date, account = str(date), str(account)
+        payload = records.tobytes()
+        digest = hashlib.sha1(payload).hexdigest()
+        versions = self.index.setdefault(account, {}).setdefault(date, {}).setdefault(source, [])
+        if versions and versions[-1]['sha1'] == digest:
+            return versions[-1]['version']
+        version = versions[-1]['version'] + 1 if versions else 1
+        folder = os.path.join(self.root, account)
+        os.makedirs(folder, exist_ok=True)
+        name = f"{date}_{source}_v{version}.npy"
+        tmp = os.path.join(folder, f"{name}.{os.getpid()}.tmp")
+        with open(tmp, 'wb') as f:
+            np.save(f, records)
+        os.replace(tmp, os.path.join(folder, name))
+        versions.append({'version': version, 'file': name, 'rows': len(records), 'sha1': digest,
+                         'created': time.strftime('%Y-%m-%d %H:%M:%S')})
+        self._save_index()
+        return version
+
+    def dates(self, account=None, source='broker'):
+        accounts = [str(account)] if account else list(self.index)
+        return sorted({d for acc in accounts for d, sources in self.index.get(acc, {}).items() if source in sources})
+
+    def accounts(self):
+        return sorted(self.index)
+
+    def snapshot(self, date=None, account=None, source='broker', version=None):
+        """
+        读取 date（含）之前最近一份快照；date 为空取最新一天，version 为空取最新版本
+        account 为空且只有一个帐号时自动选择（多个帐号时用 snapshots 逐个读取）；没有快照时返回 None
+        """
+        if account is None:
+            accounts = self.accounts()
+            if len(accounts) != 1:
+                if not accounts:
+                    return None
+                raise ValueError(f"有多个资金帐号，请指定：{accounts}")
+            account = accounts[0]
+        account = str(account)
+        dates = [d for d in self.dates(account, source) if date is None or d <= str(date)]
+        if not dates:
+            return None
+        versions = self.index[account][dates[-1]][source]
+        entry = versions[-1] if version is None else next(v for v in versions if v['version'] == version)
+        key = (account, entry['file'])
+        if key not in self._loaded:
+            records = np.load(os.path.join(self.root, account, entry['file']))
+            self._loaded[key] = Snapshot(records, dates[-1], account, source, entry['version'])
+        return self._loaded[key]
+
+    def snapshots(self, date=None, source='broker'):
+        """每个资金帐号 date（含）之前最近一份快照，返回 {资金帐号: Snapshot}，没有快照的帐号不返回"""
+        result = {}
+        for account in self.accounts():
+            snap = self.snapshot(date, account, source)
+            if snap is not None:
+                result[account] = snap
+        return result
+
+    def import_broker(self, path, date):
+        """导入券商持仓表，返回 {资金帐号: 版本号}"""
+        return {account: self.put(to_records(df), date, account, 'broker')
+                for account, df in read_broker_csv(path).items()}
+
+    def import_ledger(self, trades, date):
+        """回放对账单生成 date 的持仓快照，返回 {资金帐号: 版本号}"""
+        return {account: self.put(to_records(df), date, account, 'ledger')
+                for account, df in ledger_positions(trades, date).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="持仓快照：导入券商持仓表、回放对账单生成持仓并核对")
+    parser.add_argument('files', nargs='*', default=['613.csv'], help="券商持仓表")
+    parser.add_argument('--date', default=datetime.now().strftime('%Y%m%d'), help="快照日期 YYYYMMDD，默认今天")
+    parser.add_argument('--statement', default='202506对账单.csv', help="用于回放的对账单")
+    parser.add_argument('--store', action='store_true', help="使用 statement_store 归档的全部对账单回放")
+    parser.add_argument('--root', help="仓库目录，默认 ./positions")
+    args = parser.parse_args()
+
+    store = PositionStore(args.root)
+    for path in args.files:
+        for account, version in store.import_broker(path, args.date).items():
+            print(f"{path} -> {account} {args.date} 券商快照 v{version}")
+
+    if args.store:
+        from statement_store import StatementStore
+        raw = StatementStore().load('对账单')
+    else:
+        raw = pd.read_csv(args.statement, dtype=str)
+    for account, version in store.import_ledger(prepare_trades(raw), args.date).items():
+        print(f"{args.statement if not args.store else 'statement_store'} -> {account} {args.date} 回放快照 v{version}")
+        broker = store.snapshot(args.date, account, 'broker')
+        if broker is None:
+            continue
+        diff = cross_check(broker, store.snapshot(args.date, account, 'ledger'))
+        print('持仓与对账单回放一致' if diff.empty else f"持仓与对账单回放不一致：\n{diff.to_string(index=False)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+对账单归档：扫描目录下券商导出的 .xls/.xlsx/.csv，统一格式后去重写入本地仓库
+
+券商导出的 .xls 多数其实是 GBK（GB18030）编码、制表符分隔的文本，数字列带 ="..." 包裹，这里一并处理
+支持三类导出：
+  对账单   发生日期/业务名称/发生金额/资金本次余额...（对账单*.xls）
+  交割单   发生日期/业务名称/清算金额/资金本次余额...，业务名称为 买入/卖出（table530-612.xls 等）
+  历史成交 成交日期/买卖标志/清算金额...（历史成交*.xls、table603-610.xls 等）
+都转换成对账单的列（与 202506对账单.csv 相同），另加一列 来源；三类之间的记录不互相去重
+持仓、银行流水等其他导出会跳过；列错位的行（名称截断把分隔符吞掉等）丢弃并计数
+
+仓库结构（ledger/ 目录）：
+  {来源}/{YYYYMM}.csv  按来源和月份分区，只追加
+  keys.npy             已入库记录的 64 位哈希（排序后保存），用于去重
+  manifest.json        已处理文件的大小、修改时间、sha1；文件没变就不再解析
+去重键：来源、资金帐号、发生日期、成交时间、委托编号、业务名称、证券代码、成交数量、发生金额，
+以及同一文件内相同键的出现次数（同一文件里完全相同的两行都保留，跨文件重叠的只保留一份）
+"""
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+LEDGER_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ledger')
+
+STATEMENT_COLUMNS = ['发生日期', '成交时间', '业务名称', '证券代码', '证券名称', '成交价格', '成交数量', '成交金额',
+                     '股份余额', '手续费', '印花税', '过户费', '交易所清算费', '附加费', '发生金额', '资金本次余额',
+                     '委托编号', '股东代码', '资金帐号', '币种', '备注', '交易市场']
+LEDGER_COLUMNS = STATEMENT_COLUMNS + ['来源']
+NUMERIC_COLUMNS = ['成交价格', '成交数量', '成交金额', '股份余额', '手续费', '印花税', '过户费', '交易所清算费',
+                   '附加费', '发生金额', '资金本次余额']
+KEY_COLUMNS = ['来源', '资金帐号', '发生日期', '成交时间', '委托编号', '业务名称', '证券代码', '成交数量', '发生金额']
+
+# 各类导出的列名 -> 对账单列名
+RENAMES = {
+    '对账单': {},
+    '交割单': {'清算金额': '发生金额'},
+    '历史成交': {'成交日期': '发生日期', '清算金额': '发生金额', '交易所名称': '交易市场'},
+}
+EXTENSIONS = ('.xls', '.xlsx', '.csv')
+
+
+def detect_source(columns):
+    columns = set(columns)
+    if {'发生日期', '业务名称', '资金本次余额', '发生金额'} <= columns:
+        return '对账单'
+    if {'发生日期', '业务名称', '资金本次余额', '清算金额'} <= columns:
+        return '交割单'
+    if {'成交日期', '买卖标志', '委托编号'} <= columns:
+        return '历史成交'
+    return None
+
+
+def read_export(path):
+    """读取一个导出文件，所有列按字符串返回；真正的 Excel 文件需要安装 openpyxl/xlrd"""
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    if head.startswith(b'PK') or head.startswith(b'\xd0\xcf\x11\xe0'):
+        return pd.read_excel(path, dtype=str)
+    # 券商按字节截断证券名称，GB18030 下可能出现半个汉字，替换成 \ufffd
+    for encoding, errors in [('utf-8-sig', 'strict'), ('gb18030', 'replace')]:
+        try:
+            with open(path, encoding=encoding, errors=errors) as f:
+                first = f.readline()
+            sep = '\t' if '\t' in first else ','
+            return pd.read_csv(path, dtype=str, sep=sep, encoding=encoding, encoding_errors=errors,
+                               keep_default_na=False, index_col=False)
+        except UnicodeDecodeError:
+            continue
+
+
+def normalize(raw, source):
+    """转换成对账单的列：去掉 ="..." 包裹和空白，数字统一格式，成交时间补齐为 HH:MM:SS"""
+    raw = raw.loc[:, [c for c in raw.columns if c and not str(c).startswith('Unnamed')]]
+    raw = raw.rename(columns=lambda c: str(c).strip()).rename(columns=RENAMES[source])
+    df = pd.DataFrame({col: raw[col] if col in raw else '' for col in STATEMENT_COLUMNS}, index=raw.index)
+    df = df.fillna('').astype(str).apply(lambda s: s.str.strip().str.replace(r'^="(.*)"$', r'\1', regex=True))
+    for col in NUMERIC_COLUMNS:
+        values = pd.to_numeric(df[col], errors='coerce')
+        df[col] = values.map(lambda v: '' if pd.isna(v) else f"{v:.10g}")
+    time = df['成交时间'].str.split(':', expand=True).reindex(columns=[0, 1, 2])
+    time = time.apply(pd.to_numeric, errors='coerce').fillna(0).astype('int64')
+    df['成交时间'] = (time[0].map('{:02d}'.format) + ':' + time[1].map('{:02d}'.format) + ':'
+                   + time[2].map('{:02d}'.format))
+    df['委托编号'] = df['委托编号'].str.lstrip('0')
+    df['来源'] = source
+    valid = df['发生日期'].str.fullmatch(r'\d{8}') & ~df['业务名称'].str.fullmatch(r'[\d.\-]*')
+    return df[valid].reset_index(drop=True), int((~valid).sum())
+
+
+def row_keys(df):
+    """每行的 64 位去重哈希（包含同一文件内相同键的出现次数）"""
+    occurrence = df.groupby(KEY_COLUMNS, sort=False).cumcount().astype(str)
+    return pd.util.hash_pandas_object(df[KEY_COLUMNS].assign(_n=occurrence), index=False).to_numpy()
+
+
+def parse_file(path):
+    """
+    解析单个文件，返回 (path, DataFrame 或 None, 说明)；在子进程中运行
+    任何一步出错都只跳过这个文件（异常不会抛到进程池里中断整批导入）
+    """
+    try:
+        raw = read_export(path)
+    except Exception as e:
+        return path, None, f"读取失败：{e}"
+    try:
+        source = detect_source(c.strip() for c in raw.columns.astype(str))
+        if source is None:
+            return path, None, "不是对账单或历史成交，跳过"
+        df, dropped = normalize(raw, source)
+        df['_key'] = row_keys(df)
+    except Exception as e:
+        return path, None, f"解析失败：{e}"
+    return path, df, f"{source}（丢弃错位行 {dropped}）" if dropped else source
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class StatementStore:
+    """按来源、月份分区的对账单仓库"""
+
+    def __init__(self, root=None):
+        self.root = root or LEDGER_ROOT
+        os.makedirs(self.root, exist_ok=True)
+        self.manifest_path = os.path.join(self.root, 'manifest.json')
+        self.keys_path = os.path.join(self.root, 'keys.npy')
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        self.keys = np.load(self.keys_path) if os.path.exists(self.keys_path) else np.array([], dtype='u8')
+
+    def changed_files(self, paths):
+        """大小和修改时间都没变的文件直接跳过；变了再比较 sha1"""
+        changed = []
+        for path in paths:
+            stat = os.stat(path)
+            entry = self.manifest.get(os.path.abspath(path))
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+            digest = file_digest(path)
+            if entry and entry['sha1'] == digest:
+                entry['mtime'] = stat.st_mtime
+                continue
+            changed.append(path)
+        return changed
+
+    def append(self, df):
+        """写入仓库中没有的记录，返回新增行数"""
+        keys = df.pop('_key').to_numpy()
+        seen = np.isin(keys, self.keys)
+        # 同一批里跨文件重复的只保留第一份
+        first = ~pd.Series(keys).duplicated().to_numpy()
+        new = df[~seen & first]
+        if new.empty:
+            return 0
+        for (source, month), part in new.groupby([new['来源'], new['发生日期'].str[:6]], sort=True):
+            folder = os.path.join(self.root, source)
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"{month}.csv")
+            exists = os.path.exists(path)
+            part[LEDGER_COLUMNS].to_csv(path, mode='a' if exists else 'w', header=not exists, index=False,
+                                        encoding='utf-8' if exists else 'utf-8-sig')
+        self.keys = np.union1d(self.keys, keys[~seen & first])
+        return len(new)
+
+    def save_index(self):
+        tmp = self.keys_path + '.tmp.npy'
+        np.save(tmp, self.keys)
+        os.replace(tmp, self.keys_path)
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+
+    def ingest(self, paths, workers=4):
+        """并行解析有变化的文件，按文件名顺序去重入库，返回每个文件的处理结果"""
+        paths = sorted(paths)
+        changed = self.changed_files(paths)
+        report = []
+        if changed:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parsed = sorted(pool.map(parse_file, changed))
+            for path, df, note in parsed:
+                added = self.append(df) if df is not None else 0
+                report.append((path, note, 0 if df is None else len(df), added))
+                if note.startswith('读取失败'):
+                    # 缺少依赖等原因读不了的文件不记录，下次再试
+                    continue
+                stat = os.stat(path)
+                self.manifest[os.path.abspath(path)] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                                                        'sha1': file_digest(path), 'source': note,
+                                                        'rows': 0 if df is None else len(df), 'added': added}
+        self.save_index()
+        return report
+
+    def load(self, source='对账单', start=None, end=None, account=None):
+        """
+        按来源和日期范围读取（只读涉及的月份分区），列为字符串，格式与 202506对账单.csv 相同
+        start/end 为 YYYYMMDD
+        """
+        folder = os.path.join(self.root, source)
+        months = sorted(f[:6] for f in os.listdir(folder) if f.endswith('.csv')) if os.path.isdir(folder) else []
+        months = [m for m in months if (not start or m >= str(start)[:6]) and (not end or m <= str(end)[:6])]
+        parts = [pd.read_csv(os.path.join(folder, f"{m}.csv"), dtype=str, keep_default_na=False) for m in months]
+        if not parts:
+            return pd.DataFrame(columns=LEDGER_COLUMNS)
+        df = pd.concat(parts, ignore_index=True)
+        if start:
+            df = df[df['发生日期'] >= str(start)]
+        if end:
+            df = df[df['发生日期'] <= str(end)]
+        if account:
+            df = df[df['资金帐号'] == str(account)]
+        # 只按日期稳定排序，同一天内保持券商导出的顺序（资金本次余额按这个顺序滚动）
+        return df.sort_values('发生日期', kind='mergesort').reset_index(drop=True)
+
+
+def scan(folders):
+    """递归查找导出文件"""
+    paths = []
+    for folder in folders:
+        if os.path.isfile(folder):
+            paths.append(folder)
+            continue
+        for dirpath, dirnames, filenames in os.walk(folder):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.') and d not in ('ledger', 'bars', '__pycache__')]
+            paths.extend(os.path.join(dirpath, f) for f in filenames if f.lower().endswith(EXTENSIONS))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="扫描目录，把对账单、历史成交导出去重后归档到本地仓库")
+    parser.add_argument('folders', nargs='*', default=['.'])
+    parser.add_argument('--root', help="仓库目录，默认 ./ledger")
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    store = StatementStore(args.root)
+    paths = scan(args.folders)
+    report = store.ingest(paths, args.workers)
+    for path, note, rows, added in report:
+        print(f"{path}: {note}，{rows} 行，新增 {added} 行")
+    print(f"扫描 {len(paths)} 个文件，{len(report)} 个有变化，新增 {sum(r[3] for r in report)} 行，"
+          f"仓库共 {len(store.keys)} 行")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,51 @@
-import pandas as pd
+import sys
 import mplfinance as mpf
 import numpy as np
 import matplotlib
 matplotlib.rcParams['font.sans-serif'] = ['SimHei']  # 指定黑体
 matplotlib.rcParams['axes.unicode_minus'] = False    # 正常显示负号
 
+from bar_store import get_bars
+from analyze_divergence import load_divergence, filter_signals
+from result_cache import ResultCache
+
 # 读取数据
-df = pd.read_csv('09988_data.csv', index_col=1, parse_dates=True)
-df_div = pd.read_csv('09988_divergence.csv', index_col=1, parse_dates=True)
+df = get_bars('09988', market='HK', adjust='qfq')
+df_div = load_divergence('09988')
 
 # 保证索引为日期
-df = df[['开盘','收盘','最高','最低','成交量']]
+df = df[['open','close','high','low','volume']]
 df.columns = ['Open','Close','High','Low','Volume']
 
-# 只取最近60天
-df_recent = df.iloc[-60:]
-df_div_recent = df_div.reindex(df_recent.index)
-
 # 设定阈值（如5%）
 threshold = 0.05
 window = 5
-
-# 只保留背离后5天内最大涨跌幅绝对值超过阈值的背离点
-def filter_signals(div_df, price_df, signal, threshold, window):
-    filtered_idx = []
-    for idx in div_df[div_df['divergence_signal']==signal].index:
-        if idx not in price_df.index:
-            continue
-        pos = price_df.index.get_loc(idx)
-        close = price_df.loc[idx, 'Close']
-        # 取后window天
-        future = price_df.iloc[pos+1:pos+1+window]
-        if not future.empty:
-            max_up = (future['High'].max() - close) / close
-            max_down = (future['Low'].min() - close) / close
-            if abs(max_up) >= threshold or abs(max_down) >= threshold:
-                filtered_idx.append(idx)
-    return filtered_idx
-
-pos_idx = filter_signals(df_div_recent, df_recent, 1, threshold, window)
-neg_idx = filter_signals(df_div_recent, df_recent, -1, threshold, window)
-
-# 生成和df_recent等长的标记Series
-pos_marker = np.full(len(df_recent), np.nan)
-neg_marker = np.full(len(df_recent), np.nan)
-for idx in pos_idx:
-    pos_marker[df_recent.index.get_loc(idx)] = df_recent.loc[idx, 'High']
-for idx in neg_idx:
-    neg_marker[df_recent.index.get_loc(idx)] = df_recent.loc[idx, 'Low']
-
-apds = [
-    mpf.make_addplot(pos_marker, type='scatter', markersize=80, marker='^', color='red', alpha=0.8),
-    mpf.make_addplot(neg_marker, type='scatter', markersize=80, marker='v', color='blue', alpha=0.8)
-]
-
-# 画K线+量柱+背离标记
-mpf.plot(df_recent, type='candle', volume=True, addplot=apds, style='yahoo', title='09988 近60天量价K线与背离', figratio=(16,9), figscale=1.2, mav=(5,10,20), savefig='09988_kline_divergence_recent.png')
\ No newline at end of file
+# 画图显示最近多少天（命令行第一个参数，0 表示全部历史）
+days = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+
+# 在全部历史上一次确认所有背离信号，再截取最近 days 天画图
+df_div = df_div.reindex(df.index)
+confirmed = filter_signals(df_div['divergence_signal'], df['Close'], df['High'], df['Low'], threshold, window)
+df_recent = df.iloc[-days:] if days else df
+confirmed = confirmed.reindex(df_recent.index)
+
+# 生成和df_recent等长的标记
+pos_marker = np.where(confirmed == 1, df_recent['High'], np.nan)
+neg_marker = np.where(confirmed == -1, df_recent['Low'], np.nan)
+
+output_file = '09988_kline_divergence_recent.png'
+mav = (5, 10, 20)
+
+def plot(mav):
+    apds = [
+        mpf.make_addplot(pos_marker, type='scatter', markersize=80, marker='^', color='red', alpha=0.8),
+        mpf.make_addplot(neg_marker, type='scatter', markersize=80, marker='v', color='blue', alpha=0.8)
+    ]
+    # 画K线+量柱+背离标记
+    mpf.plot(df_recent, type='candle', volume=True, addplot=apds, style='yahoo', title=f'09988 近{days or len(df)}天量价K线与背离', figratio=(16,9), figscale=1.2, mav=mav, savefig=output_file)
+
+# K线、背离信号和参数都没变时不重新画图
+_, hit = ResultCache().memoize('kline_divergence', plot, inputs=[df_recent, pos_marker, neg_marker],
+                               params={'mav': mav}, outputs=[output_file])
+if hit:
+    print(f"数据未变化，跳过画图（{output_file}）")
\ No newline at end of file
@@ -1,29 +1,33 @@
-import pandas as pd
 import numpy as np
 
+from bar_store import get_bars
+from indicator_engine import rolling_mean, macd
+from analyze_divergence import load_divergence
+from result_cache import ResultCache
+
 # 读取数据
-df = pd.read_csv('09988_data.csv', index_col=1, parse_dates=True)
-df = df[['开盘','收盘','最高','最低','成交量']]
+df = get_bars('09988', market='HK', adjust='qfq')
+df = df[['open','close','high','low','volume']]
 df.columns = ['Open','Close','High','Low','Volume']
+df = df.astype('float64')
+
+# 均线周期和 MACD 参数
+MA_PERIODS = (5, 10, 20)
+MACD_PARAMS = (12, 26, 9)
 
 # 计算均线
-df['MA5'] = df['Close'].rolling(5).mean()
-df['MA10'] = df['Close'].rolling(10).mean()
-df['MA20'] = df['Close'].rolling(20).mean()
+for period in MA_PERIODS:
+    df[f'MA{period}'] = rolling_mean(df['Close'], period)
 
-# 计算MACD
+# 计算MACD（国内软件习惯：柱状值为 2*(DIF-DEA)）
 def calc_macd(close, fast=12, slow=26, signal=9):
-    ema_fast = close.ewm(span=fast, adjust=False).mean()
-    ema_slow = close.ewm(span=slow, adjust=False).mean()
-    dif = ema_fast - ema_slow
-    dea = dif.ewm(span=signal, adjust=False).mean()
-    macd = 2 * (dif - dea)
-    return dif, dea, macd
+    dif, dea, hist = macd(close, fast, slow, signal, min_periods=False)
+    return dif, dea, 2 * hist
 
-df['DIF'], df['DEA'], df['MACD'] = calc_macd(df['Close'])
+df['DIF'], df['DEA'], df['MACD'] = calc_macd(df['Close'], *MACD_PARAMS)
 
 # 读取背离信号
-df_div = pd.read_csv('09988_divergence.csv', index_col=1, parse_dates=True)
+df_div = load_divergence('09988')
 df['divergence_signal'] = df_div.reindex(df.index)['divergence_signal']
 
 # 生成买入信号
@@ -38,10 +42,18 @@ print(buy_points[['Open','Close','High','Low']])
 
 # 可选：画图标记买点
 import mplfinance as mpf
-apds = []
-buy_marker = np.full(len(df), np.nan)
-for idx in buy_points.index:
-    buy_marker[df.index.get_loc(idx)] = df.loc[idx, 'Low']
-apds.append(mpf.make_addplot(buy_marker, type='scatter', markersize=120, marker='^', color='green'))
-
-mpf.plot(df, type='candle', volume=True, addplot=apds, style='yahoo', title='组合量化买点', figratio=(16,9), figscale=1.2, mav=(5,10,20), savefig='combo_quant_buy.png')
\ No newline at end of file
+output_file = 'combo_quant_buy.png'
+
+def plot(mav):
+    apds = []
+    buy_marker = np.full(len(df), np.nan)
+    for idx in buy_points.index:
+        buy_marker[df.index.get_loc(idx)] = df.loc[idx, 'Low']
+    apds.append(mpf.make_addplot(buy_marker, type='scatter', markersize=120, marker='^', color='green'))
+    mpf.plot(df, type='candle', volume=True, addplot=apds, style='yahoo', title='组合量化买点', figratio=(16,9), figscale=1.2, mav=mav, savefig=output_file)
+
+# 数据和参数（均线周期、MACD 参数）都没变时不重新画图
+_, hit = ResultCache().memoize('combo_quant_buy', plot, inputs=[df[['Open', 'Close', 'High', 'Low', 'Volume', 'divergence_signal']]],
+                               params={'mav': MA_PERIODS}, key_params={'macd': MACD_PARAMS}, outputs=[output_file])
+if hit:
+    print(f"数据未变化，跳过画图（{output_file}）")
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+复权层：仓库只保存不复权K线，分红送转的复权因子单独保存，读取时按需计算前复权/后复权
+
+因子文件 bars/{市场}/factors/{代码}.npy：每个除权除息日一行 (date, factor)，
+factor 为该日起生效的累计后复权因子（第一次除权前为 1）
+  后复权 hfq：价格 × 当日因子（早期价格不变，除权后的价格放大）
+  前复权 qfq：价格 × 当日因子 / 最新因子（最新价格不变，早期价格缩小）
+成交量不调整（与 akshare、baostock 的复权数据一致）
+
+除权后只需要追加一行因子，已经缓存的不复权K线不变，增量同步始终有效；
+前复权视图按读取时的最新因子计算，不用再整段重新下载
+
+因子来源：
+  A股  baostock query_adjust_factor（backAdjustFactor）
+  港股 yfinance 的分红、拆合股记录，按除权日前一天的收盘价计算
+"""
+import os
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from bar_store import BAR_ROOT, resolve_symbol, load_bars
+from profiler import timed, count
+
+FACTOR_DTYPE = np.dtype([
+    ('date', 'M8[ns]'),
+    ('factor', 'f8'),
+])
+ADJUST_MODES = (None, 'qfq', 'hfq')
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+
+
+def factor_path(symbol, market, root=None):
+    return os.path.join(root or BAR_ROOT, market.upper(), 'factors', f"{symbol}.npy")
+
+
+def save_factors(events, symbol, market, root=None):
+    """events 为 (日期, 累计后复权因子) 的 DataFrame/Series，同一日期以新数据为准"""
+    events = pd.Series(events) if not isinstance(events, pd.Series) else events
+    events = events[~events.index.duplicated(keep='last')].sort_index()
+    rec = np.empty(len(events), dtype=FACTOR_DTYPE)
+    rec['date'] = pd.DatetimeIndex(events.index).tz_localize(None).values.astype('M8[ns]')
+    rec['factor'] = events.to_numpy(dtype='f8')
+    path = factor_path(symbol, market, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        np.save(f, rec)
+    os.replace(tmp, path)
+    return path
+
+
+def load_factors(symbol, market, root=None):
+    """读取因子表，没有时返回空数组（相当于没有除权）"""
+    path = factor_path(symbol, market, root)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=FACTOR_DTYPE)
+    return np.load(path)
+
+
+def daily_factors(dates, factors):
+    """每个交易日生效的累计后复权因子：按日期二分查找，不逐行循环"""
+    d = np.asarray(pd.DatetimeIndex(dates).values, dtype='M8[ns]')
+    idx = np.searchsorted(factors['date'], d, side='right') - 1
+    return np.where(idx >= 0, factors['factor'][np.maximum(idx, 0)], 1.0)
+
+
+def apply_factors(df, factors, adjust='qfq'):
+    """返回复权后的新 DataFrame（不修改 df），adjust=None 时原样返回"""
+    if adjust is None or len(factors) == 0 or df is None:
+        return df
+    if adjust not in ADJUST_MODES:
+        raise ValueError(f"不支持的复权方式：{adjust}，可选 {ADJUST_MODES}")
+    f = daily_factors(df.index, factors)
+    if adjust == 'qfq':
+        f = f / factors['factor'][-1]
+    out = df.copy()
+    cols = [c for c in PRICE_COLUMNS if c in out]
+    out[cols] = out[cols].to_numpy(dtype='f8') * f[:, None]
+    return out
+
+
+def has_factors(symbol, market, root=None):
+    return os.path.exists(factor_path(symbol, market, root))
+
+
+def adjust_bars(df, symbol, market, adjust='qfq', root=None):
+    """
+    按仓库里这只股票的因子复权；A股没有因子文件时发出警告并返回不复权数据
+    （因子文件存在但为空表示没有除权过，不警告）
+    """
+    if adjust is None or df is None:
+        return df
+    if market.upper() == 'A' and not has_factors(symbol, market, root):
+        warnings.warn(f"{symbol} 没有复权因子文件，返回的是不复权价格；"
+                      f"请先运行 adjustment.py {symbol} 或 batch_fetch --factors", stacklevel=2)
+    return apply_factors(df, load_factors(symbol, market, root), adjust)
+
+
+def load_adjusted(symbol, market, start=None, end=None, adjust='qfq', root=None):
+    """从仓库读取K线并复权，adjust=None 时等同于 load_bars（不读因子文件）"""
+    return adjust_bars(load_bars(symbol, market, start, end, root), symbol, market, adjust, root)
+
+
+def factors_from_actions(closes, actions):
+    """
+    由分红、送转计算因子
+    closes: 不复权收盘价（日期索引）
+    actions: 除权除息日索引，列 dividend（每股现金分红）、split（每 1 股变成几股，没有为 1）
+    除权参考价 = (前收盘 - 分红) / split，当天因子 = 前一个因子 × 前收盘 / 除权参考价
+    """
+    closes = closes.dropna().sort_index()
+    actions = actions.sort_index()
+    dividend = actions['dividend'].fillna(0.0) if 'dividend' in actions else 0.0
+    split = actions['split'].replace(0, 1.0).fillna(1.0) if 'split' in actions else 1.0
+    # 除权日前一个交易日的收盘价
+    pos = np.searchsorted(closes.index.values, actions.index.values, side='left') - 1
+    valid = pos >= 0
+    prev_close = np.where(valid, closes.to_numpy()[np.maximum(pos, 0)], np.nan)
+    ratio = prev_close / ((prev_close - np.asarray(dividend)) / np.asarray(split))
+    ratio = np.where(valid & np.isfinite(ratio) & (ratio > 0), ratio, 1.0)
+    return pd.Series(np.cumprod(ratio), index=actions.index)
+
+
+@timed('fetch.baostock_factors')
+def fetch_baostock_factors(symbol, start_date='19900101', end_date=None):
+    import baostock as bs
+    end_date = end_date or datetime.now().strftime('%Y%m%d')
+    bs.login()
+    try:
+        count('api_calls.baostock')
+        rs = bs.query_adjust_factor(code=symbol,
+                                    start_date=f"{start_date[:4]}-{start_date[4:6]}-{start_date[6:]}",
+                                    end_date=f"{end_date[:4]}-{end_date[4:6]}-{end_date[6:]}")
+        rows = []
+        while (rs.error_code == '0') & rs.next():
+            rows.append(rs.get_row_data())
+    finally:
+        bs.logout()
+    if not rows:
+        return pd.Series(dtype='f8')
+    df = pd.DataFrame(rows, columns=rs.fields)
+    return pd.Series(pd.to_numeric(df['backAdjustFactor']).to_numpy(),
+                     index=pd.to_datetime(df['dividOperateDate']))
+
+
+@timed('fetch.yfinance_actions')
+def fetch_yfinance_actions(symbol):
+    """港股分红（港元）和拆合股记录"""
+    import yfinance as yf
+    count('api_calls.yfinance')
+    actions = yf.Ticker(f"{symbol.lstrip('0').zfill(4)}.HK").actions
+    if actions is None or actions.empty:
+        return pd.DataFrame(columns=['dividend', 'split'])
+    actions.index = actions.index.tz_localize(None).normalize()
+    return pd.DataFrame({'dividend': actions.get('Dividends', 0.0),
+                         'split': actions.get('Stock Splits', 0.0).replace(0, 1.0)})
+
+
+def sync_factors(stock_code, market=None, root=None):
+    """下载并保存某只股票的复权因子，返回因子行数"""
+    market, symbol = resolve_symbol(stock_code, market)
+    if market == 'A':
+        events = fetch_baostock_factors(symbol)
+    else:
+        bars = load_bars(symbol, market, root=root)
+        if bars is None:
+            return 0
+        events = factors_from_actions(bars['close'].astype('f8'), fetch_yfinance_actions(symbol))
+    save_factors(events, symbol, market, root)
+    return len(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载复权因子（K线仓库只存不复权数据）")
+    parser.add_argument('symbols', nargs='+', help="股票代码，如 09988.hk、sh.600000")
+    parser.add_argument('--root', help="K线仓库目录，默认 bars/")
+    args = parser.parse_args()
+    for code in args.symbols:
+        market, symbol = resolve_symbol(code)
+        n = sync_factors(code, root=args.root)
+        print(f"{symbol} 复权因子 {n} 条已写入 {factor_path(symbol, market, args.root)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,168 @@
+import os
+import sys
+import numpy as np
 import pandas as pd
+from bar_store import get_bars
+from indicator_engine import macd, forward_max, forward_min, _as_array, _wrap
+from batch_fetch import read_symbols
+from result_cache import ResultCache
+
+# 默认的回看窗口，第一个作为 divergence_signal
+LOOKBACKS = (14, 30, 60)
+
+def swing_points(x, swing=2, mode='high'):
+    """
+    波峰/波谷：x[j] 不低于（波谷为不高于）前后各 swing 根K线，要到 j+swing 才能确认
+    x 可以是一维数组或 日期 × 股票 的面板，NaN 不算波峰波谷
+    """
+    a = _as_array(x)
+    better = np.greater_equal if mode == 'high' else np.less_equal
+    out = ~np.isnan(a)
+    out[:swing] = False
+    out[len(a) - swing:] = False
+    for k in range(1, swing + 1):
+        out[k:] &= better(a[k:], a[:-k])
+        out[:-k] &= better(a[:-k], a[k:])
+    return out
+
+def divergence_panel(high, low, close, volume, lookbacks=(14,), swing=2, dif=None):
+    """
+    多个回看窗口的量价背离和 MACD 背离，输入为一维数组或 日期 × 股票 的面板
+    对每个 t，在 [t-lookback, t-swing] 中找最高的波峰（最低的波谷）作为前一个极值点：
+      顶背离（1）：最高价突破前一个波峰，但成交量 / MACD DIF 低于波峰那天
+      底背离（-1）：最低价跌破前一个波谷，但成交量低于波谷那天（缩量）/ MACD DIF 高于波谷那天
+    只用到 t 当天及以前的数据；所有回看窗口共用一次按偏移递推的滚动极值，
+    偏移到达某个窗口长度时记下当时的结果
+    返回 {(指标, 窗口): 信号数组}，指标为 'volume' 或 'macd'
+    """
+    lookbacks = sorted(set(lookbacks))
+    if lookbacks[0] <= swing:
+        raise ValueError(f"回看窗口必须大于 swing={swing}")
+    h, l, v = _as_array(high), _as_array(low), _as_array(volume)
+    d = _as_array(macd(close)[0] if dif is None else dif)
+    peak = np.where(swing_points(h, swing, 'high'), h, -np.inf)
+    trough = np.where(swing_points(l, swing, 'low'), l, np.inf)
+
+    # 每个 t 目前找到的最高波峰、最低波谷，以及那一天的成交量和 DIF
+    best_high, best_low = np.full(h.shape, -np.inf), np.full(l.shape, np.inf)
+    high_v, high_d = np.full(h.shape, np.nan), np.full(h.shape, np.nan)
+    low_v, low_d = np.full(l.shape, np.nan), np.full(l.shape, np.nan)
+    out = {}
+    for k in range(max(swing, 1), lookbacks[-1] + 1):
+        if k < len(h):
+            # 偏移从近到远，严格大于才替换，同样高的波峰取最近的一个
+            up = peak[:-k] > best_high[k:]
+            np.copyto(best_high[k:], peak[:-k], where=up)
+            np.copyto(high_v[k:], v[:-k], where=up)
+            np.copyto(high_d[k:], d[:-k], where=up)
+            dn = trough[:-k] < best_low[k:]
+            np.copyto(best_low[k:], trough[:-k], where=dn)
+            np.copyto(low_v[k:], v[:-k], where=dn)
+            np.copyto(low_d[k:], d[:-k], where=dn)
+        if k in lookbacks:
+            higher_high = h > best_high
+            lower_low = l < best_low
+            out[('volume', k)] = (np.where(higher_high & (v < high_v), 1, 0)
+                                  - np.where(lower_low & (v < low_v), 1, 0))
+            out[('macd', k)] = (np.where(higher_high & (d < high_d), 1, 0)
+                                - np.where(lower_low & (d > low_d), 1, 0))
+    return out
+
+def detect_divergence(data, lookbacks=(14,), swing=2):
+    """
+    单只股票的背离信号，data 需要 high/low/close/volume 列
+    返回新的 DataFrame（与 data 同索引，不复制原始列）：
+      vol_div_{n} / macd_div_{n}  各回看窗口的量价背离、MACD 背离（1:顶背离, -1:底背离, 0:无）
+      divergence_signal           第一个回看窗口的量价背离，与旧格式兼容
+    """
+    signals = divergence_panel(data['high'], data['low'], data['close'], data['volume'], lookbacks, swing)
+    result = pd.DataFrame(index=data.index)
+    for n in lookbacks:
+        result[f'vol_div_{n}'] = signals[('volume', n)].astype('int8')
+        result[f'macd_div_{n}'] = signals[('macd', n)].astype('int8')
+    result['divergence_signal'] = result[f'vol_div_{lookbacks[0]}']
+    return result
 
 def detect_volume_price_divergence(data, lookback=14):
-    """检测量价背离"""
-    data['price_change'] = data['收盘'].pct_change()
-    data['volume_change'] = data['成交量'].pct_change()
-    data['divergence_signal'] = 0  # 0:无信号, 1:顶背离, -1:底背离
-    
-    # 检测顶背离(价格上涨但成交量下降)
-    top_divergence = (data['price_change'] > 0) & (data['volume_change'] < 0)
-    data.loc[top_divergence, 'divergence_signal'] = 1
-    
-    # 检测底背离(价格下跌但成交量上升)
-    bottom_divergence = (data['price_change'] < 0) & (data['volume_change'] > 0)
-    data.loc[bottom_divergence, 'divergence_signal'] = -1
-    
-    return data
+    """检测量价背离（单个回看窗口），返回新的 DataFrame，不修改 data"""
+    return detect_divergence(data, (lookback,))
+
+def filter_signals(signal, close, high, low, threshold=0.05, window=5):
+    """
+    只保留背离后 window 天内最大涨跌幅绝对值超过 threshold 的信号，其余置 0
+    输入可以是单只股票的 Series，也可以是 日期 × 股票 的面板（DataFrame），形状一致即可；
+    所有信号（1 和 -1）一次确认，返回与 signal 同类型的结果
+    面板里的 window 按面板的行数计算，停牌日（NaN）占一行但不参与最大/最小值
+    """
+    c = _as_array(close)
+    up = np.abs(_as_array(forward_max(high, window)) - c) / c
+    down = np.abs(_as_array(forward_min(low, window)) - c) / c
+    # 没有未来数据时两者都是 NaN，比较结果为 False
+    confirmed = (up >= threshold) | (down >= threshold)
+    return _wrap(np.where(confirmed, np.nan_to_num(_as_array(signal)), 0.0), signal)
+
+def divergence_path(stock_code):
+    """{code}_divergence.csv 放在本脚本所在目录，不随运行时的当前目录变化"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{stock_code}_divergence.csv")
+
+def load_divergence(stock_code):
+    """
+    读取 {code}_divergence.csv，兼容旧格式（带 日期 列）和新格式（date 索引）
+    utf-8-sig 失败时按 GBK 读（Excel 另存过的文件）
+    """
+    for encoding in ['utf-8-sig', 'gbk']:
+        try:
+            df = pd.read_csv(divergence_path(stock_code), encoding=encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    date_col = 'date' if 'date' in df.columns else '日期'
+    df[date_col] = pd.to_datetime(df[date_col])
+    return df.set_index(date_col)
+
+def analyze(stock_code, lookbacks=LOOKBACKS, cache=None):
+    """
+    计算一只股票各回看窗口的背离信号并写入 {code}_divergence.csv
+    K线数据和参数都没变时直接跳过（输出文件被删除或改动时从缓存恢复），返回是否跳过
+    """
+    data = get_bars(stock_code, market="HK", adjust='qfq')
+    if data is None:
+        raise FileNotFoundError(f"本地没有 {stock_code} 的数据，请先获取该股票数据")
+    output_file = divergence_path(stock_code)
+
+    def run(lookbacks):
+        detect_divergence(data, lookbacks).to_csv(output_file)
+
+    cache = cache or ResultCache()
+    _, hit = cache.memoize('divergence', run, inputs=[data], params={'lookbacks': tuple(lookbacks)},
+                           outputs=[output_file])
+    return hit
 
 def main():
     print("\n股票量价背离分析工具")
     print("="*30)
-    
-    stock_code = input("请输入要分析的股票代码(如:03690): ").strip()
-    if not stock_code:
-        print("错误: 股票代码不能为空")
-        return
-        
-    input_file = f"{stock_code}_data.csv"
-    output_file = f"{stock_code}_divergence.csv"
-    
-    try:
-        # 读取数据
-        data = pd.read_csv(input_file)
-        
-        # 应用量价背离分析
-        result = detect_volume_price_divergence(data)
-        
-        # 保存结果
-        result.to_csv(output_file, index=False)
-        print(f"\n量价背离分析完成，结果已保存到{output_file}")
-        
-    except FileNotFoundError:
-        print(f"错误: 找不到数据文件 {input_file}，请先获取该股票数据")
-    except Exception as e:
-        print(f"分析过程中出错: {e}")
+
+    # 可以在命令行给出多个代码或 @代码列表文件批量分析，否则交互输入
+    codes = []
+    for item in sys.argv[1:]:
+        codes.extend(read_symbols(item[1:]) if item.startswith('@') else [item])
+    if not codes:
+        stock_code = input("请输入要分析的股票代码(如:03690): ").strip()
+        if not stock_code:
+            print("错误: 股票代码不能为空")
+            return
+        codes = [stock_code]
+
+    cache = ResultCache()
+    for stock_code in codes:
+        output_file = divergence_path(stock_code)
+        try:
+            if analyze(stock_code, cache=cache):
+                print(f"{stock_code} 数据未变化，跳过（{output_file}）")
+            else:
+                print(f"\n量价背离分析完成，结果已保存到{output_file}")
+        except Exception as e:
+            print(f"分析过程中出错: {e}")
 
 # 主程序
 if __name__ == "__main__":
@@ -0,0 +1,395 @@
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from profiler import stage, timed, count
+
+# 本地K线仓库：bars/{市场}/{代码}.npy，每个文件是一个按日期升序的结构化数组，
+# 读取时用 mmap 打开，按日期二分定位，只拷贝需要的行
+BAR_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bars')
+
+BAR_DTYPE = np.dtype([
+    ('date', 'M8[ns]'),
+    ('open', 'f4'),
+    ('high', 'f4'),
+    ('low', 'f4'),
+    ('close', 'f4'),
+    ('volume', 'i8'),
+])
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+# 最长的休市间隔（春节等），用于判断缓存是否已覆盖请求的开始日期
+HOLIDAY_GAP = pd.Timedelta(days=12)
+
+# akshare 返回的中文列名
+AK_COLUMNS = {
+    '日期': 'date',
+    '开盘': 'open',
+    '最高': 'high',
+    '最低': 'low',
+    '收盘': 'close',
+    '成交量': 'volume',
+}
+
+
+def resolve_symbol(stock_code, market=None):
+    """
+    统一股票代码格式，返回 (市场, 代码)
+    00700.hk / 00700 + market="HK" -> ("HK", "00700")
+    09988 / 700（不超过 5 位的纯数字） -> ("HK", "09988") / ("HK", "00700")，A股代码都是 6 位
+    sh600519 / sh.600519 / 600519   -> ("A", "sh.600519")
+    513030 / 159941                 -> ("A", "sh.513030") / ("A", "sz.159941")（场内基金、可转债）
+    """
+    code = str(stock_code).strip().lower()
+    if (market or '').upper() == 'HK' or code.endswith('.hk'):
+        return 'HK', code.replace('.hk', '').zfill(5)
+    if code.startswith(('sh', 'sz')):
+        if not code.startswith(('sh.', 'sz.')):
+            code = f"{code[:2]}.{code[2:]}"
+        return 'A', code
+    if code.isdigit() and len(code) <= 5:
+        return 'HK', code.zfill(5)
+    if code.startswith(('0', '3')):  # 深市主板、创业板
+        return 'A', f"sz.{code}"
+    if code.startswith(('6', '8')):  # 上海主板、科创板
+        return 'A', f"sh.{code}"
+    if code.startswith(('5', '11')):  # 沪市ETF、可转债
+        return 'A', f"sh.{code}"
+    if code.startswith(('15', '16', '12')):  # 深市ETF/LOF、可转债
+        return 'A', f"sz.{code}"
+    raise ValueError(f"无法识别的股票代码格式：{stock_code}")
+
+
+def bar_path(symbol, market, root=None):
+    return os.path.join(root or BAR_ROOT, market.upper(), f"{symbol}.npy")
+
+
+def to_records(df):
+    """把 open/high/low/close/volume + 日期索引的 DataFrame 转成结构化数组"""
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+    rec = np.empty(len(df), dtype=BAR_DTYPE)
+    rec['date'] = pd.DatetimeIndex(df.index).tz_localize(None).values.astype('M8[ns]')
+    for col in BAR_COLUMNS[:-1]:
+        rec[col] = df[col].to_numpy(dtype='f4')
+    rec['volume'] = df['volume'].fillna(0).to_numpy(dtype='i8')
+    return rec
+
+
+def to_frame(rec):
+    """结构化数组 -> DataFrame（日期索引）"""
+    df = pd.DataFrame({col: np.asarray(rec[col]) for col in BAR_COLUMNS},
+                      index=pd.DatetimeIndex(np.asarray(rec['date']), name='date'))
+    return df
+
+
+def save_bars(df, symbol, market, root=None):
+    """整体写入某只股票的K线，先写临时文件再替换，保证原子性"""
+    path = bar_path(symbol, market, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, to_records(df))
+    os.replace(tmp_path, path)
+    return path
+
+
+def open_bars(symbol, market, root=None):
+    """以只读 mmap 方式打开，文件不存在返回 None"""
+    path = bar_path(symbol, market, root)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
+
+
+def load_bars(symbol, market, start=None, end=None, root=None):
+    """
+    读取K线，start/end 可为 YYYYMMDD 字符串或日期，闭区间
+    只有命中日期范围的行会被读入内存
+    """
+    rec = open_bars(symbol, market, root)
+    if rec is None:
+        return None
+    dates = rec['date']
+    lo = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start), 'ns'), side='left')
+    hi = len(rec) if end is None else np.searchsorted(
+        dates, np.datetime64(pd.Timestamp(end) + pd.Timedelta(days=1), 'ns'), side='left')
+    return to_frame(rec[lo:hi])
+
+
+def last_date(symbol, market, root=None):
+    """返回本地已缓存的最后一个交易日，没有缓存返回 None"""
+    rec = open_bars(symbol, market, root)
+    if rec is None or len(rec) == 0:
+        return None
+    return pd.Timestamp(rec['date'][-1])
+
+
+def list_symbols(market, root=None):
+    folder = os.path.join(root or BAR_ROOT, market.upper())
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name[:-4] for name in os.listdir(folder) if name.endswith('.npy'))
+
+
+def from_akshare(df):
+    """akshare stock_hk_hist 结果 -> 标准K线"""
+    df = df.rename(columns=AK_COLUMNS)
+    df['date'] = pd.to_datetime(df['date'])
+    return df.set_index('date')[BAR_COLUMNS]
+
+
+def import_csv(csv_file, symbol=None, market='HK', root=None):
+    """把旧的 {code}_data.csv 导入仓库"""
+    df = pd.read_csv(csv_file, encoding='utf-8-sig')
+    df = df.drop(columns=[c for c in df.columns if c.startswith('Unnamed') or c == ''])
+    if symbol is None:
+        symbol = os.path.basename(csv_file).split('_')[0]
+    return save_bars(from_akshare(df), symbol, market, root)
+
+
+@timed('fetch.akshare')
+def fetch_akshare_hk(symbol, start_date, end_date):
+    import akshare as ak
+    count('api_calls.akshare')
+    df = ak.stock_hk_hist(symbol=symbol, period="daily", start_date=start_date, end_date=end_date, adjust="")
+    if df is None or df.empty:
+        return None
+    return from_akshare(df)
+
+
+@timed('fetch.yfinance')
+def fetch_yfinance_hk(symbol, start_date, end_date):
+    import yfinance as yf
+    count('api_calls.yfinance')
+    start_dt = datetime.strptime(start_date, '%Y%m%d')
+    end_dt = datetime.strptime(end_date, '%Y%m%d')
+    # 仓库只存不复权数据：关掉 yfinance 默认的 auto_adjust，与 akshare（adjust=''）的K线一致
+    df = yf.Ticker(f"{symbol}.HK").history(start=start_dt, end=end_dt + timedelta(days=1), interval="1d",
+                                           auto_adjust=False, actions=False)
+    if df.empty:
+        return None
+    df = df.rename(columns={'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'})
+    df.index = df.index.tz_localize(None).normalize()
+    return df[BAR_COLUMNS]
+
+
+def query_baostock(bs, symbol, start_date, end_date, adjustflag="3"):
+    """
+    在已登录的 baostock 会话中查询日K线
+    默认不复权（adjustflag="3"），复权由 adjustment 模块按因子计算
+    查询出错时抛出 RuntimeError（不当作没有数据），由调用方重试
+    """
+    count('api_calls.baostock')
+    rs = bs.query_history_k_data_plus(
+        symbol,
+        "date,open,high,low,close,volume",
+        start_date=f"{start_date[:4]}-{start_date[4:6]}-{start_date[6:]}",
+        end_date=f"{end_date[:4]}-{end_date[4:6]}-{end_date[6:]}",
+        frequency="d",
+        adjustflag=adjustflag
+    )
+    data_list = []
+    with stage('fetch.baostock_query'):
+        while (rs.error_code == '0') & rs.next():
+            data_list.append(rs.get_row_data())
+    if rs.error_code != '0':
+        raise RuntimeError(f"baostock 查询 {symbol} 失败: {rs.error_code} {rs.error_msg}")
+    if len(data_list) == 0:
+        return None
+    df = pd.DataFrame(data_list, columns=['date'] + BAR_COLUMNS)
+    df = df.replace('', np.nan).dropna(subset=['close'])
+    for col in BAR_COLUMNS:
+        df[col] = pd.to_numeric(df[col])
+    df['date'] = pd.to_datetime(df['date'])
+    return df.set_index('date').sort_index()
+
+
+def fetch_baostock_a(symbol, start_date, end_date):
+    import baostock as bs
+    with stage('fetch.baostock_login'):
+        bs.login()
+    try:
+        return query_baostock(bs, symbol, start_date, end_date)
+    finally:
+        bs.logout()
+
+
+def is_fund(symbol):
+    """场内基金（ETF/LOF）：baostock 没有基金K线"""
+    return symbol.split('.')[-1].startswith(('5', '15', '16'))
+
+
+@timed('fetch.akshare')
+def fetch_akshare_fund(symbol, start_date, end_date):
+    """akshare 场内基金日K线（不复权）"""
+    import akshare as ak
+    count('api_calls.akshare')
+    df = ak.fund_etf_hist_em(symbol=symbol.split('.')[-1], period="daily", start_date=start_date,
+                             end_date=end_date, adjust="")
+    if df is None or df.empty:
+        return None
+    return from_akshare(df)
+
+
+def fetch_a(symbol, start_date, end_date):
+    """A股默认数据源：股票用 baostock，场内基金用 akshare"""
+    if is_fund(symbol):
+        return fetch_akshare_fund(symbol, start_date, end_date)
+    return fetch_baostock_a(symbol, start_date, end_date)
+
+
+# 每个市场默认的数据源
+PROVIDERS = {
+    'HK': fetch_akshare_hk,
+    'A': fetch_a,
+}
+
+
+def fetch_bars(stock_code, start_date, end_date=None, market=None, provider=None, root=None, save=True):
+    """
+    统一的下载入口：下载 -> 标准化 -> 写入仓库
+    start_date/end_date 格式 YYYYMMDD，end_date 默认今天
+    """
+    market, symbol = resolve_symbol(stock_code, market)
+    end_date = end_date or datetime.now().strftime('%Y%m%d')
+    fetch = provider or PROVIDERS[market]
+    df = fetch(symbol, start_date, end_date)
+    if df is None or df.empty:
+        print(f"未找到 {symbol} 的数据，请检查股票代码是否正确")
+        return None
+    if save:
+        path = save_bars(df, symbol, market, root)
+        print(f"{symbol} 共 {len(df)} 条K线已写入 {path}")
+    return df
+
+
+def first_date(symbol, market, root=None):
+    rec = open_bars(symbol, market, root)
+    if rec is None or len(rec) == 0:
+        return None
+    return pd.Timestamp(rec['date'][0])
+
+
+def append_bars(df, symbol, market, root=None):
+    """把新K线合并到已有数据后面（同日期以新数据为准），整体原子替换"""
+    old = load_bars(symbol, market, root=root)
+    if old is not None:
+        df = pd.concat([old[old.index < df.index.min()], df])
+    return save_bars(df, symbol, market, root)
+
+
+def prepend_bars(df, symbol, market, root=None):
+    """把更早的K线合并到已有数据前面（同日期以缓存为准），缓存里的后续K线全部保留"""
+    old = load_bars(symbol, market, root=root)
+    if old is not None:
+        df = pd.concat([df[df.index < old.index.min()], old])
+    return save_bars(df, symbol, market, root)
+
+
+def is_restated(cached, fresh, rtol=1e-4):
+    """
+    比较重叠区间的缓存和新下载数据，价格不一致说明数据源改写了历史
+    （例如前复权数据在除权除息后整段历史都会变化；仓库改存不复权数据后，
+    以前按前复权缓存的A股会在第一次同步时被识别出来并重新下载一次）
+    """
+    common = cached.index.intersection(fresh.index)
+    if len(common) == 0:
+        return True
+    cols = BAR_COLUMNS[:-1]
+    a = cached.loc[common, cols].to_numpy(dtype='f8')
+    b = fresh.loc[common, cols].to_numpy(dtype='f8')
+    return not np.allclose(a, b, rtol=rtol, atol=1e-3)
+
+
+def sync_bars(stock_code, start_date=None, end_date=None, market=None, provider=None, root=None, overlap=5):
+    """
+    增量同步：只下载本地缓存最后一天之后的数据
+    额外重叠下载最后 overlap 根K线用于检测历史改写，发现改写则整段重新下载
+    请求的开始日期早于缓存时只补下载缺少的开头一段，合并后再做增量同步
+    返回 (状态, 新增条数)，状态为 full / prepend / append / restated / skip / empty
+    """
+    market, symbol = resolve_symbol(stock_code, market)
+    end_date = end_date or datetime.now().strftime('%Y%m%d')
+    fetch = provider or PROVIDERS[market]
+    rec = open_bars(symbol, market, root)
+    
+    # 没有缓存 -> 全量下载
+    if rec is None or len(rec) == 0:
+        start_date = start_date or (datetime.now() - timedelta(days=365)).strftime('%Y%m%d')
+        df = fetch(symbol, start_date, end_date)
+        if df is None or df.empty:
+            return 'empty', 0
+        count('rows.fetched', len(df))
+        save_bars(df, symbol, market, root)
+        return 'full', len(df)
+    
+    # 请求的开始日期明显早于缓存 -> 只下载 start_date ~ 缓存第一天前一天，合并到缓存前面
+    # （开始日期落在长假里时第一根K线会晚几天，留出 HOLIDAY_GAP 的余量）
+    first = pd.Timestamp(rec['date'][0])
+    added = 0
+    if start_date and pd.Timestamp(start_date) < first - HOLIDAY_GAP:
+        head = fetch(symbol, start_date, (first - timedelta(days=1)).strftime('%Y%m%d'))
+        if head is not None and not head.empty:
+            count('rows.fetched', len(head))
+            head = head[head.index < first]
+            prepend_bars(head, symbol, market, root)
+            added = len(head)
+            rec = open_bars(symbol, market, root)
+    
+    last = pd.Timestamp(rec['date'][-1])
+    if last >= pd.Timestamp(end_date):
+        return ('prepend', added) if added else ('skip', 0)
+    
+    # 从倒数第 overlap 根K线开始下载
+    tail = to_frame(rec[-overlap:])
+    df = fetch(symbol, tail.index[0].strftime('%Y%m%d'), end_date)
+    if df is None or df.empty:
+        return ('prepend', added) if added else ('empty', 0)
+    count('rows.fetched', len(df))
+    
+    if is_restated(tail, df):
+        print(f"{symbol} 历史数据被改写（复权因子变化），重新全量下载")
+        df = fetch(symbol, pd.Timestamp(rec['date'][0]).strftime('%Y%m%d'), end_date)
+        if df is None or df.empty:
+            return 'empty', 0
+        save_bars(df, symbol, market, root)
+        return 'restated', len(df)
+    
+    new = df[df.index > last]
+    if new.empty:
+        return ('prepend', added) if added else ('skip', 0)
+    append_bars(new, symbol, market, root)
+    return 'append', added + len(new)
+
+
+def get_bars(stock_code, start=None, end=None, market=None, root=None, adjust=None):
+    """
+    分析脚本统一的读取入口
+    优先读仓库；仓库没有时尝试导入同目录下旧的 {code}_data.csv
+    adjust: None 不复权，'qfq' 前复权，'hfq' 后复权（需要先用 adjustment.sync_factors 下载因子）
+    """
+    market, symbol = resolve_symbol(stock_code, market)
+    df = load_bars(symbol, market, start, end, root)
+    if df is None:
+        csv_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{symbol}_data.csv")
+        if not os.path.exists(csv_file):
+            return None
+        import_csv(csv_file, symbol, market, root)
+        df = load_bars(symbol, market, start, end, root)
+    if adjust and df is not None:
+        from adjustment import adjust_bars
+        df = adjust_bars(df, symbol, market, adjust, root)
+    return df
+
+
+def main():
+    """把当前目录下旧的 *_data.csv 全部导入仓库"""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('_data.csv'):
+            path = import_csv(os.path.join(folder, name))
+            print(f"已导入 {name} -> {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+from profiler import stage, count, snapshot, merge, add_profile_args, profile_from_args
+from bar_store import (resolve_symbol, sync_bars, load_bars, query_baostock, is_fund,
+                       fetch_akshare_hk, fetch_akshare_fund, fetch_yfinance_hk)
+from adjustment import sync_factors
+
+# 每个数据源的限速：(每秒请求数, 突发容量)，所有 worker 平分
+RATE_LIMITS = {
+    'baostock': (10.0, 10),
+    'akshare': (2.0, 2),
+    'yfinance': (2.0, 4),
+    'local': (1000.0, 1000),
+}
+
+# 每个市场默认使用的数据源（A股场内基金例外，见 default_provider）
+DEFAULT_PROVIDER = {
+    'A': 'baostock',
+    'HK': 'akshare',
+}
+
+
+def default_provider(market, symbol):
+    """与 bar_store.fetch_a 相同：baostock 没有基金K线，A股场内基金（ETF/LOF）用 akshare"""
+    if market == 'A' and is_fund(symbol):
+        return 'akshare'
+    return DEFAULT_PROVIDER[market]
+
+
+class TokenBucket:
+    """令牌桶限速，rate 为每秒补充的令牌数，capacity 为桶容量"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def call_with_retry(func, *args, retries=3, backoff=1.0):
+    """失败后按 backoff, 2*backoff, 4*backoff ... 秒重试"""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"请求失败({e})，{delay:.1f}秒后重试")
+            time.sleep(delay)
+
+
+class BaostockProvider:
+    """每个 worker 登录一次 baostock，所有股票复用同一个会话"""
+    name = 'baostock'
+
+    def open(self):
+        import baostock as bs
+        self.bs = bs
+        with stage('fetch.baostock_login'):
+            lg = bs.login()
+        if lg.error_code != '0':
+            raise RuntimeError(f"baostock 登录失败: {lg.error_msg}")
+
+    def fetch(self, symbol, start_date, end_date):
+        return query_baostock(self.bs, symbol, start_date, end_date)
+
+    def close(self):
+        self.bs.logout()
+
+
+class AkshareProvider:
+    """港股和A股场内基金；A股股票请用 baostock"""
+    name = 'akshare'
+
+    def open(self):
+        pass
+
+    def fetch(self, symbol, start_date, end_date):
+        if not symbol.startswith(('sh.', 'sz.')):
+            return fetch_akshare_hk(symbol, start_date, end_date)
+        if is_fund(symbol):
+            return fetch_akshare_fund(symbol, start_date, end_date)
+        raise ValueError(f"akshare 数据源不支持A股股票 {symbol}，请使用 baostock")
+
+    def close(self):
+        pass
+
+
+class YfinanceProvider:
+    name = 'yfinance'
+
+    def open(self):
+        pass
+
+    def fetch(self, symbol, start_date, end_date):
+        return fetch_yfinance_hk(symbol, start_date, end_date)
+
+    def close(self):
+        pass
+
+
+class LocalProvider:
+    """
+    从另一个本地K线仓库读取数据，模拟远程数据源
+    用于离线测试批量下载流程，可设置延迟和失败率
+    """
+    name = 'local'
+
+    def __init__(self, root=None, latency=0.0, fail_every=0):
+        self.root = root
+        self.latency = latency
+        self.fail_every = fail_every
+        self.calls = 0
+
+    def open(self):
+        pass
+
+    def fetch(self, symbol, start_date, end_date):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.fail_every and self.calls % self.fail_every == 0:
+            raise ConnectionError("模拟网络错误")
+        market = 'A' if symbol.startswith(('sh.', 'sz.')) else 'HK'
+        return load_bars(symbol, market, start_date, end_date, self.root)
+
+    def close(self):
+        pass
+
+
+PROVIDER_CLASSES = {
+    'baostock': BaostockProvider,
+    'akshare': AkshareProvider,
+    'yfinance': YfinanceProvider,
+    'local': LocalProvider,
+}
+
+# worker 进程内的状态：已打开的数据源和对应的令牌桶
+_providers = {}
+_buckets = {}
+_options = {}
+
+
+def _init_worker(workers, provider_kwargs):
+    _options['workers'] = workers
+    _options['provider_kwargs'] = provider_kwargs
+    # worker 进程退出时登出各数据源（进程池的 worker 不会执行 atexit）
+    Finalize(None, _close_worker, exitpriority=10)
+
+
+def _close_worker():
+    for provider in _providers.values():
+        try:
+            provider.close()
+        except Exception:
+            pass
+    _providers.clear()
+
+
+def _get_provider(name):
+    if name not in _providers:
+        provider = PROVIDER_CLASSES[name](**_options.get('provider_kwargs', {}).get(name, {}))
+        provider.open()
+        _providers[name] = provider
+        rate, capacity = RATE_LIMITS[name]
+        workers = _options.get('workers', 1)
+        _buckets[name] = TokenBucket(rate / workers, max(1, capacity // workers))
+    return _providers[name], _buckets[name]
+
+
+def _sync_one(stock_code, start_date, end_date, provider_name, root, retries):
+    market, symbol = resolve_symbol(stock_code)
+    name = provider_name or default_provider(market, symbol)
+
+    def request(symbol, start, end):
+        # 每次请求（包括重试）都先取令牌，重试不会绕过限速
+        provider, bucket = _get_provider(name)
+        with stage('fetch.rate_limit_wait'):
+            bucket.acquire()
+        count(f'requests.{name}')
+        return provider.fetch(symbol, start, end)
+
+    def fetch(symbol, start, end):
+        return call_with_retry(request, symbol, start, end, retries=retries)
+
+    try:
+        with stage('fetch.sync'):
+            status, added = sync_bars(symbol, start_date, end_date, market=market, provider=fetch, root=root)
+    except Exception as e:
+        return stock_code, 'error', 0, str(e), snapshot(reset=True)
+    # 把本次的耗时统计随结果带回主进程
+    return stock_code, status, added, '', snapshot(reset=True)
+
+
+def read_symbols(path):
+    """读取股票列表文件，每行一个代码，# 开头为注释"""
+    symbols = []
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line:
+                symbols.append(line)
+    return symbols
+
+
+def batch_fetch(symbols, start_date=None, end_date=None, provider=None, workers=4, root=None,
+                retries=3, provider_kwargs=None, factors=False):
+    """
+    并发同步一组股票，返回 {代码: (状态, 新增条数, 错误信息)}
+    provider 为空时按市场选择默认数据源
+    factors=True 时K线同步完成后再逐只更新复权因子（因子只在除权除息后变化，不需要每天更新）
+    """
+    end_date = end_date or datetime.now().strftime('%Y%m%d')
+    start_date = start_date or (datetime.now() - timedelta(days=365)).strftime('%Y%m%d')
+    results = {}
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(workers, provider_kwargs or {})) as pool:
+        futures = [pool.submit(_sync_one, code, start_date, end_date, provider, root, retries)
+                   for code in symbols]
+        for done, future in enumerate(as_completed(futures), 1):
+            code, status, count, error, stats = future.result()
+            merge(stats)
+            results[code] = (status, count, error)
+            print(f"[{done}/{len(symbols)}] {code} {status} +{count} {error}".rstrip())
+    if factors:
+        for code, (status, _, _) in results.items():
+            if status == 'error':
+                continue
+            try:
+                with stage('fetch.factors'):
+                    print(f"{code} 复权因子 {sync_factors(code, root=root)} 条")
+            except Exception as e:
+                print(f"{code} 复权因子下载失败：{e}")
+    elapsed = time.time() - started
+    errors = sum(1 for status, _, _ in results.values() if status == 'error')
+    print(f"完成 {len(symbols)} 只股票，失败 {errors} 只，耗时 {elapsed:.1f} 秒")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量增量下载K线到本地仓库")
+    parser.add_argument('symbols', nargs='+', help="股票代码，或以 @ 开头的代码列表文件，如 @watchlist.txt")
+    parser.add_argument('--start', help="开始日期 YYYYMMDD，默认一年前")
+    parser.add_argument('--end', help="结束日期 YYYYMMDD，默认今天")
+    parser.add_argument('--provider', choices=sorted(PROVIDER_CLASSES), help="数据源，默认按市场选择")
+    parser.add_argument('--local-root', help="provider=local 时读取的K线仓库目录")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--root', help="写入的K线仓库目录，默认 bars/")
+    parser.add_argument('--factors', action='store_true', help="同时更新复权因子")
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    symbols = []
+    for item in args.symbols:
+        symbols.extend(read_symbols(item[1:]) if item.startswith('@') else [item])
+    provider_kwargs = {'local': {'root': args.local_root}} if args.local_root else None
+    with profile_from_args('batch_fetch', args):
+        batch_fetch(symbols, args.start, args.end, args.provider, args.workers, args.root,
+                    provider_kwargs=provider_kwargs, factors=args.factors)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+批量生成K线图：K线 + 成交量 + 均线 + 背离标记（经 filter_signals 确认）+ 组合买点（5201.py 的规则，vector_backtest.combo_signals）
+
+多进程并行，子进程使用 Agg 后端（不需要显示器）；字体和图表样式在每个子进程启动时加载一次
+输出 charts/{代码}.png；K线数据和画图参数都没变的股票直接跳过（用 result_cache，图片被删时从缓存恢复）
+"""
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bar_store import resolve_symbol, list_symbols, get_bars
+from batch_fetch import read_symbols
+from vector_backtest import combo_signals
+from analyze_divergence import detect_divergence, filter_signals
+from result_cache import ResultCache
+
+CHART_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'charts')
+# 按顺序找第一个已安装的中文字体
+CJK_FONTS = ['SimHei', 'Microsoft YaHei', 'PingFang SC', 'Noto Sans CJK SC', 'WenQuanYi Micro Hei', 'Source Han Sans SC']
+
+# 子进程内只初始化一次
+_mpf = None
+_style = None
+_cache = None
+
+
+def _init_worker(cache_root=None):
+    """子进程初始化：切换到 Agg 后端，查找中文字体，生成 mplfinance 样式"""
+    global _mpf, _style, _cache
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import font_manager
+    import mplfinance as mpf
+    installed = {f.name for f in font_manager.fontManager.ttflist}
+    fonts = [f for f in CJK_FONTS if f in installed] + ['DejaVu Sans']
+    _style = mpf.make_mpf_style(base_mpf_style='yahoo',
+                                rc={'font.sans-serif': fonts, 'font.family': 'sans-serif', 'axes.unicode_minus': False})
+    _mpf = mpf
+    _cache = ResultCache(cache_root)
+
+
+def chart_data(bars, days=60, lookback=14, threshold=0.05, window=5):
+    """画图用的数据：最近 days 天的K线和三组标记价位（没有标记的位置为 NaN）"""
+    df = bars[['open', 'high', 'low', 'close', 'volume']].astype('float64')
+    df.columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+    divergence = detect_divergence(bars, (lookback,))['divergence_signal']
+    # 在全部历史上确认信号和计算指标，再截取最近 days 天
+    confirmed = filter_signals(divergence, df['Close'], df['High'], df['Low'], threshold, window)
+    buy = pd.Series(combo_signals(bars, divergence), index=df.index)
+    recent = df.iloc[-days:] if days else df
+    markers = {
+        '顶背离': np.where(confirmed.reindex(recent.index) == 1, recent['High'] * 1.01, np.nan),
+        '底背离': np.where(confirmed.reindex(recent.index) == -1, recent['Low'] * 0.99, np.nan),
+        '买点': np.where(buy.reindex(recent.index), recent['Low'] * 0.98, np.nan),
+    }
+    return recent, markers
+
+
+MARKER_STYLES = {
+    '顶背离': dict(marker='v', color='blue', markersize=80),
+    '底背离': dict(marker='^', color='red', markersize=80),
+    '买点': dict(marker='^', color='green', markersize=120),
+}
+
+
+def render_chart(stock_code, output_dir=CHART_ROOT, days=60, lookback=14, threshold=0.05, window=5,
+                 mav=(5, 10, 20)):
+    """在子进程中画一只股票，返回 (代码, 状态)；状态为 生成 / 跳过 / 无数据 / 出错原因"""
+    try:
+        market, symbol = resolve_symbol(stock_code)
+        bars = get_bars(symbol, market=market, adjust='qfq')
+        if bars is None or len(bars) < 2:
+            return stock_code, '无数据'
+        output_file = os.path.join(output_dir, f"{symbol.replace('.', '')}.png")
+
+        def plot(days, lookback, threshold, window, mav):
+            recent, markers = chart_data(bars, days, lookback, threshold, window)
+            # 全是 NaN 的散点图 mplfinance 会报错，没有标记的不画
+            apds = [_mpf.make_addplot(values, type='scatter', alpha=0.8, **MARKER_STYLES[name])
+                    for name, values in markers.items() if not np.isnan(values).all()]
+            _mpf.plot(recent, type='candle', volume=True, addplot=apds, style=_style, mav=mav,
+                      title=f"{symbol} 近{len(recent)}天K线、背离与买点", figratio=(16, 9), figscale=1.2,
+                      savefig=output_file)
+
+        params = {'days': days, 'lookback': lookback, 'threshold': threshold, 'window': window, 'mav': tuple(mav)}
+        _, hit = _cache.memoize('chart', plot, inputs=[bars], params=params, outputs=[output_file])
+        return stock_code, '跳过' if hit else '生成'
+    except Exception as e:
+        return stock_code, f"出错：{e}"
+
+
+def render_all(symbols, output_dir=CHART_ROOT, workers=4, cache_root=None, **params):
+    """多进程批量画图，返回 {状态: [代码]}"""
+    os.makedirs(output_dir, exist_ok=True)
+    result = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_root,)) as pool:
+        futures = [pool.submit(render_chart, code, output_dir, **params) for code in symbols]
+        for done, future in enumerate(as_completed(futures), 1):
+            code, status = future.result()
+            result.setdefault(status if not status.startswith('出错') else '出错', []).append(code)
+            if status.startswith('出错'):
+                print(f"{code} {status}")
+            if done % 50 == 0 or done == len(futures):
+                print(f"[{done}/{len(futures)}] 已完成")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量生成K线图（量价背离、组合买点），数据没变的跳过")
+    parser.add_argument('symbols', nargs='*', help="股票代码，或以 @ 开头的代码列表文件；为空时画本地仓库全部股票")
+    parser.add_argument('--days', type=int, default=60, help="显示最近多少天，0 表示全部")
+    parser.add_argument('--lookback', type=int, default=14, help="背离回看窗口")
+    parser.add_argument('--threshold', type=float, default=0.05, help="背离确认的涨跌幅阈值")
+    parser.add_argument('--window', type=int, default=5, help="背离确认的天数")
+    parser.add_argument('--output-dir', default=CHART_ROOT)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    symbols = []
+    for item in args.symbols:
+        symbols.extend(read_symbols(item[1:]) if item.startswith('@') else [item])
+    if not symbols:
+        symbols = [f"{s}.hk" for s in list_symbols('HK')] + list_symbols('A')
+
+    started = time.time()
+    result = render_all(symbols, args.output_dir, args.workers, days=args.days, lookback=args.lookback,
+                        threshold=args.threshold, window=args.window)
+    counts = '，'.join(f"{status} {len(codes)}" for status, codes in result.items())
+    print(f"共 {len(symbols)} 只股票：{counts}，耗时 {time.time() - started:.1f} 秒，图片在 {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-import akshare as ak
 import pandas as pd
+from bar_store import sync_bars, load_bars
 from datetime import datetime
 
 def get_user_input():
@@ -46,23 +46,17 @@ def main():
         return
     
     try:
-        # 获取股票数据
-        df = ak.stock_hk_hist(
-            symbol=stock_code, 
-            period="daily", 
-            start_date=start_date, 
-            end_date=end_date, 
-            adjust=""
-        )
-        
-        # 保存数据到CSV
-        csv_file = f"{stock_code}_data.csv"
-        df.to_csv(csv_file, encoding='utf-8-sig')
-        print(f"\n{stock_code}股票数据已保存到: {csv_file}")
+        # 增量同步本地K线仓库：已缓存的日期不再重复下载
+        status, count = sync_bars(stock_code, start_date, end_date, market="HK")
+        print(f"\n{stock_code} 同步完成: {status}，新增 {count} 条")
+        df = load_bars(stock_code, "HK", start_date, end_date)
+        if df is None or df.empty:
+            print("未找到股票数据")
+            return
         
         # 显示数据摘要
         print("\n数据摘要:")
-        print(df[['开盘', '收盘', '最高', '最低', '成交量']].describe())
+        print(df[['open', 'close', 'high', 'low', 'volume']].describe())
         
     except Exception as e:
         print(f"获取数据失败: {e}")
@@ -0,0 +1,272 @@
+"""
+多股票向量化技术指标引擎
+
+输入是二维价格面板（行=日期，列=股票），一次计算整个股票池的
+MACD、KDJ、RSI、布林带和均线，代替每只股票单独构造 ta 指标对象
+
+与 ta 库（fillna=False）的一致性：
+  对每只股票单独计算时，所有指标与 ta 的结果在 1e-6 相对误差内一致
+  （滚动均值/标准差用累加和实现，存在 1e-9 量级的浮点误差）
+  面板中上市前的 NaN 与单独计算完全等价；停牌造成的中间 NaN 按
+  pandas 的规则处理：滚动窗口内有 NaN 则结果为 NaN，EMA 按间隔衰减权重
+可以用 check_against_ta(df) 对单只股票做核对
+"""
+import numpy as np
+import pandas as pd
+from adjustment import load_adjusted
+
+PANEL_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def _as_array(x):
+    return np.asarray(x, dtype='f8')
+
+
+def _wrap(values, like):
+    """结果转回与输入相同类型（DataFrame/Series/ndarray）"""
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(values, index=like.index, columns=like.columns)
+    if isinstance(like, pd.Series):
+        return pd.Series(values, index=like.index, name=like.name)
+    return values
+
+
+def ema(x, span=None, alpha=None, min_periods=0):
+    """
+    指数移动平均，等价于 pandas ewm(span/alpha, adjust=False, min_periods).mean()
+    沿时间轴递推，每一步对所有股票同时计算
+    """
+    a = _as_array(x)
+    flat = a.ndim == 1
+    if flat:
+        a = a[:, None]
+    alpha = alpha if alpha is not None else 2.0 / (span + 1.0)
+    out = np.full(a.shape, np.nan)
+    weighted = np.full(a.shape[1], np.nan)
+    old_wt = np.ones(a.shape[1])
+    nobs = np.zeros(a.shape[1], dtype='i8')
+    for t in range(a.shape[0]):
+        cur = a[t]
+        is_obs = ~np.isnan(cur)
+        nobs += is_obs
+        started = ~np.isnan(weighted)
+        old_wt = np.where(started, old_wt * (1 - alpha), old_wt)
+        upd = started & is_obs
+        weighted = np.where(upd, (old_wt * weighted + alpha * cur) / (old_wt + alpha), weighted)
+        old_wt = np.where(upd, 1.0, old_wt)
+        weighted = np.where(~started & is_obs, cur, weighted)
+        out[t] = np.where(nobs >= max(min_periods, 1), weighted, np.nan)
+    out = out[:, 0] if flat else out
+    return _wrap(out, x)
+
+
+def rolling_mean(x, window):
+    """滚动均值（窗口内必须全部有效，否则为 NaN），累加和实现 O(T*N)"""
+    a = _as_array(x)
+    valid = ~np.isnan(a)
+    base = _first_valid(a)
+    csum = np.cumsum(np.where(valid, a - base, 0.0), axis=0)
+    ccnt = np.cumsum(valid, axis=0)
+    out = np.full(a.shape, np.nan)
+    if a.shape[0] >= window:
+        s = csum[window - 1:].copy()
+        c = ccnt[window - 1:].copy()
+        s[1:] -= csum[:-window]
+        c[1:] -= ccnt[:-window]
+        out[window - 1:] = np.where(c == window, s / window + base, np.nan)
+    return _wrap(out, x)
+
+
+def rolling_std(x, window, ddof=0):
+    """滚动标准差，先减去每列首个有效值再累加，降低大数相减的误差"""
+    a = _as_array(x)
+    valid = ~np.isnan(a)
+    d = np.where(valid, a - _first_valid(a), 0.0)
+    csum = np.cumsum(d, axis=0)
+    csq = np.cumsum(d * d, axis=0)
+    ccnt = np.cumsum(valid, axis=0)
+    out = np.full(a.shape, np.nan)
+    if a.shape[0] >= window:
+        s, q, c = csum[window - 1:].copy(), csq[window - 1:].copy(), ccnt[window - 1:].copy()
+        s[1:] -= csum[:-window]
+        q[1:] -= csq[:-window]
+        c[1:] -= ccnt[:-window]
+        var = (q - s * s / window) / (window - ddof)
+        out[window - 1:] = np.where(c == window, np.sqrt(np.maximum(var, 0.0)), np.nan)
+    return _wrap(out, x)
+
+
+def rolling_max(x, window):
+    """滚动最大值，对窗口内每个偏移取一次 maximum，NaN 会传播"""
+    a = _as_array(x)
+    out = np.full(a.shape, np.nan)
+    if a.shape[0] >= window:
+        m = a[window - 1:].copy()
+        for k in range(1, window):
+            m = np.maximum(m, a[window - 1 - k:len(a) - k])
+        out[window - 1:] = m
+    return _wrap(out, x)
+
+
+def rolling_min(x, window):
+    a = _as_array(x)
+    out = np.full(a.shape, np.nan)
+    if a.shape[0] >= window:
+        m = a[window - 1:].copy()
+        for k in range(1, window):
+            m = np.minimum(m, a[window - 1 - k:len(a) - k])
+        out[window - 1:] = m
+    return _wrap(out, x)
+
+
+def forward_max(x, window):
+    """
+    未来 window 天（t+1 .. t+window）的最大值，末尾不足 window 天时取剩余的天数，没有未来数据为 NaN
+    NaN 跳过不传播（与 Series.max() 相同）
+    """
+    a = _as_array(x)
+    out = np.full(a.shape, np.nan)
+    for k in range(1, min(window, len(a) - 1) + 1):
+        out[:-k] = np.fmax(out[:-k], a[k:])
+    return _wrap(out, x)
+
+
+def forward_min(x, window):
+    a = _as_array(x)
+    out = np.full(a.shape, np.nan)
+    for k in range(1, min(window, len(a) - 1) + 1):
+        out[:-k] = np.fmin(out[:-k], a[k:])
+    return _wrap(out, x)
+
+
+def _first_valid(a):
+    """每列第一个有效值，用作累加的基准"""
+    if a.ndim == 1:
+        idx = np.flatnonzero(~np.isnan(a))
+        return a[idx[0]] if len(idx) else 0.0
+    has = ~np.isnan(a)
+    first = np.argmax(has, axis=0)
+    base = a[first, np.arange(a.shape[1])]
+    return np.where(has.any(axis=0), base, 0.0)
+
+
+def macd(close, fast=12, slow=26, signal=9, min_periods=True):
+    """
+    返回 (macd, signal, hist)
+    min_periods=True 与 ta.trend.MACD 一致（前 slow-1 个值为 NaN）
+    min_periods=False 与 5201.py 的 calc_macd 一致（从第一天开始有值）
+    """
+    ema_fast = ema(close, span=fast, min_periods=fast if min_periods else 0)
+    ema_slow = ema(close, span=slow, min_periods=slow if min_periods else 0)
+    dif = _as_array(ema_fast) - _as_array(ema_slow)
+    dea = ema(dif, span=signal, min_periods=signal if min_periods else 0)
+    return _wrap(dif, close), _wrap(dea, close), _wrap(dif - dea, close)
+
+
+def rsi(close, window=14):
+    """与 ta.momentum.RSIIndicator 一致"""
+    c = _as_array(close)
+    diff = np.empty_like(c)
+    diff[0] = np.nan
+    diff[1:] = c[1:] - c[:-1]
+    listed = ~np.isnan(c)
+    up = np.where(diff > 0, diff, 0.0)
+    dn = np.where(diff < 0, -diff, 0.0)
+    # 上市前保持 NaN，使面板结果与单只股票计算一致
+    up = np.where(listed, up, np.nan)
+    dn = np.where(listed, dn, np.nan)
+    emaup = ema(up, alpha=1.0 / window, min_periods=window)
+    emadn = ema(dn, alpha=1.0 / window, min_periods=window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = np.where(emadn == 0, 100.0, 100 - 100 / (1 + emaup / emadn))
+    out = np.where(np.isnan(emadn) | np.isnan(emaup), np.nan, out)
+    return _wrap(out, close)
+
+
+def stochastic(high, low, close, window=14, smooth_window=3):
+    """返回 (k, d, j)，k/d 与 ta.momentum.StochasticOscillator 一致"""
+    smin = rolling_min(low, window)
+    smax = rolling_max(high, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = 100 * (_as_array(close) - smin) / (smax - smin)
+    d = rolling_mean(k, smooth_window)
+    j = 3 * k - 2 * d
+    return _wrap(k, close), _wrap(d, close), _wrap(j, close)
+
+
+def bollinger(close, window=20, window_dev=2):
+    """返回 (upper, middle, lower)，与 ta.volatility.BollingerBands 一致"""
+    mid = _as_array(rolling_mean(close, window))
+    std = _as_array(rolling_std(close, window, ddof=0))
+    return _wrap(mid + window_dev * std, close), _wrap(mid, close), _wrap(mid - window_dev * std, close)
+
+
+def compute_indicators(high, low, close, ma_windows=(5, 10, 20, 60)):
+    """
+    一次计算整个面板的全部指标
+    high/low/close: 同形状的 DataFrame（日期 × 股票）
+    返回 {指标名: DataFrame}，指标名与 calculate_technical_indicators 的列名一致
+    """
+    out = {}
+    out['macd'], out['macd_signal'], out['macd_hist'] = macd(close)
+    out['k'], out['d'], out['j'] = stochastic(high, low, close)
+    out['rsi'] = rsi(close)
+    out['upper'], out['middle'], out['lower'] = bollinger(close)
+    for window in ma_windows:
+        out[f'ma{window}'] = rolling_mean(close, window)
+    return out
+
+
+def load_panel(symbols, market, start=None, end=None, root=None, adjust=None):
+    """
+    从本地K线仓库构建面板，返回 {字段: DataFrame(日期 × 股票)}
+    不同股票的交易日按并集对齐，缺失处为 NaN
+    adjust 为 'qfq'/'hfq' 时按本地复权因子复权
+    """
+    frames = {}
+    for symbol in symbols:
+        df = load_adjusted(symbol, market, start, end, adjust, root)
+        if df is not None and not df.empty:
+            frames[symbol] = df
+    if not frames:
+        return {field: pd.DataFrame() for field in PANEL_FIELDS}
+    joined = pd.concat(frames, axis=1)
+    return {field: joined.xs(field, axis=1, level=1).astype('f8') for field in PANEL_FIELDS}
+
+
+def panel_to_frame(panel, indicators, symbol):
+    """从面板结果中取出单只股票，得到与 calculate_technical_indicators 相同格式的 DataFrame"""
+    df = pd.DataFrame({field: panel[field][symbol] for field in PANEL_FIELDS})
+    for name, values in indicators.items():
+        df[name] = values[symbol]
+    return df.dropna(subset=['close'])
+
+
+def check_against_ta(df):
+    """与 ta 库逐列核对，返回每个指标的最大相对误差"""
+    from ta.trend import MACD, SMAIndicator
+    from ta.momentum import RSIIndicator, StochasticOscillator
+    from ta.volatility import BollingerBands
+    m = MACD(close=df['close'])
+    stoch = StochasticOscillator(high=df['high'], low=df['low'], close=df['close'])
+    bb = BollingerBands(close=df['close'])
+    expected = {
+        'macd': m.macd(), 'macd_signal': m.macd_signal(), 'macd_hist': m.macd_diff(),
+        'k': stoch.stoch(), 'd': stoch.stoch_signal(),
+        'rsi': RSIIndicator(close=df['close']).rsi(),
+        'upper': bb.bollinger_hband(), 'middle': bb.bollinger_mavg(), 'lower': bb.bollinger_lband(),
+    }
+    for window in (5, 10, 20, 60):
+        expected[f'ma{window}'] = SMAIndicator(close=df['close'], window=window).sma_indicator()
+    actual = compute_indicators(df['high'], df['low'], df['close'])
+    errors = {}
+    for name, exp in expected.items():
+        exp = exp.to_numpy(dtype='f8')
+        act = _as_array(actual[name])
+        if not np.array_equal(np.isnan(exp), np.isnan(act)):
+            errors[name] = np.inf
+            continue
+        mask = ~np.isnan(exp)
+        scale = np.maximum(np.abs(exp[mask]), 1.0)
+        errors[name] = float(np.max(np.abs(exp[mask] - act[mask]) / scale)) if mask.any() else 0.0
+    return errors
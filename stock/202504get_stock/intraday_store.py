@@ -0,0 +1,342 @@
+"""
+分钟K线仓库：1 分钟 / 5 分钟K线按月分块存储，按需重采样到 15 分钟、60 分钟、日线
+
+仓库结构（与日线仓库共用 bars/ 目录）：
+  bars/{市场}/{周期}/{代码}/{YYYYMM}.npy     原始分钟K线，结构化数组，按时间升序，mmap 读取
+  bars/{市场}/{周期}_{目标周期}/{代码}/{YYYYMM}.npy   重采样结果缓存（如 1min_15min），源分块更新后自动重算
+一根分钟K线 40 字节，一年 1 分钟K线约 6 万根（2.4MB），只读取请求区间涉及的月份
+
+时间戳为K线结束时间（09:31 表示 09:30-09:31，与 akshare、baostock 一致）
+重采样按交易时段对齐：每个时段从开盘起每 n 分钟一根，午休前后不合并，不跨天，
+标签为这根K线里最后一根分钟K线的时间；用 np.*.reduceat 一次算完，不逐组循环
+逐笔成交可以用 ticks_to_bars 聚合成 1 分钟K线后写入
+"""
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from bar_store import BAR_ROOT, resolve_symbol, get_bars
+from profiler import stage, timed, count
+
+INTRADAY_DTYPE = np.dtype([
+    ('time', 'M8[s]'),
+    ('open', 'f4'),
+    ('high', 'f4'),
+    ('low', 'f4'),
+    ('close', 'f4'),
+    ('volume', 'i8'),
+    ('amount', 'f8'),      # 成交额可以到 1e10 以上，f4 只有 7 位有效数字
+])
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+BASE_FREQS = ['1min', '5min']
+TIMEFRAMES = {'1min': 1, '5min': 5, '15min': 15, '30min': 30, '60min': 60, 'daily': None}
+
+# 各市场的交易时段（分钟K线的结束时间落在 (开始, 结束]）
+SESSIONS = {
+    'A': [('09:30', '11:30'), ('13:00', '15:00')],
+    'HK': [('09:30', '12:00'), ('13:00', '16:00')],
+}
+
+
+def _minutes(hhmm):
+    h, m = hhmm.split(':')
+    return int(h) * 60 + int(m)
+
+
+def chunk_dir(symbol, market, freq, root=None):
+    return os.path.join(root or BAR_ROOT, market.upper(), freq, symbol)
+
+
+def to_records(df):
+    """DataFrame（时间索引，open/high/low/close/volume[/amount]）-> 结构化数组"""
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+    rec = np.empty(len(df), dtype=INTRADAY_DTYPE)
+    rec['time'] = pd.DatetimeIndex(df.index).tz_localize(None).values.astype('M8[s]')
+    for col in PRICE_COLUMNS:
+        rec[col] = df[col].to_numpy(dtype='f4')
+    rec['volume'] = df['volume'].fillna(0).to_numpy(dtype='i8')
+    rec['amount'] = df['amount'].fillna(0).to_numpy(dtype='f8') if 'amount' in df else 0.0
+    return rec
+
+
+def to_frame(rec):
+    return pd.DataFrame({col: np.asarray(rec[col]) for col in INTRADAY_DTYPE.names[1:]},
+                        index=pd.DatetimeIndex(np.asarray(rec['time']).astype('M8[ns]'), name='date'))
+
+
+def _write(path, rec):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        np.save(f, rec)
+    os.replace(tmp, path)
+
+
+def _months(rec):
+    """每条记录所在的月份 YYYYMM"""
+    return np.asarray(rec['time']).astype('M8[M]').astype('i8')
+
+
+def _month_name(m):
+    return f"{1970 + m // 12}{m % 12 + 1:02d}"
+
+
+def save_intraday(df, symbol, market, freq='1min', root=None):
+    """按月写入，与已有分块合并（同一时间以新数据为准），返回写入的分块数"""
+    rec = to_records(df)
+    if len(rec) == 0:
+        return 0
+    folder = chunk_dir(symbol, market, freq, root)
+    months = _months(rec)
+    bounds = np.flatnonzero(np.diff(months)) + 1
+    for part in np.split(rec, bounds):
+        path = os.path.join(folder, f"{_month_name(_months(part[:1])[0])}.npy")
+        if os.path.exists(path):
+            old = _load_chunk(path)
+            old = old[~np.isin(old['time'], part['time'])]
+            part = np.sort(np.concatenate([old, part]), order='time')
+        _write(path, part)
+    count('rows.intraday_saved', len(rec))
+    return len(bounds) + 1
+
+
+def _load_chunk(path):
+    """mmap 读取一个分块；旧版本（成交额为 f4）的分块转换成当前的 INTRADAY_DTYPE"""
+    rec = np.load(path, mmap_mode='r')
+    return rec if rec.dtype == INTRADAY_DTYPE else rec.astype(INTRADAY_DTYPE)
+
+
+def _chunk_files(folder, start=None, end=None):
+    if not os.path.isdir(folder):
+        return []
+    names = sorted(f for f in os.listdir(folder) if f.endswith('.npy'))
+    lo = pd.Timestamp(start).strftime('%Y%m') if start is not None else None
+    hi = pd.Timestamp(end).strftime('%Y%m') if end is not None else None
+    return [os.path.join(folder, f) for f in names
+            if (lo is None or f[:6] >= lo) and (hi is None or f[:6] <= hi)]
+
+
+def _slice(rec, start=None, end=None):
+    times = rec['time']
+    lo = 0 if start is None else np.searchsorted(times, np.datetime64(pd.Timestamp(start), 's'), side='left')
+    hi = len(rec) if end is None else np.searchsorted(
+        times, np.datetime64(pd.Timestamp(end).normalize() + pd.Timedelta(days=1), 's'), side='left')
+    return rec[lo:hi]
+
+
+def load_records(symbol, market, freq='1min', start=None, end=None, root=None):
+    """读取 [start, end] 的分钟K线结构化数组（end 含当天），没有数据返回 None"""
+    files = _chunk_files(chunk_dir(symbol, market, freq, root), start, end)
+    if not files:
+        return None
+    parts = [_slice(_load_chunk(path), start, end) for path in files]
+    return np.concatenate(parts) if len(parts) > 1 else np.array(parts[0])
+
+
+def load_intraday(symbol, market, freq='1min', start=None, end=None, root=None):
+    rec = load_records(symbol, market, freq, start, end, root)
+    return None if rec is None else to_frame(rec)
+
+
+def bucket_ids(times, market, minutes):
+    """
+    每根分钟K线属于当天哪一根 minutes 分钟K线（minutes=None 表示日线，整天一组）
+    每个交易时段单独从头切分，午休前后的K线不合并；返回 (日期序号, 组号)
+    """
+    t = np.asarray(times).astype('M8[m]').astype('i8')
+    day = t // 1440
+    if minutes is None:
+        return day, np.zeros_like(day)
+    clock = t - day * 1440
+    begins = np.array([_minutes(b) for b, _ in SESSIONS[market.upper()]])
+    lengths = np.array([_minutes(e) - _minutes(b) for b, e in SESSIONS[market.upper()]])
+    # 所在时段：开始时间在它之前的最后一个时段；时段以外的K线（集合竞价、收盘竞价）并入最近的一组
+    session = np.clip(np.searchsorted(begins, clock, side='left') - 1, 0, len(begins) - 1)
+    # 时段开盘后的第几分钟，结束时间 09:31 -> 0
+    offset = np.clip(clock - begins[session] - 1, 0, lengths[session] - 1)
+    return day, session * 10000 + offset // minutes
+
+
+def _aggregate(rec, starts):
+    """按组起点聚合成K线：开盘取第一根，收盘和时间取最后一根，最高/最低/成交量/成交额用 reduceat"""
+    ends = np.append(starts[1:], len(rec)) - 1
+    out = np.empty(len(starts), dtype=INTRADAY_DTYPE)
+    out['time'] = rec['time'][ends]
+    out['open'] = rec['open'][starts]
+    out['close'] = rec['close'][ends]
+    out['high'] = np.maximum.reduceat(rec['high'], starts)
+    out['low'] = np.minimum.reduceat(rec['low'], starts)
+    out['volume'] = np.add.reduceat(rec['volume'], starts)
+    out['amount'] = np.add.reduceat(rec['amount'], starts)
+    return out
+
+
+def resample_records(rec, market, timeframe):
+    """把按时间升序的分钟K线重采样成 timeframe（15min/60min/daily 等）"""
+    if len(rec) == 0:
+        return rec[:0]
+    day, bucket = bucket_ids(rec['time'], market, TIMEFRAMES[timeframe])
+    # 数据按时间排好序，同一组连续，组的起点是 (日期, 组号) 变化的位置
+    change = np.ones(len(rec), dtype=bool)
+    change[1:] = (day[1:] != day[:-1]) | (bucket[1:] != bucket[:-1])
+    return _aggregate(rec, np.flatnonzero(change))
+
+
+@timed('intraday.resample')
+def load_resampled(symbol, market, timeframe='15min', base='1min', start=None, end=None, root=None):
+    """
+    读取重采样后的K线；每个月的结果缓存在 {base}_{timeframe} 目录（目录名不能有 Windows 不允许的字符），
+    源分块比缓存新（重新下载、追加）时重算这个月
+    """
+    if timeframe == base:
+        return load_intraday(symbol, market, base, start, end, root)
+    source_dir = chunk_dir(symbol, market, base, root)
+    cache_dir = chunk_dir(symbol, market, f"{base}_{timeframe}", root)
+    parts = []
+    for path in _chunk_files(source_dir, start, end):
+        cached = os.path.join(cache_dir, os.path.basename(path))
+        if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+            out = _load_chunk(cached)
+            count('intraday.cache_hit')
+        else:
+            out = resample_records(_load_chunk(path), market, timeframe)
+            _write(cached, out)
+            count('intraday.cache_miss')
+        parts.append(_slice(out, start, end))
+    if not parts:
+        return None
+    return to_frame(np.concatenate(parts))
+
+
+def ticks_to_bars(times, prices, volumes):
+    """
+    逐笔成交 -> 1 分钟K线（结束时间标签），times 为 datetime64 数组，需按时间升序
+    成交时间正好落在整分钟的算作前一分钟（09:31:00 属于 09:30-09:31）
+    """
+    t = np.asarray(times).astype('M8[s]')
+    rec = np.zeros(len(t), dtype=INTRADAY_DTYPE)
+    rec['time'] = (t - np.timedelta64(1, 's')).astype('M8[m]') + np.timedelta64(1, 'm')
+    for col in PRICE_COLUMNS:
+        rec[col] = prices
+    rec['volume'] = volumes
+    rec['amount'] = np.asarray(prices, dtype='f8') * np.asarray(volumes, dtype='f8')
+    starts = np.flatnonzero(np.r_[True, rec['time'][1:] != rec['time'][:-1]])
+    return to_frame(_aggregate(rec, starts))
+
+
+# ---------- 下载 ----------
+
+@timed('fetch.akshare_min')
+def fetch_akshare_hk_min(symbol, start_date, end_date, freq='1min'):
+    """akshare 港股分钟K线（东方财富），freq 为 1min/5min"""
+    import akshare as ak
+    count('api_calls.akshare')
+    df = ak.stock_hk_hist_min_em(symbol=symbol, period=freq[:-3], adjust='',
+                                 start_date=f"{start_date[:4]}-{start_date[4:6]}-{start_date[6:]} 09:00:00",
+                                 end_date=f"{end_date[:4]}-{end_date[4:6]}-{end_date[6:]} 17:00:00")
+    if df is None or df.empty:
+        return None
+    df = df.rename(columns={'时间': 'date', '开盘': 'open', '最高': 'high', '最低': 'low', '收盘': 'close',
+                            '成交量': 'volume', '成交额': 'amount'})
+    df['date'] = pd.to_datetime(df['date'])
+    return df.set_index('date')[PRICE_COLUMNS + ['volume', 'amount']]
+
+
+@timed('fetch.baostock_min')
+def fetch_baostock_a_min(symbol, start_date, end_date, freq='5min'):
+    """baostock A股分钟K线（不复权，复权见 adjustment），baostock 只提供 5/15/30/60 分钟"""
+    import baostock as bs
+    if freq == '1min':
+        raise ValueError("baostock 不提供 1 分钟K线")
+    with stage('fetch.baostock_login'):
+        bs.login()
+    try:
+        count('api_calls.baostock')
+        rs = bs.query_history_k_data_plus(
+            symbol, "time,open,high,low,close,volume,amount",
+            start_date=f"{start_date[:4]}-{start_date[4:6]}-{start_date[6:]}",
+            end_date=f"{end_date[:4]}-{end_date[4:6]}-{end_date[6:]}",
+            frequency=freq[:-3], adjustflag="3")
+        rows = []
+        while (rs.error_code == '0') & rs.next():
+            rows.append(rs.get_row_data())
+    finally:
+        bs.logout()
+    if not rows:
+        return None
+    df = pd.DataFrame(rows, columns=['time'] + PRICE_COLUMNS + ['volume', 'amount'])
+    df = df.replace('', np.nan).dropna(subset=['close'])
+    for col in PRICE_COLUMNS + ['volume', 'amount']:
+        df[col] = pd.to_numeric(df[col])
+    # time 格式为 YYYYMMDDHHMMSSsss
+    df['date'] = pd.to_datetime(df['time'].str[:14], format='%Y%m%d%H%M%S')
+    return df.set_index('date').drop(columns='time')
+
+
+@timed('fetch.yfinance_min')
+def fetch_yfinance_hk_min(symbol, start_date, end_date, freq='1min'):
+    """yfinance 港股分钟K线（1 分钟只能取最近 7 天，不复权），时间戳改为结束时间"""
+    import yfinance as yf
+    count('api_calls.yfinance')
+    minutes = int(freq[:-3])
+    df = yf.Ticker(f"{symbol.lstrip('0').zfill(4)}.HK").history(
+        start=datetime.strptime(start_date, '%Y%m%d'),
+        end=datetime.strptime(end_date, '%Y%m%d') + timedelta(days=1), interval=f"{minutes}m",
+        auto_adjust=False, actions=False)
+    if df.empty:
+        return None
+    df = df.rename(columns={'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'})
+    df.index = df.index.tz_convert('Asia/Hong_Kong').tz_localize(None) + pd.Timedelta(minutes=minutes)
+    return df[PRICE_COLUMNS + ['volume']]
+
+
+INTRADAY_PROVIDERS = {
+    'HK': fetch_akshare_hk_min,
+    'A': fetch_baostock_a_min,
+}
+
+
+def sync_intraday(stock_code, start_date=None, end_date=None, freq=None, market=None, provider=None, root=None):
+    """
+    增量下载分钟K线：从本地最后一根所在的交易日开始（当天可能不完整）重新下载
+    freq 默认港股 1min、A股 5min；返回 (周期, 新写入条数)
+    """
+    market, symbol = resolve_symbol(stock_code, market)
+    freq = freq or ('1min' if market == 'HK' else '5min')
+    end_date = end_date or datetime.now().strftime('%Y%m%d')
+    files = _chunk_files(chunk_dir(symbol, market, freq, root))
+    if files:
+        last = np.load(files[-1], mmap_mode='r')['time'][-1]
+        start_date = pd.Timestamp(last).strftime('%Y%m%d')
+    else:
+        start_date = start_date or (datetime.now() - timedelta(days=30)).strftime('%Y%m%d')
+    fetch = provider or INTRADAY_PROVIDERS[market]
+    df = fetch(symbol, start_date, end_date, freq)
+    if df is None or df.empty:
+        return freq, 0
+    save_intraday(df, symbol, market, freq, root)
+    return freq, len(df)
+
+
+def get_timeframe_bars(stock_code, timeframe='daily', start=None, end=None, market=None, root=None, adjust=None):
+    """
+    任意周期的K线，列与 get_bars 相同（open/high/low/close/volume）
+    daily 优先读日线仓库；分钟周期由本地 1 分钟（没有时 5 分钟）K线重采样
+    adjust 为 'qfq'/'hfq' 时按日线的复权因子复权（分钟K线同样存不复权数据）
+    """
+    market, symbol = resolve_symbol(stock_code, market)
+    if timeframe == 'daily':
+        df = get_bars(symbol, start, end, market=market, root=root, adjust=adjust)
+        if df is not None:
+            return df
+    minutes = TIMEFRAMES[timeframe] or 1440
+    for base in BASE_FREQS:
+        if TIMEFRAMES[base] <= minutes and _chunk_files(chunk_dir(symbol, market, base, root)):
+            df = load_resampled(symbol, market, timeframe, base, start, end, root)
+            if df is None:
+                return None
+            if adjust:
+                from adjustment import adjust_bars
+                df = adjust_bars(df, symbol, market, adjust, root)
+            return df[PRICE_COLUMNS + ['volume']]
+    return None
@@ -0,0 +1,15 @@
+"""
+各市场的交易规则：每手股数、是否 T+1
+模拟盘（paper_trading）、组合回测（portfolio_backtest）、滚动窗口评估（walk_forward）共用
+"""
+
+# A股每手 100 股；港股每手股数各不相同，没有列出的按 100
+LOT_SIZES = {'01810': 200, '06186': 1000}
+T_PLUS_ONE = {'A': True, 'HK': False}
+
+
+def lot_size(symbol, market):
+    """每手股数：A股、ETF 100 股，可转债（沪市 11xxxx、深市 12xxxx）10 张，港股按 LOT_SIZES"""
+    if market == 'A':
+        return 10 if symbol.split('.')[-1].startswith(('11', '12')) else 100
+    return LOT_SIZES.get(symbol, 100)
@@ -0,0 +1,102 @@
+import time
+import random
+import argparse
+import itertools
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from bar_store import resolve_symbol
+from batch_fetch import read_symbols
+from quant_trading_strategy import load_frame, build_cerebro, collect_metrics
+
+# 默认扫描的参数网格
+PARAM_GRID = {
+    'fast': [3, 5, 8, 10, 13],
+    'slow': [20, 30, 40, 60],
+    'stop_loss': [0.02, 0.03, 0.05, 0.08],
+    'take_profit': [0.05, 0.08, 0.12, 0.2],
+    'volume_filter': [0, 1.2, 1.5],
+}
+
+# 扫描时固定的参数：关闭逐K线日志，改为金叉建仓
+FIXED_PARAMS = {'verbose': False, 'entry_price': None}
+
+# worker 进程内预加载的数据，{代码: DataFrame}
+_frames = {}
+
+
+def grid_params(grid):
+    keys = list(grid)
+    for values in itertools.product(*(grid[k] for k in keys)):
+        params = dict(zip(keys, values))
+        if params.get('fast', 0) < params.get('slow', 1):
+            yield params
+
+
+def random_params(grid, n_iter, seed=0):
+    """从网格中不重复地随机抽取 n_iter 组参数"""
+    combos = list(grid_params(grid))
+    random.Random(seed).shuffle(combos)
+    return combos[:n_iter]
+
+
+def _load_frames(codes):
+    for code in codes:
+        if code not in _frames:
+            market, symbol = resolve_symbol(code)
+            _frames[code] = load_frame(symbol, market)
+
+
+def run_one(code, params, cash=20000.0):
+    """在 worker 中运行一次回测，不画图、不打印"""
+    df = _frames[code]
+    cerebro = build_cerebro(df, cash=cash, stdstats=False, **FIXED_PARAMS, **params)
+    strat = cerebro.run()[0]
+    return {'code': code, **params, **collect_metrics(cerebro, strat)}
+
+
+def _run_batch(tasks, cash):
+    return [run_one(code, params, cash) for code, params in tasks]
+
+
+def optimize(codes, combos, workers=None, cash=20000.0, batch_size=20):
+    """
+    对每只股票 × 每组参数回测，返回结果表
+    数据在主进程加载一次，fork 出的 worker 直接共享（spawn 平台在 worker 初始化时各加载一次）
+    """
+    _load_frames(codes)
+    tasks = [(code, params) for code in codes for params in combos]
+    batches = [tasks[i:i + batch_size] for i in range(0, len(tasks), batch_size)]
+    rows = []
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_frames, initargs=(codes,)) as pool:
+        for done, result in enumerate(pool.map(_run_batch, batches, [cash] * len(batches)), 1):
+            rows.extend(result)
+            if done % 10 == 0 or done == len(batches):
+                print(f"[{len(rows)}/{len(tasks)}] 耗时 {time.time() - started:.1f} 秒")
+    result = pd.DataFrame(rows)
+    return result.sort_values(['sharpe', 'annual_return'], ascending=False, na_position='last').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DualMovingAverageStrategy 参数扫描")
+    parser.add_argument('symbols', nargs='+', help="股票代码，或以 @ 开头的代码列表文件")
+    parser.add_argument('--random', type=int, help="随机搜索的组合数，默认遍历整个网格")
+    parser.add_argument('--workers', type=int, help="进程数，默认使用全部 CPU")
+    parser.add_argument('--cash', type=float, default=20000.0)
+    parser.add_argument('--output', default='optimize_result.csv')
+    args = parser.parse_args()
+
+    codes = []
+    for item in args.symbols:
+        codes.extend(read_symbols(item[1:]) if item.startswith('@') else [item])
+    combos = random_params(PARAM_GRID, args.random) if args.random else list(grid_params(PARAM_GRID))
+    print(f"{len(codes)} 只股票 × {len(combos)} 组参数")
+
+    result = optimize(codes, combos, args.workers, args.cash)
+    result.to_csv(args.output, index=False, encoding='utf-8-sig')
+    print(result.head(10).to_string())
+    print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
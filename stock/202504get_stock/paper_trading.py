@@ -0,0 +1,409 @@
+"""
+模拟盘：asyncio 逐根K线驱动 DualMovingAverageStrategy 的交易逻辑，同时盯几十只股票
+
+行情来源可替换，只要是逐根产出 Bar 的异步迭代器即可：
+  ReplayFeed   从本地K线仓库按时间顺序回放（多只股票按时间合并）
+  SocketFeed   从 TCP 行情服务读取，每行一根K线的 JSON
+  ReplayServer 本地回放服务器，按 SocketFeed 的格式推送仓库里的K线，代替实时行情做联调
+
+每只股票一个 SymbolState：
+  均线、成交量均线用 streaming_indicators 增量更新，每根K线 O(1)
+  挂单撮合与 vector_backtest.run_backtest 相同（收盘挂限价买单，下一根K线开盘撮合；
+  卖出信号/止损/止盈下一根开盘市价卖出），A股 T+1、整手交易，可选 fee_model 费率
+  和回测一样每只股票独立记账
+与 quant_trading_strategy 的区别：价格不再放大 100 倍，默认金叉+放量建仓（不使用写死的 entry_price），
+默认按可用资金全仓买入
+
+每根K线从收到到决策完成的耗时记在 latency 里，结束时打印 p50/p95/p99/最大值
+"""
+import json
+import math
+import time
+import asyncio
+import argparse
+import numpy as np
+import pandas as pd
+from bar_store import resolve_symbol, get_bars
+from streaming_indicators import SMA
+from market_rules import T_PLUS_ONE, lot_size
+from profiler import stage, count, add_profile_args, profile_from_args
+
+NAN = float('nan')
+
+# 与 DualMovingAverageStrategy.params 对应；entry_price=None 为金叉建仓，size=None 为全仓
+DEFAULT_PARAMS = {
+    'fast': 5,
+    'slow': 20,
+    'stop_loss': 0.03,
+    'take_profit': 0.08,
+    'volume_filter': 1.5,
+    'entry_price': None,
+    'size': None,
+}
+
+
+class Bar:
+    """一根K线；received 为收到的时刻（perf_counter），用来计算决策延迟"""
+    __slots__ = ('symbol', 'market', 'time', 'open', 'high', 'low', 'close', 'volume', 'received')
+
+    def __init__(self, symbol, market, time_, open_, high, low, close, volume, received=None):
+        self.symbol, self.market, self.time = symbol, market, pd.Timestamp(time_)
+        self.open, self.high, self.low, self.close = float(open_), float(high), float(low), float(close)
+        self.volume = float(volume)
+        self.received = received
+
+    def to_json(self):
+        return json.dumps({'symbol': self.symbol, 'market': self.market, 'time': self.time.isoformat(),
+                           'open': self.open, 'high': self.high, 'low': self.low, 'close': self.close,
+                           'volume': self.volume})
+
+    @classmethod
+    def from_json(cls, line):
+        d = json.loads(line)
+        return cls(d['symbol'], d['market'], d['time'], d['open'], d['high'], d['low'], d['close'], d['volume'],
+                   time.perf_counter())
+
+
+# ---------- 行情 ----------
+
+def load_frames(symbols, start=None, end=None, adjust=None):
+    """从K线仓库读取 {(市场, 代码): DataFrame}"""
+    frames = {}
+    for code in symbols:
+        market, symbol = resolve_symbol(code)
+        df = get_bars(symbol, start, end, market=market, adjust=adjust)
+        if df is None or df.empty:
+            print(f"{symbol} 本地没有K线，跳过")
+            continue
+        frames[(market, symbol)] = df.astype('f8')
+    return frames
+
+
+def merge_frames(frames):
+    """把多只股票的K线按时间合并成一张表，同一时刻按代码顺序"""
+    parts = [df.assign(market=market, symbol=symbol) for (market, symbol), df in frames.items()]
+    merged = pd.concat(parts).rename_axis('time').reset_index()
+    return merged.sort_values(['time', 'symbol'], kind='stable').reset_index(drop=True)
+
+
+def iter_rows(merged):
+    cols = ['symbol', 'market', 'time', 'open', 'high', 'low', 'close', 'volume']
+    return zip(*(merged[c].tolist() for c in cols))
+
+
+class ReplayFeed:
+    """本地回放：interval 为相邻两个时刻之间的等待秒数（0 表示尽快回放）"""
+
+    def __init__(self, frames, interval=0.0):
+        self.merged = merge_frames(frames)
+        self.interval = interval
+
+    async def __aiter__(self):
+        last = None
+        for row in iter_rows(self.merged):
+            if row[2] != last:
+                if last is not None:
+                    await asyncio.sleep(self.interval)
+                last = row[2]
+            yield Bar(*row, received=time.perf_counter())
+
+
+class SocketFeed:
+    """从 TCP 行情服务读取，每行一根K线（Bar.to_json 的格式），服务端断开时结束"""
+
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.host, self.port = host, port
+
+    async def __aiter__(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                count('feed.bytes', len(line))
+                yield Bar.from_json(line)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+
+class ReplayServer:
+    """本地回放行情服务器：每个连接从头推送一遍仓库里的K线，推完断开"""
+
+    def __init__(self, frames, interval=0.0, host='127.0.0.1', port=0):
+        self.merged = merge_frames(frames)
+        self.interval, self.host, self.port = interval, host, port
+        self.server = None
+
+    async def _handle(self, reader, writer):
+        last = None
+        try:
+            for row in iter_rows(self.merged):
+                if row[2] != last:
+                    if last is not None:
+                        await writer.drain()
+                        await asyncio.sleep(self.interval)
+                    last = row[2]
+                writer.write((Bar(*row).to_json() + '\n').encode())
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+# ---------- 策略与模拟撮合 ----------
+
+class SymbolState:
+    """单只股票的指标状态、持仓和挂单"""
+
+    def __init__(self, symbol, market, params, cash, fee_fn=None):
+        self.symbol, self.market, self.p = symbol, market, params
+        self.lot = lot_size(symbol, market)
+        self.t_plus_one = T_PLUS_ONE.get(market, False)
+        self.fee_fn = fee_fn
+        self.fast_ma, self.slow_ma = SMA(params['fast']), SMA(params['slow'])
+        self.volume_ma = SMA(params['slow'])
+        self.nzd = NAN     # 上一次非零的 快线-慢线，与 backtrader CrossOver 相同
+        self.bars = 0
+        self.cash = float(cash)
+        self.shares = 0.0
+        self.pending = None  # 'buy' / 'sell'
+        self.limit = self.order_size = NAN
+        self.stop, self.target = -math.inf, math.inf
+        self.buy_day = None
+        self.entry = None    # (时间, 价格, 费用)
+        self.last_close = NAN
+        self.trades = []
+
+    def fee(self, amount, sell):
+        if self.fee_fn is None:
+            return 0.0
+        return float(np.asarray(self.fee_fn(amount, sell), dtype='f8').ravel()[0])
+
+    def update_indicators(self, bar):
+        """更新均线，返回交叉方向（1 金叉，-1 死叉，0 无）"""
+        fast = self.fast_ma.update(bar.close)
+        slow = self.slow_ma.update(bar.close)
+        self.volume_ma.update(bar.volume)
+        diff = fast - slow
+        cross = 0
+        if self.nzd < 0 < diff:
+            cross = 1
+        elif self.nzd > 0 > diff:
+            cross = -1
+        if diff != 0 and not math.isnan(diff):
+            self.nzd = diff
+        self.bars += 1
+        return cross
+
+    def match(self, bar):
+        """开盘撮合挂单，返回成交事件"""
+        if self.pending == 'sell' and not math.isnan(bar.open):
+            if not self.t_plus_one or bar.time.normalize() > self.buy_day:
+                amount = self.shares * bar.open
+                f = self.fee(amount, True)
+                entry_time, entry_px, entry_fee = self.entry
+                pnl = amount - self.shares * entry_px - f - entry_fee
+                self.trades.append((self.symbol, entry_time, bar.time, self.shares, entry_px, bar.open, pnl))
+                self.cash += amount - f
+                self.shares, self.pending = 0.0, None
+                return ('sell', bar.open)
+        elif self.pending == 'buy':
+            if bar.open <= self.limit:
+                px = bar.open
+            elif bar.low <= self.limit:
+                px = self.limit
+            else:
+                return None  # 价格没到，限价单继续挂着
+            amount = self.order_size * px
+            f = self.fee(amount, False)
+            self.pending = None
+            if amount + f > self.cash:
+                return ('cancel', px)
+            self.cash -= amount + f
+            self.shares = self.order_size
+            self.entry = (bar.time, px, f)
+            self.buy_day = bar.time.normalize()
+            return ('buy', px)
+        return None
+
+    def decide(self, bar, cross):
+        """收盘决策：与 DualMovingAverageStrategy.next 相同的条件，返回新挂单"""
+        p = self.p
+        # backtrader 在慢线有值之后才调用 next
+        if self.pending or math.isnan(bar.close) or self.bars <= p['slow']:
+            return None
+        if self.shares > 0:
+            if cross < 0 or bar.close <= self.stop or bar.close >= self.target:
+                self.pending = 'sell'
+                return ('order_sell', bar.close)
+            return None
+        if p['entry_price'] is None:
+            enter = cross > 0 and (not p['volume_filter'] or
+                                   bar.volume >= p['volume_filter'] * self.volume_ma.value)
+        else:
+            enter = bar.close <= p['entry_price']
+        if not enter:
+            return None
+        if p['size'] is not None:
+            qty = math.floor(p['size'] / self.lot) * self.lot
+        else:
+            qty = math.floor((self.cash - self.fee(self.cash, False)) / bar.close / self.lot) * self.lot
+        if qty <= 0:
+            return None
+        self.pending, self.order_size, self.limit = 'buy', qty, bar.close
+        self.stop = bar.close * (1 - p['stop_loss']) if p['stop_loss'] is not None else -math.inf
+        self.target = bar.close * (1 + p['take_profit']) if p['take_profit'] is not None else math.inf
+        return ('order_buy', bar.close)
+
+    def on_bar(self, bar):
+        fill = self.match(bar)
+        if not math.isnan(bar.close):
+            self.last_close = bar.close
+        cross = self.update_indicators(bar)
+        return fill, self.decide(bar, cross)
+
+    def value(self):
+        return self.cash + self.shares * (0.0 if math.isnan(self.last_close) else self.last_close)
+
+
+class PaperTrader:
+    """消费行情、分发给各股票的 SymbolState，记录每根K线的决策延迟"""
+
+    def __init__(self, params=None, cash=20000.0, fee_fns=None, verbose=True):
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        self.cash = cash
+        self.fee_fns = fee_fns or {}
+        self.verbose = verbose
+        self.states = {}
+        self.latency = []
+
+    def state(self, symbol, market):
+        s = self.states.get(symbol)
+        if s is None:
+            s = self.states[symbol] = SymbolState(symbol, market, self.params, self.cash,
+                                                  self.fee_fns.get(symbol))
+        return s
+
+    def warmup(self, frames):
+        """用历史K线预热指标（不下单），实盘开始时信号立即可用"""
+        for (market, symbol), df in frames.items():
+            s = self.state(symbol, market)
+            for row in df.itertuples():
+                s.update_indicators(Bar(symbol, market, row.Index, row.open, row.high, row.low, row.close,
+                                        row.volume))
+
+    def on_bar(self, bar):
+        fill, order = self.state(bar.symbol, bar.market).on_bar(bar)
+        if bar.received is not None:
+            self.latency.append(time.perf_counter() - bar.received)
+        count('paper.bars')
+        if self.verbose:
+            for event in (fill, order):
+                if event:
+                    print(f"{bar.time:%Y-%m-%d %H:%M} {bar.symbol} {event[0]} @ {event[1]:.3f}")
+
+    async def run(self, feed):
+        with stage('paper.run'):
+            async for bar in feed:
+                self.on_bar(bar)
+
+    def trades(self):
+        rows = [t for s in self.states.values() for t in s.trades]
+        return pd.DataFrame(rows, columns=['symbol', 'entry_date', 'exit_date', 'shares', 'entry_price',
+                                           'exit_price', 'pnl'])
+
+    def summary(self):
+        trades = self.trades()
+        rows = []
+        for symbol, s in sorted(self.states.items()):
+            done = trades[trades['symbol'] == symbol]
+            rows.append([symbol, s.market, round(s.value(), 2), s.shares, s.pending or '', len(done),
+                         round(float(done['pnl'].sum()), 2)])
+        return pd.DataFrame(rows, columns=['代码', '市场', '资产', '持仓', '挂单', '交易次数', '已实现盈亏'])
+
+    def latency_stats(self):
+        """每根K线决策延迟（毫秒）"""
+        if not self.latency:
+            return {}
+        ms = np.asarray(self.latency) * 1000
+        return {'bars': len(ms), 'p50': round(float(np.percentile(ms, 50)), 4),
+                'p95': round(float(np.percentile(ms, 95)), 4), 'p99': round(float(np.percentile(ms, 99)), 4),
+                'max': round(float(ms.max()), 4)}
+
+
+def check_against_vector(frames, trader):
+    """用 vector_backtest 回测同样的数据和参数，逐只比较最终资产"""
+    from vector_backtest import run_backtest, dual_ma_signals
+    p = trader.params
+    rows = []
+    for (market, symbol), df in frames.items():
+        entries, exits = dual_ma_signals(df['close'], df['volume'], p['fast'], p['slow'],
+                                         p['volume_filter'], p['entry_price'])
+        fee_fn = trader.fee_fns.get(symbol)
+        result = run_backtest(df['open'], df['high'], df['low'], df['close'], entries, exits,
+                              p['stop_loss'], p['take_profit'], cash=trader.cash, size=p['size'],
+                              lot_size=lot_size(symbol, market), dates=df.index,
+                              t_plus_one=T_PLUS_ONE.get(market, False), fee_fn=fee_fn)
+        rows.append([symbol, trader.states[symbol].value(), float(result['value'].iloc[-1, 0])])
+    return pd.DataFrame(rows, columns=['代码', '模拟盘', '向量化回测'])
+
+
+async def run_paper(frames, trader, interval=0.0, server=False):
+    """server=True 时启动本地回放服务器，通过 TCP 接收行情；否则直接回放"""
+    if not server:
+        await trader.run(ReplayFeed(frames, interval))
+        return
+    replay = await ReplayServer(frames, interval).start()
+    print(f"本地回放服务器 127.0.0.1:{replay.port}")
+    try:
+        await trader.run(SocketFeed('127.0.0.1', replay.port))
+    finally:
+        await replay.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="双均线策略模拟盘（本地回放 / TCP 行情）")
+    parser.add_argument('symbols', nargs='+', help="股票代码，如 09988.hk、sh.600519")
+    parser.add_argument('--start', help="回放开始日期 YYYYMMDD")
+    parser.add_argument('--end', help="回放结束日期 YYYYMMDD")
+    parser.add_argument('--interval', type=float, default=0.0, help="每个时刻之间等待的秒数，0 为尽快回放")
+    parser.add_argument('--server', action='store_true', help="通过本地回放服务器（TCP）推送行情")
+    parser.add_argument('--cash', type=float, default=20000.0, help="每只股票的初始资金")
+    parser.add_argument('--fast', type=int, default=DEFAULT_PARAMS['fast'])
+    parser.add_argument('--slow', type=int, default=DEFAULT_PARAMS['slow'])
+    parser.add_argument('--fees', action='store_true', help="按 fee_model 费率表计算交易费用")
+    parser.add_argument('--adjust', choices=['qfq', 'hfq'], help="复权方式，默认不复权")
+    parser.add_argument('--check', action='store_true', help="与 vector_backtest 的回测结果核对")
+    parser.add_argument('--quiet', action='store_true', help="不打印逐笔成交")
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    frames = load_frames(args.symbols, args.start, args.end, args.adjust)
+    if not frames:
+        return
+    fee_fns = {}
+    if args.fees:
+        from quant_trading_strategy import load_fee_fn
+        fee_fns = {symbol: load_fee_fn(symbol, market) for market, symbol in frames}
+    trader = PaperTrader({'fast': args.fast, 'slow': args.slow}, args.cash, fee_fns, verbose=not args.quiet)
+    with profile_from_args('paper_trading', args):
+        asyncio.run(run_paper(frames, trader, args.interval, args.server))
+
+    print(trader.summary().to_string(index=False))
+    print(f"决策延迟（毫秒）：{trader.latency_stats()}")
+    if args.check:
+        print(check_against_vector(frames, trader).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+组合回测：A股、场内ETF、港股通共用一个人民币资金池，按规则定期调仓
+
+  日历    所有股票交易日的并集；某只股票当天没有K线（停牌、本市场休市）就不能成交，估值沿用最近收盘价
+          港股通只在沪深和香港都开市的日子交易（connect_calendar=True，按组合里A股的K线判断）
+  汇率    港股价格按当天的 港元->人民币 汇率折算；汇率取对账单备注中的港股通结算汇率，没有时用 HK_DEFAULT_RATE
+  调仓    rule(close) 返回每天的目标权重（日期 × 股票），用前一天收盘的权重在每个调仓周期第一个交易日开盘成交
+          先卖后买，按手取整，资金不够时买单按比例缩小；band 为权重偏离阈值，偏离小于 band 的不调
+  费用    fee_model 的费率表（港股通费用按港元计算后折人民币）
+  现金    闲置资金可以按 cash_rate 年化计息（模拟逆回购）
+
+数据按时间分块从K线仓库读取（mmap，只拷贝需要的行），每块多读 lookback_days 天用于计算信号，
+内存只和 股票数 × 分块长度 有关，不随回测区间变长而增加
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from bar_store import resolve_symbol
+from adjustment import load_adjusted
+from market_rules import lot_size
+from vector_backtest import max_drawdown, annual_return, sharpe_ratio
+from indicator_engine import rolling_mean
+from profiler import stage, timed, count, add_profile_args, profile_from_args
+from fee_model import compute_fees, FX_PATTERN, HK_DEFAULT_RATE
+
+# 仓库根目录（对账单所在目录）
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+# 对账单中的交易市场 -> bar_store 代码前缀
+STATEMENT_MARKETS = {'上海': 'sh.', '深圳': 'sz.', '沪HK': '', '深HK': ''}
+# 不参与回测的代码：逆回购、新股申购
+EXCLUDED_PREFIXES = ('204', '131', '7', '07', '37')
+
+
+# ---------- 调仓规则 ----------
+
+def equal_weight(close):
+    """有价格的股票等权"""
+    has = close.notna()
+    return has.div(has.sum(axis=1).replace(0, np.nan), axis=0).astype('f8')
+
+
+def fixed_weights(weights):
+    """固定权重，weights 为 {代码: 权重}"""
+    def rule(close):
+        w = pd.Series({resolve_symbol(k)[1]: v for k, v in weights.items()}).reindex(close.columns).fillna(0.0)
+        return pd.DataFrame(np.broadcast_to(w.to_numpy(), close.shape), index=close.index, columns=close.columns)
+    return rule
+
+
+def dual_ma_weights(fast=5, slow=20):
+    """双均线趋势过滤：快线在慢线上方的股票等权持有，其余空仓"""
+    def rule(close):
+        c = close.to_numpy(dtype='f8')
+        with np.errstate(invalid='ignore'):
+            up = rolling_mean(c, fast) > rolling_mean(c, slow)
+        n = up.sum(axis=1, keepdims=True)
+        w = np.where(n > 0, up / np.maximum(n, 1), 0.0)
+        w[np.isnan(rolling_mean(c, slow)).all(axis=1)] = np.nan  # 信号还没有值
+        return pd.DataFrame(w, index=close.index, columns=close.columns)
+    return rule
+
+
+RULES = {
+    'equal': lambda args: equal_weight,
+    'dual_ma': lambda args: dual_ma_weights(args.fast, args.slow),
+}
+
+
+# ---------- 数据 ----------
+
+def statement_universe(path):
+    """对账单里买卖过的证券（去掉逆回购和新股申购），返回 bar_store 代码列表"""
+    raw = pd.read_csv(path, dtype=str)
+    raw = raw[raw['业务名称'].isin(['证券买入', '证券卖出'])]
+    raw = raw[~raw['证券代码'].str.startswith(EXCLUDED_PREFIXES)]
+    pairs = raw.groupby('证券代码')['交易市场'].last()
+    return [f"{code}.hk" if 'HK' in market else STATEMENT_MARKETS.get(market, '') + code
+            for code, market in pairs.items()]
+
+
+def load_fx(statement=None):
+    """港元->人民币汇率（日期索引）；没有对账单时返回空序列，回测使用 HK_DEFAULT_RATE"""
+    if not statement:
+        return pd.Series(dtype='f8')
+    raw = pd.read_csv(statement, dtype=str)
+    fx = pd.to_numeric(raw['备注'].str.extract(FX_PATTERN)[0], errors='coerce')
+    fx.index = pd.to_datetime(raw['发生日期'], format='%Y%m%d')
+    return fx.dropna().groupby(level=0).last()
+
+
+def block_ranges(start, end, block_days):
+    s = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    while s <= end:
+        e = min(s + pd.Timedelta(days=block_days - 1), end)
+        yield s, e
+        s = e + pd.Timedelta(days=1)
+
+
+def stream_panels(universe, start, end, block_days=365, lookback_days=120, root=None, adjust=None):
+    """
+    按时间分块读取 开盘价、收盘价 面板（日期 × 股票），每块向前多读 lookback_days 天
+    yield (块开始日期, {'open': DataFrame, 'close': DataFrame})
+    """
+    lookback = pd.Timedelta(days=lookback_days)
+    for s, e in block_ranges(start, end, block_days):
+        frames = {}
+        with stage('portfolio.load'):
+            for market, symbol in universe:
+                df = load_adjusted(symbol, market, s - lookback, e, adjust, root)
+                if df is None or df.empty:
+                    continue
+                frames[symbol] = df[['open', 'close']]
+        if not frames:
+            continue
+        joined = pd.concat(frames, axis=1)
+        count('portfolio.rows', joined.size)
+        yield s, {field: joined.xs(field, axis=1, level=1).astype('f8') for field in ['open', 'close']}
+
+
+# ---------- 回测 ----------
+
+def _fees(idx, codes, markets, amounts, sell, date, fx):
+    if len(idx) == 0:
+        return np.zeros(0)
+    return compute_fees(codes[idx], markets[idx], amounts, np.full(len(idx), sell), [date] * len(idx),
+                        fx[idx])['合计'].to_numpy()
+
+
+@timed('backtest.portfolio')
+def run_portfolio(symbols, rule, start, end, cash=1_000_000.0, rebalance='M', band=0.0, fx=None, fees=True,
+                  cash_rate=0.0, connect_calendar=True, block_days=365, lookback_days=120, root=None, adjust=None):
+    """
+    symbols: 股票代码列表（bar_store 格式，可混合A股、ETF、港股）
+    rule: rule(close) -> 目标权重 DataFrame；rebalance: D/W/M/Q
+    fx: 港元->人民币汇率序列（日期索引），为空时用 HK_DEFAULT_RATE
+    返回 dict：value（每日资产，人民币）、trades（成交明细）、cash（初始资金）
+    """
+    universe = [resolve_symbol(code) for code in symbols]
+    keys = [symbol for _, symbol in universe]
+    is_hk = np.array([market == 'HK' for market, _ in universe])
+    lots = np.array([lot_size(symbol, market) for market, symbol in universe], dtype='f8')
+    fee_codes = np.array([symbol.split('.')[-1] for symbol in keys])
+    fee_markets = np.array(['HK' if hk else symbol[:2].upper() for hk, symbol in zip(is_hk, keys)])
+    fx = pd.Series(dtype='f8') if fx is None else fx.sort_index()
+
+    N = len(keys)
+    shares = np.zeros(N)
+    last_close = np.full(N, np.nan)
+    cash_ = float(cash)
+    prev_period = prev_date = None
+    values, value_dates, trades = [], [], []
+
+    for s, panel in stream_panels(universe, start, end, block_days, lookback_days, root, adjust):
+        close = panel['close'].reindex(columns=keys)
+        # 用前一天收盘的目标权重调仓；本市场休市的日子沿用最近收盘价，
+        # 否则休市的股票当天权重为 0，下一次调仓会把它清仓（只有上市前的 NaN 算没有价格）
+        weights = rule(close.ffill()).reindex(columns=keys).shift(1)
+        block = close.index >= s
+        dates = close.index[block]
+        if len(dates) == 0:
+            continue
+        o = panel['open'].reindex(columns=keys).to_numpy()[block]
+        c = close.to_numpy()[block]
+        w = weights.to_numpy(dtype='f8')[block]
+        tradable = ~np.isnan(o)
+        a_close = c[:, ~is_hk]
+        if connect_calendar and is_hk.any() and (~np.isnan(a_close)).any():
+            a_open = (~np.isnan(a_close)).any(axis=1)
+            tradable[:, is_hk] &= a_open[:, None]
+        rate = fx.reindex(dates, method='ffill') if len(fx) else pd.Series(np.nan, index=dates)
+        rate = rate.fillna(fx.iloc[0] if len(fx) else HK_DEFAULT_RATE).to_numpy()
+        periods = dates.to_period(rebalance).asi8
+
+        for t, date in enumerate(dates):
+            if prev_date is not None and cash_rate:
+                cash_ *= 1 + cash_rate * (date - prev_date).days / 365
+            f = np.where(is_hk, rate[t], 1.0)
+            if periods[t] != prev_period and not np.isnan(w[t]).all():
+                with stage('portfolio.rebalance'):
+                    cash_ = _rebalance(date, o[t], f, tradable[t], np.nan_to_num(w[t]), shares, last_close, cash_,
+                                       lots, band, fees, fee_codes, fee_markets, keys, trades)
+                prev_period = periods[t]
+            last_close = np.where(np.isnan(c[t]), last_close, c[t])
+            values.append(cash_ + np.nansum(shares * last_close * f))
+            value_dates.append(date)
+            prev_date = date
+
+    trades = pd.DataFrame(trades, columns=['date', 'symbol', 'side', 'shares', 'price', 'fx', 'amount', 'fee'])
+    return {'value': pd.Series(values, index=pd.DatetimeIndex(value_dates), name='value'),
+            'trades': trades, 'cash': float(cash)}
+
+
+def _rebalance(date, open_, f, tradable, target_w, shares, last_close, cash_, lots, band, fees,
+               fee_codes, fee_markets, keys, trades):
+    """开盘调仓：先卖后买，原地修改 shares，返回调仓后的现金"""
+    ref = np.where(np.isnan(open_), last_close, open_) * f
+    holding = np.nan_to_num(shares * ref)
+    total = cash_ + holding.sum()
+    px = open_ * f
+    with np.errstate(invalid='ignore', divide='ignore'):
+        target = np.floor(target_w * total / px / lots) * lots
+        drift = np.abs(holding / total - target_w)
+    delta = np.where(tradable & (drift >= band), np.nan_to_num(target) - shares, 0.0)
+
+    sell = np.flatnonzero(delta < 0)
+    amounts = -delta[sell] * px[sell]
+    fee = _fees(sell, fee_codes, fee_markets, amounts, True, date, f) if fees else np.zeros(len(sell))
+    cash_ += amounts.sum() - fee.sum()
+    shares[sell] += delta[sell]
+    trades.extend((date, keys[i], 'sell', -delta[i], open_[i], f[i], a, x) for i, a, x in zip(sell, amounts, fee))
+
+    buy = np.flatnonzero(delta > 0)
+    qty = delta[buy]
+    while len(buy):
+        amounts = qty * px[buy]
+        fee = _fees(buy, fee_codes, fee_markets, amounts, False, date, f) if fees else np.zeros(len(buy))
+        need = amounts.sum() + fee.sum()
+        if need <= cash_:
+            break
+        # 资金不足：按比例缩小，再不够就从金额最大的单子逐手减少
+        scaled = np.floor(qty * (cash_ / need) / lots[buy]) * lots[buy]
+        if np.array_equal(scaled, qty):
+            i = np.argmax(amounts)
+            scaled[i] = max(scaled[i] - lots[buy][i], 0)
+        qty = scaled
+        keep = qty > 0
+        buy, qty = buy[keep], qty[keep]
+    if len(buy):
+        cash_ -= amounts.sum() + fee.sum()
+        shares[buy] += qty
+        trades.extend((date, keys[i], 'buy', q, open_[i], f[i], a, x) for i, q, a, x in zip(buy, qty, amounts, fee))
+    return cash_
+
+
+def summarize(result):
+    """收益率、回撤统一以 % 表示（与 vector_backtest.summarize 相同）"""
+    value, cash = result['value'], result['cash']
+    trades = result['trades']
+    return {
+        'final_value': round(float(value.iloc[-1]), 2),
+        'total_return': round(float(100.0 * (value.iloc[-1] / cash - 1)), 4),
+        'annual_return': round(float(annual_return(value.to_numpy(), cash)[0]), 4),
+        'max_drawdown': round(float(max_drawdown(value.to_numpy())[0]), 4),
+        'sharpe': sharpe_ratio(value.to_numpy(), value.index, cash)[0],
+        'trades': len(trades),
+        'fees': round(float(trades['fee'].sum()), 2) if len(trades) else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="组合回测：A股/ETF/港股通共用人民币资金池，定期调仓")
+    parser.add_argument('symbols', nargs='*', help="股票代码，如 sh.513030 00700.hk；为空时使用对账单里买卖过的证券")
+    parser.add_argument('--statement', default=os.path.join(ROOT, '202506对账单.csv'),
+                        help="对账单（港股通汇率、默认股票池）")
+    parser.add_argument('--start', default='20200101')
+    parser.add_argument('--end', default=pd.Timestamp.now().strftime('%Y%m%d'))
+    parser.add_argument('--cash', type=float, default=1_000_000.0, help="初始资金（人民币）")
+    parser.add_argument('--rule', choices=sorted(RULES), default='equal', help="调仓规则")
+    parser.add_argument('--fast', type=int, default=5)
+    parser.add_argument('--slow', type=int, default=20)
+    parser.add_argument('--rebalance', choices=['D', 'W', 'M', 'Q'], default='M', help="调仓周期")
+    parser.add_argument('--band', type=float, default=0.0, help="权重偏离小于该值时不调仓")
+    parser.add_argument('--cash-rate', type=float, default=0.0, help="闲置资金年化收益（逆回购）")
+    parser.add_argument('--no-fees', action='store_true', help="不计交易费用")
+    parser.add_argument('--block-days', type=int, default=365, help="每次从仓库读取的天数")
+    parser.add_argument('--adjust', choices=['qfq', 'hfq'], help="复权方式，默认不复权")
+    parser.add_argument('--output', help="每日资产写入的 CSV")
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    statement = args.statement if os.path.exists(args.statement) else None
+    symbols = args.symbols or (statement_universe(statement) if statement else [])
+    if not symbols:
+        print("没有可回测的股票")
+        return
+    with profile_from_args('portfolio_backtest', args):
+        result = run_portfolio(symbols, RULES[args.rule](args), args.start, args.end, args.cash, args.rebalance,
+                               args.band, load_fx(statement), not args.no_fees, args.cash_rate,
+                               block_days=args.block_days, lookback_days=max(120, args.slow * 3), adjust=args.adjust)
+    if result['value'].empty:
+        print("本地K线仓库没有这些股票在该区间的数据")
+        return
+    for key, value in summarize(result).items():
+        print(f"{key:<14}{value}")
+    if args.output:
+        result['value'].to_csv(args.output, encoding='utf-8-sig')
+        print(f"每日资产已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
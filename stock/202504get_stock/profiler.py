@@ -0,0 +1,181 @@
+"""
+轻量的耗时统计：下载 -> 指标 -> 信号 -> 回测 各阶段的耗时和计数
+
+  with stage('fetch.baostock_login'): ...   代码块计时
+  @timed('indicators')                      函数计时
+  count('api_calls.baostock')               计数（请求次数、处理行数等）
+
+计时一直开启（每次只多两次 perf_counter），只有在 profile_run 中才写报告：
+  with profile_run('batch_fetch', cprofile=True, memory=True): ...
+运行结束后写 profiles/{名称}_{时间}.json，包含各阶段的调用次数、总耗时、最大耗时、占比、计数器，
+以及可选的 cProfile 前 30 个函数（按累计耗时）和 tracemalloc 峰值内存、前 20 个分配位置
+也可以不改命令行，设置环境变量 TRADE_PROFILE=1（TRADE_PROFILE_CPROFILE=1、TRADE_PROFILE_MEMORY=1）
+
+统计按进程记录；进程池的 worker 用 snapshot(reset=True) 把增量随结果带回，主进程 merge 合并
+"""
+import os
+import sys
+import json
+import time
+import functools
+import contextlib
+from datetime import datetime
+
+PROFILE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+
+
+class Profiler:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stages = {}  # 名称 -> [调用次数, 总耗时, 最大耗时]
+        self.counters = {}
+
+    def add_time(self, name, elapsed, calls=1):
+        entry = self.stages.get(name)
+        if entry is None:
+            self.stages[name] = [calls, elapsed, elapsed]
+        else:
+            entry[0] += calls
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def timed(self, name=None):
+        def decorator(func):
+            label = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.add_time(label, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self, reset=False):
+        data = {'stages': {k: list(v) for k, v in self.stages.items()}, 'counters': dict(self.counters)}
+        if reset:
+            self.reset()
+        return data
+
+    def merge(self, data):
+        """合并其他进程的 snapshot；最大耗时取两者较大值"""
+        for name, (calls, total, longest) in data.get('stages', {}).items():
+            entry = self.stages.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += calls
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+        for name, n in data.get('counters', {}).items():
+            self.count(name, n)
+
+    def report(self, elapsed):
+        stages = {name: {'calls': calls, 'total': round(total, 6), 'max': round(longest, 6),
+                         'mean': round(total / calls, 6) if calls else 0.0,
+                         'share': round(total / elapsed, 4) if elapsed else 0.0}
+                  for name, (calls, total, longest) in sorted(self.stages.items(), key=lambda x: -x[1][1])}
+        return {'stages': stages, 'counters': dict(sorted(self.counters.items()))}
+
+
+PROFILER = Profiler()
+stage = PROFILER.stage
+timed = PROFILER.timed
+count = PROFILER.count
+snapshot = PROFILER.snapshot
+merge = PROFILER.merge
+
+
+def _env_flag(name):
+    return os.environ.get(name, '') not in ('', '0')
+
+
+def _cprofile_top(profile, limit=30):
+    import pstats
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, func), (cc, nc, tottime, cumtime, _) in stats.stats.items():
+        rows.append({'function': f"{os.path.basename(filename)}:{line}({func})", 'calls': nc,
+                     'tottime': round(tottime, 6), 'cumtime': round(cumtime, 6)})
+    return sorted(rows, key=lambda r: -r['cumtime'])[:limit]
+
+
+def _memory_top(snapshot, limit=20):
+    stats = snapshot.statistics('lineno')[:limit]
+    return [{'where': f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+             'size': s.size, 'count': s.count} for s in stats]
+
+
+@contextlib.contextmanager
+def profile_run(name, enabled=None, cprofile=None, memory=None, output_dir=None):
+    """
+    统计一次运行并写 JSON 报告，enabled/cprofile/memory 为 None 时看环境变量
+    yield 报告路径（未启用时为 None）
+    """
+    enabled = _env_flag('TRADE_PROFILE') if enabled is None else enabled
+    if not enabled:
+        yield None
+        return
+    cprofile = _env_flag('TRADE_PROFILE_CPROFILE') if cprofile is None else cprofile
+    memory = _env_flag('TRADE_PROFILE_MEMORY') if memory is None else memory
+    output_dir = output_dir or PROFILE_ROOT
+    os.makedirs(output_dir, exist_ok=True)
+    started_at = datetime.now()
+    path = os.path.join(output_dir, f"{name}_{started_at:%Y%m%d_%H%M%S}.json")
+
+    PROFILER.reset()
+    profile = None
+    if cprofile:
+        import cProfile
+        profile = cProfile.Profile()
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+    started = time.perf_counter()
+    if profile:
+        profile.enable()
+    try:
+        yield path
+    finally:
+        if profile:
+            profile.disable()
+        elapsed = time.perf_counter() - started
+        report = {'name': name, 'started': started_at.isoformat(timespec='seconds'), 'elapsed': round(elapsed, 6),
+                  'argv': sys.argv, 'pid': os.getpid()}
+        report.update(PROFILER.report(elapsed))
+        if profile:
+            report['cprofile'] = _cprofile_top(profile)
+        if memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            report['memory'] = {'current_bytes': current, 'peak_bytes': peak,
+                                'top': _memory_top(tracemalloc.take_snapshot())}
+            tracemalloc.stop()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"耗时统计已写入 {path}")
+
+
+def add_profile_args(parser):
+    """给命令行加上 --profile / --cprofile / --tracemalloc"""
+    parser.add_argument('--profile', action='store_true', help="统计各阶段耗时，写入 profiles/ 下的 JSON 报告")
+    parser.add_argument('--cprofile', action='store_true', help="同时记录 cProfile（隐含 --profile）")
+    parser.add_argument('--tracemalloc', action='store_true', help="同时记录内存峰值（隐含 --profile）")
+
+
+def profile_from_args(name, args):
+    """根据 add_profile_args 的参数开启 profile_run，没有指定时看环境变量"""
+    enabled = True if (args.profile or args.cprofile or args.tracemalloc) else None
+    return profile_run(name, enabled, args.cprofile or None, args.tracemalloc or None)
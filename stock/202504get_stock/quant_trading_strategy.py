@@ -1,7 +1,8 @@
-import pandas as pd
 import backtrader as bt
 import matplotlib.pyplot as plt
 from datetime import datetime
+from bar_store import get_bars, resolve_symbol
+from profiler import stage, count, profile_run
 
 class DualMovingAverageStrategy(bt.Strategy):
     params = (
@@ -9,7 +10,10 @@ class DualMovingAverageStrategy(bt.Strategy):
         ('slow', 20),   # 慢速均线周期
         ('stop_loss', 0.03),  # 3%止损
         ('take_profit', 0.08), # 8%止盈
-        ('volume_filter', 1.5) # 交易量过滤倍数
+        ('volume_filter', 1.5), # 交易量过滤倍数（仅金叉建仓时使用，0 表示不过滤）
+        ('entry_price', 10570), # 建仓价格上限，None 表示改为均线金叉建仓
+        ('size', 1),    # 每次交易股数
+        ('verbose', True), # 是否逐K线打印日志，参数扫描时关闭
     )
 
     def __init__(self):
@@ -19,6 +23,8 @@ class DualMovingAverageStrategy(bt.Strategy):
         self.slow_ma = bt.indicators.SimpleMovingAverage(
             self.data.close, period=self.p.slow)
         self.crossover = bt.indicators.CrossOver(self.fast_ma, self.slow_ma)
+        self.volume_ma = bt.indicators.SimpleMovingAverage(
+            self.data.volume, period=self.p.slow)
         self.order = None
 
     def notify_order(self, order):
@@ -35,6 +41,8 @@ class DualMovingAverageStrategy(bt.Strategy):
         self.order = None
 
     def log(self, txt, dt=None):
+        if not self.p.verbose:
+            return
         dt = dt or self.datas[0].datetime.date(0)
         print(f"{dt}, {txt}")
 
@@ -45,82 +53,129 @@ class DualMovingAverageStrategy(bt.Strategy):
             return
             
         if not self.position:
-            # 在指定价格建仓200股
-            print(f"当前价: {self.data.close[0]:.2f}, 建仓条件: <=10570")
-            if self.data.close[0] <= 10570:
-                print(f"触发建仓条件: 当前价{self.data.close[0]:.2f} <= 10570")
-                # 调整交易数量为1股以匹配资金规模
-                self.order = self.buy(size=1, price=self.data.close[0], exectype=bt.Order.Limit)
+            if self.p.entry_price is None:
+                # 均线金叉 + 放量建仓
+                volume_ok = (not self.p.volume_filter or
+                             self.data.volume[0] >= self.p.volume_filter * self.volume_ma[0])
+                enter = self.crossover > 0 and volume_ok
+            else:
+                # 在指定价格建仓
+                self.log(f"当前价: {self.data.close[0]:.2f}, 建仓条件: <={self.p.entry_price}")
+                enter = self.data.close[0] <= self.p.entry_price
+            if enter:
+                self.log(f"触发建仓条件: 当前价{self.data.close[0]:.2f}")
+                # 调整交易数量以匹配资金规模
+                self.order = self.buy(size=self.p.size, price=self.data.close[0], exectype=bt.Order.Limit)
                 self.stop_loss = self.data.close[0] * (1 - self.p.stop_loss)
                 self.take_profit = self.data.close[0] * (1 + self.p.take_profit)
-                print(f"设置止损价: {self.stop_loss:.2f}, 止盈价: {self.take_profit:.2f}")
-                print(f"可用资金: {self.broker.getcash():.2f}, 所需资金: {self.data.close[0] * 1:.2f}")
+                self.log(f"设置止损价: {self.stop_loss:.2f}, 止盈价: {self.take_profit:.2f}")
+                self.log(f"可用资金: {self.broker.getcash():.2f}, 所需资金: {self.data.close[0] * self.p.size:.2f}")
         else:
             if (self.crossover < 0 or 
                 self.data.close[0] <= self.stop_loss or 
                 self.data.close[0] >= self.take_profit):
                 self.order = self.close()
 
-def backtest(data_file):
-    # 创建回测引擎
-    cerebro = bt.Cerebro()
-    
-    # 加载数据并转换列名
-    df = pd.read_csv(data_file, parse_dates=['日期'], index_col='日期')
-    print("原始数据样例:")
-    print(df.head())
-    
-    # 统一价格单位处理
-    print("统一价格单位处理: 将价格乘以100")
-    df['开盘'] = df['开盘'] * 100
-    df['收盘'] = df['收盘'] * 100 
-    df['最高'] = df['最高'] * 100
-    df['最低'] = df['最低'] * 100
-    
-    # 重命名列以符合backtrader要求
-    df = df.rename(columns={
-        '开盘': 'open',
-        '收盘': 'close', 
-        '最高': 'high',
-        '最低': 'low',
-        '成交量': 'volume'
-    })
+def load_frame(stock_code, market='HK', scale=100, adjust='qfq'):
+    """从本地K线仓库加载数据（默认前复权），价格统一乘以 scale，返回 backtrader 需要的列"""
+    df = get_bars(stock_code, market=market, adjust=adjust).astype('float64')
+    for col in ['open', 'high', 'low', 'close']:
+        df[col] = df[col] * scale
     # 确保数据按日期排序
     df = df.sort_index()
     # 添加必要的列
     df['openinterest'] = 0
-    data = bt.feeds.PandasData(
+    return df[['open', 'high', 'low', 'close', 'volume', 'openinterest']]
+
+class FeeModelCommission(bt.CommInfoBase):
+    """
+    按 fee_model 的费率表计费（佣金最低收费、卖出印花税、过户费、港股通征费）
+    load_frame 把价格放大了 scale 倍，计费时先还原成实际成交金额，再把费用按同样倍数放大
+    """
+    params = (
+        ('stocklike', True),
+        ('commtype', bt.CommInfoBase.COMM_FIXED),
+        ('fee_fn', None),
+        ('scale', 100),
+    )
+
+    def _getcommission(self, size, price, pseudoexec):
+        amount = abs(size) * price / self.p.scale
+        return float(self.p.fee_fn(amount, size < 0).ravel()[0]) * self.p.scale
+
+def load_fee_fn(stock_code, market='HK'):
+    """从仓库根目录的 fee_model 生成这只股票的费用函数（需要把仓库根目录加入 PYTHONPATH）"""
+    from fee_model import make_fee_fn
+    # 先统一代码格式：600519 / sh600519 都变成 sh.600519，再按前缀区分沪深
+    market, symbol = resolve_symbol(stock_code, market)
+    exchange, code = symbol.split('.') if market == 'A' else ('HK', symbol)
+    # 港股回测以港元计价，汇率取 1
+    if market == 'HK':
+        return make_fee_fn(code, 'HK', fx_rate=1.0)
+    return make_fee_fn(code, exchange.upper())
+
+def make_feed(df):
+    return bt.feeds.PandasData(
         dataname=df,
         datetime=None,  # 使用索引作为日期
         open=0, high=1, low=2, close=3, volume=4, openinterest=5
     )
-    cerebro.adddata(data)
-    
-    # 添加策略
-    cerebro.addstrategy(DualMovingAverageStrategy)
-    
-    # 设置初始资金
-    cerebro.broker.setcash(20000.0)
-    
-    # 添加分析器
+
+def build_cerebro(df, cash=20000.0, stdstats=True, fee_fn=None, scale=100, **params):
+    """
+    创建带分析器的回测引擎，params 传给 DualMovingAverageStrategy
+    fee_fn 为 fee_model.make_fee_fn 生成的费用函数，默认不收手续费
+    """
+    cerebro = bt.Cerebro(stdstats=stdstats)
+    cerebro.adddata(make_feed(df))
+    cerebro.addstrategy(DualMovingAverageStrategy, **params)
+    cerebro.broker.setcash(cash)
+    if fee_fn is not None:
+        cerebro.broker.addcommissioninfo(FeeModelCommission(fee_fn=fee_fn, scale=scale))
     cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
     cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
     cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
+    return cerebro
+
+def collect_metrics(cerebro, strat):
+    """从分析器中取出夏普比率、最大回撤、年化收益率"""
+    return {
+        'final_value': cerebro.broker.getvalue(),
+        'sharpe': strat.analyzers.sharpe.get_analysis()['sharperatio'],
+        'max_drawdown': strat.analyzers.drawdown.get_analysis()['max']['drawdown'],
+        'annual_return': strat.analyzers.returns.get_analysis()['rnorm100'],
+    }
+
+def backtest(stock_code, market='HK', plot=True, fees=False):
+    # 从本地K线仓库加载数据
+    print("统一价格单位处理: 将价格乘以100")
+    with stage('backtest.load'):
+        df = load_frame(stock_code, market)
+    count('rows.backtest', len(df))
+    print("原始数据样例:")
+    print(df.head())
+    
+    # 创建回测引擎，设置初始资金，添加策略和分析器
+    cerebro = build_cerebro(df, fee_fn=load_fee_fn(stock_code, market) if fees else None)
     
     # 运行回测
     print('初始资金: %.2f' % cerebro.broker.getvalue())
-    results = cerebro.run()
+    with stage('backtest.cerebro_run'):
+        results = cerebro.run()
     print('最终资金: %.2f' % cerebro.broker.getvalue())
     
     # 打印分析结果
-    strat = results[0]
-    print('夏普比率:', strat.analyzers.sharpe.get_analysis()['sharperatio'])
-    print('最大回撤:', strat.analyzers.drawdown.get_analysis()['max']['drawdown'])
-    print('年化收益率:', strat.analyzers.returns.get_analysis()['rnorm100'])
+    metrics = collect_metrics(cerebro, results[0])
+    print('夏普比率:', metrics['sharpe'])
+    print('最大回撤:', metrics['max_drawdown'])
+    print('年化收益率:', metrics['annual_return'])
     
     # 可视化
-    cerebro.plot(style='candlestick')
+    if plot:
+        cerebro.plot(style='candlestick')
+    return metrics
 
 if __name__ == '__main__':
-    # 使用之前获取的阿里巴巴数据
-    backtest('09988_data.csv')
+    # 使用之前获取的阿里巴巴数据（设置环境变量 TRADE_PROFILE=1 时输出耗时报告）
+    with profile_run('backtest'):
+        backtest('09988')
@@ -0,0 +1,200 @@
+"""
+分析结果缓存：按输入内容的哈希和参数做记忆化，输入没变就跳过计算、不重写输出文件
+
+缓存键 = sha1(任务名, 每个输入的内容哈希, 参数[, 只参与缓存键的参数])
+  输入可以是文件路径（按内容哈希，(路径, 大小, 修改时间) 相同时复用上次的哈希）、
+  DataFrame/Series（pd.util.hash_pandas_object）、numpy 数组、bytes 或其他可 repr 的值
+每条缓存是 cache/{key}/ 下的一个目录：
+  value.pkl   返回值（可选）
+  files/      输出文件的副本（可选），命中时如果输出文件被删了或改了就从这里恢复
+  meta.json   任务名、大小、输出文件路径和哈希
+目录的修改时间作为最近使用时间，超过 max_bytes 时按最久未使用淘汰
+每条缓存单独一个目录、原子替换，多个进程同时跑批也不会互相破坏
+"""
+import os
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+CACHE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def file_sha1(path, chunk=1 << 20):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root or CACHE_ROOT
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._file_hashes_path = os.path.join(self.root, 'file_hashes.json')
+        self._file_hashes = None
+
+    # ---------- 输入哈希 ----------
+
+    def _hash_file(self, path):
+        """文件内容哈希；(大小, 修改时间) 没变时直接用记录下来的结果"""
+        if self._file_hashes is None:
+            try:
+                with open(self._file_hashes_path, encoding='utf-8') as f:
+                    self._file_hashes = json.load(f)
+            except (OSError, ValueError):
+                self._file_hashes = {}
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self._file_hashes.get(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = file_sha1(path)
+        self._file_hashes[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        tmp = f"{self._file_hashes_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._file_hashes, f)
+        os.replace(tmp, self._file_hashes_path)
+        return digest
+
+    def hash_input(self, value):
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            sha = hashlib.sha1(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+            names = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+            sha.update(repr((names, [str(t) for t in np.atleast_1d(value.dtypes)])).encode())
+            return sha.hexdigest()
+        if isinstance(value, np.ndarray):
+            sha = hashlib.sha1(np.ascontiguousarray(value).tobytes())
+            sha.update(repr((value.dtype.str, value.shape)).encode())
+            return sha.hexdigest()
+        if isinstance(value, bytes):
+            return hashlib.sha1(value).hexdigest()
+        if isinstance(value, str) and os.path.isfile(value):
+            return self._hash_file(value)
+        return hashlib.sha1(repr(value).encode()).hexdigest()
+
+    def make_key(self, name, inputs=(), params=None, key_params=None):
+        """任务名 + 输入内容 + 参数 -> 缓存键；key_params 是不传给函数、只影响缓存键的参数"""
+        parts = [name] + [self.hash_input(x) for x in inputs] + [repr(sorted((params or {}).items()))]
+        if key_params:
+            parts.append(repr(sorted(key_params.items())))
+        return hashlib.sha1('\0'.join(parts).encode()).hexdigest()
+
+    # ---------- 读写 ----------
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def _touch(self, key):
+        now = time.time()
+        os.utime(self._entry(key), (now, now))
+
+    def get(self, key, default=None):
+        """取缓存的返回值；没有时返回 default"""
+        path = os.path.join(self._entry(key), 'value.pkl')
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return default
+        self._touch(key)
+        return value
+
+    def restore(self, key, outputs=()):
+        """
+        检查输出文件是否仍是缓存时的内容：是则直接返回 True；被删除或修改的从缓存副本恢复
+        缓存里没有这个键时返回 False
+        """
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        files = meta.get('files', {})
+        if set(files) != {os.path.abspath(p) for p in outputs}:
+            return False
+        for path, (digest, stored) in files.items():
+            if os.path.exists(path) and self._hash_file(path) == digest:
+                continue
+            shutil.copyfile(os.path.join(entry, 'files', stored), path)
+        self._touch(key)
+        return True
+
+    def put(self, key, value=None, outputs=(), name=''):
+        """保存返回值和输出文件副本，然后按容量淘汰旧缓存"""
+        entry = self._entry(key)
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(os.path.join(tmp, 'files'))
+        if value is not None:
+            with open(os.path.join(tmp, 'value.pkl'), 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        files = {}
+        for i, path in enumerate(outputs):
+            stored = f"{i}_{os.path.basename(path)}"
+            shutil.copyfile(path, os.path.join(tmp, 'files', stored))
+            files[os.path.abspath(path)] = [self._hash_file(path), stored]
+        size = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(tmp) for f in fs)
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'name': name, 'size': size, 'created': time.time(), 'files': files}, f, ensure_ascii=False)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        self.evict()
+        return value
+
+    def memoize(self, name, func, inputs=(), params=None, outputs=(), key_params=None):
+        """
+        有缓存就返回缓存的值（并确保输出文件存在），否则调用 func(**params) 计算并保存
+        key_params 只参与缓存键、不传给 func，用于 func 通过闭包用到、但签名里没有的参数
+        返回 (值, 是否命中)
+        """
+        key = self.make_key(name, inputs, params, key_params)
+        if outputs:
+            if self.restore(key, outputs):
+                return self.get(key), True
+        else:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value, True
+        value = func(**(params or {}))
+        self.put(key, value, outputs, name)
+        return value, False
+
+    # ---------- 淘汰 ----------
+
+    def entries(self):
+        """返回 [(最近使用时间, 大小, 键)]"""
+        result = []
+        for key in os.listdir(self.root):
+            meta = os.path.join(self.root, key, 'meta.json')
+            if key.endswith('.tmp') or not os.path.exists(meta):
+                continue
+            with open(meta, encoding='utf-8') as f:
+                size = json.load(f).get('size', 0)
+            result.append((os.path.getmtime(os.path.join(self.root, key)), size, key))
+        return result
+
+    def evict(self):
+        """总大小超过 max_bytes 时，从最久未使用的开始删除"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+        return total
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+
+
+_MISSING = object()
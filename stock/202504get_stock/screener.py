@@ -0,0 +1,109 @@
+import time
+import argparse
+import pandas as pd
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bar_store import resolve_symbol, list_symbols
+from batch_fetch import read_symbols
+from indicator_engine import load_panel, compute_indicators, panel_to_frame
+from stock_analyze import generate_signals
+from analyze_divergence import divergence_panel
+from profiler import stage, count, snapshot, merge, add_profile_args, profile_from_args
+
+HEADER = ['股票代码', '市场', '日期', '收盘价', 'MACD信号', 'RSI信号', '布林信号', '量价背离', 'RSI', '触发数', '综合评分']
+
+
+def screen_chunk(symbols, market, start=None, end=None, root=None, adjust='qfq'):
+    """
+    对一组同市场的股票做一次面板计算，返回每只股票最后一根K线的信号
+    综合评分 = MACD信号 + RSI信号 + 布林信号（正数偏买入，负数偏卖出）
+    """
+    with stage('load'):
+        panel = load_panel(symbols, market, start, end, root, adjust)
+    if panel['close'].empty:
+        return [], snapshot(reset=True)
+    count('rows.indicators', panel['close'].size)
+    with stage('indicators'):
+        indicators = compute_indicators(panel['high'], panel['low'], panel['close'])
+        divergence = divergence_panel(panel['high'], panel['low'], panel['close'], panel['volume'], (14,),
+                                      dif=indicators['macd'])[('volume', 14)]
+        divergence = pd.DataFrame(divergence, index=panel['close'].index, columns=panel['close'].columns)
+    rows = []
+    for symbol in panel['close'].columns:
+        df = panel_to_frame(panel, indicators, symbol)
+        if len(df) < 2:
+            continue
+        signals = generate_signals(df).iloc[-1]
+        values = [int(signals['macd_cross']), int(signals['rsi_signal']), int(signals['bb_signal']),
+                  int(divergence.at[df.index[-1], symbol])]
+        triggered = sum(v != 0 for v in values)
+        if triggered == 0:
+            continue
+        last = df.iloc[-1]
+        rows.append([symbol, market, df.index[-1].strftime('%Y-%m-%d'), round(float(last['close']), 3)]
+                    + values + [round(float(last['rsi']), 2), triggered, sum(values[:3])])
+    # 耗时统计随结果带回主进程
+    return rows, snapshot(reset=True)
+
+
+def screen(symbols, start=None, end=None, workers=4, chunk_size=200, root=None, adjust='qfq'):
+    """
+    按市场分组、分块，多进程并行筛选，返回排好序的结果表
+    默认前复权，港股和A股的指标口径一致（没有下载因子的股票按不复权计算）
+    """
+    groups = {}
+    for code in symbols:
+        market, symbol = resolve_symbol(code)
+        groups.setdefault(market, []).append(symbol)
+    tasks = [(chunk, market) for market, syms in groups.items()
+             for chunk in (syms[i:i + chunk_size] for i in range(0, len(syms), chunk_size))]
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(screen_chunk, chunk, market, start, end, root, adjust) for chunk, market in tasks]
+        for done, future in enumerate(as_completed(futures), 1):
+            chunk_rows, stats = future.result()
+            rows.extend(chunk_rows)
+            merge(stats)
+            print(f"[{done}/{len(tasks)}] 已完成")
+
+    # 只保留在各市场最新交易日触发的股票（停牌或数据没更新的不算）
+    result = pd.DataFrame(rows, columns=HEADER)
+    latest = result.groupby('市场')['日期'].transform('max')
+    result = result[result['日期'] == latest]
+    result = result.sort_values(['综合评分', '触发数', 'RSI'], ascending=[False, False, True])
+    return result.reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全市场信号筛选：MACD金叉死叉、RSI、布林带、量价背离")
+    parser.add_argument('symbols', nargs='*', help="股票代码，或以 @ 开头的代码列表文件；为空时筛选本地仓库全部股票")
+    parser.add_argument('--days', type=int, default=200, help="参与计算的历史天数")
+    parser.add_argument('--end', help="截止日期 YYYYMMDD，默认今天")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help="输出文件，默认 screener_YYYYMMDD.csv")
+    parser.add_argument('--adjust', default='qfq', choices=['qfq', 'hfq', 'none'], help="复权方式，默认前复权")
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    symbols = []
+    for item in args.symbols:
+        symbols.extend(read_symbols(item[1:]) if item.startswith('@') else [item])
+    if not symbols:
+        symbols = [f"{s}.hk" for s in list_symbols('HK')] + list_symbols('A')
+
+    end_dt = datetime.strptime(args.end, '%Y%m%d') if args.end else datetime.now()
+    start_dt = end_dt - timedelta(days=args.days)
+    started = time.time()
+    with profile_from_args('screener', args):
+        result = screen(symbols, start_dt, end_dt, args.workers,
+                        adjust=None if args.adjust == 'none' else args.adjust)
+
+    output_file = args.output or f"screener_{end_dt.strftime('%Y%m%d')}.csv"
+    result.to_csv(output_file, index=False, encoding='utf-8-sig')
+    print(result.head(20).to_string())
+    print(f"筛选 {len(symbols)} 只股票，{len(result)} 只触发信号，耗时 {time.time() - started:.1f} 秒，结果已写入 {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
 import pandas as pd
 import numpy as np
-from ta.trend import MACD, SMAIndicator
-from ta.momentum import RSIIndicator, StochasticOscillator
-from ta.volatility import BollingerBands
-import baostock as bs
-import yfinance as yf
+from indicator_engine import compute_indicators
+from bar_store import resolve_symbol, sync_bars, fetch_yfinance_hk, fetch_baostock_a
+from adjustment import load_adjusted, has_factors, sync_factors
 from datetime import datetime, timedelta
+from profiler import timed, count
+from intraday_store import TIMEFRAMES, sync_intraday, get_timeframe_bars
 
 def validate_date(date_str):
     """
@@ -18,13 +18,15 @@ def validate_date(date_str):
     except ValueError:
         return None
 
-def get_stock_data(stock_code, start_date=None, end_date=None, market="A"):
+@timed('fetch')
+def get_stock_data(stock_code, start_date=None, end_date=None, market="A", timeframe="daily"):
     """
     获取股票数据
     stock_code: 股票代码（如：000001、sh000001、00700.hk）
     start_date: 开始日期，格式：YYYYMMDD
     end_date: 结束日期，格式：YYYYMMDD
     market: 市场，可选 "A"(A股) 或 "HK"(港股)
+    timeframe: K线周期，daily 或 1min/5min/15min/30min/60min（由分钟K线仓库重采样）
     """
     try:
         # 验证日期
@@ -47,176 +49,76 @@ def get_stock_data(stock_code, start_date=None, end_date=None, market="A"):
             end_dt = today
             
         # 识别市场和股票代码
-        # 如果指定了港股市场或代码以.hk结尾
-        if market.upper() == "HK" or (isinstance(stock_code, str) and stock_code.lower().endswith('.hk')):
-            is_hk = True
-            # 提取港股代码
-            if stock_code.lower().endswith('.hk'):
-                hk_code = stock_code.lower().replace('.hk', '')
-            else:
-                hk_code = stock_code
-                
-            # 补足5位数，前面加0
-            if len(hk_code) < 5:
-                hk_code = hk_code.zfill(5)
-                
-            # Yahoo Finance的港股代码格式
-            yahoo_code = f"{hk_code}.HK"
-            print(f"正在获取港股 {yahoo_code} 的数据...")
-            
-            # 打印日期范围
-            print(f"开始日期: {start_dt.strftime('%Y-%m-%d')}, 结束日期: {end_dt.strftime('%Y-%m-%d')}")
-            
-            # 使用yfinance获取港股数据
-            stock = yf.Ticker(yahoo_code)
-            df = stock.history(start=start_dt, end=end_dt + timedelta(days=1), interval="1d")
-            
-            # 打印获取的数据的前几行
-            print(df.head())  # 打印获取的数据的前几行
+        try:
+            market, symbol = resolve_symbol(stock_code, market)
+        except ValueError as e:
+            print(e)
+            return None
             
-            if df.empty:
-                print("未找到股票数据，请检查股票代码是否正确")
+        if timeframe != "daily":
+            # 分钟K线：增量下载到分钟仓库，再重采样到需要的周期
+            print(f"正在获取 {symbol} 的分钟K线，周期 {timeframe}...")
+            freq, count_new = sync_intraday(symbol, start_dt.strftime('%Y%m%d'), end_dt.strftime('%Y%m%d'),
+                                            market=market)
+            print(f"本地{freq}K线同步：新增 {count_new} 条")
+            df = get_timeframe_bars(symbol, timeframe, start_dt, end_dt, market=market)
+            if df is None or df.empty:
+                print("未找到分钟K线数据")
                 return None
-                
-            # 重命名列名以匹配我们的分析函数
-            df = df.rename(columns={
-                'Open': 'open',
-                'High': 'high',
-                'Low': 'low',
-                'Close': 'close',
-                'Volume': 'volume'
-            })
-            
-            # 保留需要的列
-            df = df[['open', 'high', 'low', 'close', 'volume']]
-            
-            print(f"成功获取了港股 {yahoo_code} 的 {len(df)} 条交易数据")
+            print(f"成功获取了 {symbol} 的 {len(df)} 根{timeframe}K线")
             return df
-            
-        else:
-            is_hk = False
-            # 处理A股代码
-            if stock_code.startswith(('sh', 'sz')):
-                # 如果已经包含前缀，检查格式 
-                if not stock_code.startswith(('sh.', 'sz.')):
-                    # 转换为baostock格式
-                    prefix = stock_code[:2]
-                    code = stock_code[2:]
-                    full_code = f"{prefix}.{code}"
-                else:
-                    full_code = stock_code
-            else:
-                # 否则根据编号判断添加前缀
-                if stock_code.startswith('0'):  # 深市主板
-                    full_code = f"sz.{stock_code}"
-                elif stock_code.startswith('3'):  # 创业板
-                    full_code = f"sz.{stock_code}"
-                elif stock_code.startswith('6'):  # 上海主板
-                    full_code = f"sh.{stock_code}"
-                elif stock_code.startswith('8'):  # 科创板
-                    full_code = f"sh.{stock_code}"
-                else:
-                    print(f"无法识别的股票代码格式：{stock_code}")
-                    return None
 
-            print(f"正在获取A股 {full_code} 的数据...")
-            
-            # 转换日期格式
-            bs_start_date = start_dt.strftime('%Y-%m-%d')
-            bs_end_date = end_dt.strftime('%Y-%m-%d')
-            
-            # 登录系统
-            bs.login()
+        if market == "HK":
+            # 港股使用 Yahoo Finance
+            print(f"正在获取港股 {symbol}.HK 的数据...")
+            provider = fetch_yfinance_hk
+        else:
+            # A股使用 baostock（仓库存不复权数据，读取时按复权因子前复权）
+            print(f"正在获取A股 {symbol} 的数据...")
+            provider = fetch_baostock_a
             
+        # 打印日期范围
+        print(f"开始日期: {start_dt.strftime('%Y-%m-%d')}, 结束日期: {end_dt.strftime('%Y-%m-%d')}")
+        
+        # 增量同步本地K线仓库，只下载缺少的部分，再按日期范围读取
+        status, count = sync_bars(symbol, start_dt.strftime('%Y%m%d'), end_dt.strftime('%Y%m%d'),
+                                  market=market, provider=provider)
+        print(f"本地K线同步: {status}，新增 {count} 条")
+        # 仓库只存不复权K线，前复权需要因子文件；第一次分析这只股票时下载
+        if not has_factors(symbol, market):
             try:
-                # 获取股票数据
-                rs = bs.query_history_k_data_plus(
-                    full_code,
-                    "date,open,high,low,close,volume",
-                    start_date=bs_start_date,
-                    end_date=bs_end_date,
-                    frequency="d",
-                    adjustflag="2"  # 前复权
-                )
-                
-                # 获取数据
-                data_list = []
-                while (rs.error_code == '0') & rs.next():
-                    data_list.append(rs.get_row_data())
-                    
-                # 登出系统
-                bs.logout()
-                
-                if len(data_list) == 0:
-                    print("未找到股票数据，请检查股票代码是否正确")
-                    return None
-                    
-                # 转换为DataFrame
-                df = pd.DataFrame(data_list, columns=['date', 'open', 'high', 'low', 'close', 'volume'])
-                
-                # 转换数据类型
-                for col in ['open', 'high', 'low', 'close']:
-                    df[col] = pd.to_numeric(df[col])
-                df['volume'] = pd.to_numeric(df['volume'])
-                
-                # 将日期设置为索引
-                df['date'] = pd.to_datetime(df['date'])
-                df.set_index('date', inplace=True)
-                
-                # 确保数据按日期升序排序
-                df.sort_index(inplace=True)
-                
-                print(f"成功获取了A股 {full_code} 的 {len(df)} 条交易数据")
-                return df
-                
+                print(f"本地复权因子: 新增 {sync_factors(symbol, market)} 条")
             except Exception as e:
-                print(f"获取数据失败：{e}")
-                bs.logout()
-                return None
+                print(f"下载复权因子失败: {e}")
+        df = load_adjusted(symbol, market, start_dt, end_dt, adjust='qfq')
+        if df is None or df.empty:
+            print("未找到股票数据，请检查股票代码是否正确")
+            return None
+            
+        print(f"成功获取了 {symbol} 的 {len(df)} 条交易数据")
+        return df
     
     except Exception as e:
         print(f"获取股票数据时出错: {e}")
-        try:
-            bs.logout()
-        except:
-            pass
         return None
 
+@timed('indicators')
 def calculate_technical_indicators(df):
     """
     计算常用技术指标
     df: DataFrame，包含 'close', 'high', 'low', 'volume' 列
+    使用 indicator_engine 的向量化实现，结果与 ta 库一致
     """
-    # 1. MACD
-    macd = MACD(close=df['close'])
-    df['macd'] = macd.macd()
-    df['macd_signal'] = macd.macd_signal()
-    df['macd_hist'] = macd.macd_diff()
-    
-    # 2. KDJ
-    stoch = StochasticOscillator(high=df['high'], low=df['low'], close=df['close'])
-    df['k'] = stoch.stoch()
-    df['d'] = stoch.stoch_signal()
-    df['j'] = 3 * df['k'] - 2 * df['d']
-    
-    # 3. RSI
-    rsi = RSIIndicator(close=df['close'])
-    df['rsi'] = rsi.rsi()
-    
-    # 4. 布林带
-    bb = BollingerBands(close=df['close'])
-    df['upper'] = bb.bollinger_hband()
-    df['middle'] = bb.bollinger_mavg()
-    df['lower'] = bb.bollinger_lband()
-    
-    # 5. 移动平均线
-    df['ma5'] = SMAIndicator(close=df['close'], window=5).sma_indicator()
-    df['ma10'] = SMAIndicator(close=df['close'], window=10).sma_indicator()
-    df['ma20'] = SMAIndicator(close=df['close'], window=20).sma_indicator()
-    df['ma60'] = SMAIndicator(close=df['close'], window=60).sma_indicator()
+    indicators = compute_indicators(df['high'].astype('float64'), df['low'].astype('float64'),
+                                    df['close'].astype('float64'))
+    count('rows.indicators', len(df))
+    # 1. MACD  2. KDJ  3. RSI  4. 布林带  5. 移动平均线
+    for name, values in indicators.items():
+        df[name] = values
     
     return df
 
+@timed('signals')
 def generate_signals(df):
     """
     生成交易信号
@@ -334,9 +236,15 @@ def main():
             print("结束日期格式错误！将使用默认值（今天）")
             end_date = None
         
+        print(f"请输入K线周期（可选：{'/'.join(TIMEFRAMES)}，直接回车为日线）")
+        timeframe = input("周期: ").strip() or "daily"
+        if timeframe not in TIMEFRAMES:
+            print("周期格式错误！将使用日线")
+            timeframe = "daily"
+
         # 获取股票数据
         print("\n正在获取股票数据，请稍候...")
-        df = get_stock_data(stock_code, start_date, end_date, market)
+        df = get_stock_data(stock_code, start_date, end_date, market, timeframe)
         
         if df is not None and not df.empty:
             print(f"\n成功获取 {len(df)} 条交易数据")
@@ -0,0 +1,294 @@
+"""
+增量（流式）技术指标
+
+每来一根新K线只做 O(1) 的更新，不需要重新读取全部历史
+计算口径与 indicator_engine / ta 库一致，可用 verify_against_batch 核对
+
+所有指标对象支持 get_state()/set_state() 保存和恢复状态（可直接 json 序列化）
+IndicatorSet 支持盘中用分钟线刷新"当天尚未收盘的K线"：final=False 的更新
+会在下一次更新前自动回滚
+"""
+import json
+import math
+from collections import deque
+
+NAN = float('nan')
+
+
+class StreamingIndicator:
+    """指标基类：提供状态保存/恢复"""
+
+    def get_state(self):
+        state = {}
+        for key, value in vars(self).items():
+            if isinstance(value, StreamingIndicator):
+                state[key] = value.get_state()
+            elif isinstance(value, deque):
+                state[key] = [list(v) if isinstance(v, tuple) else v for v in value]
+            else:
+                state[key] = value
+        return state
+
+    def set_state(self, state):
+        for key, value in state.items():
+            current = getattr(self, key, None)
+            if isinstance(current, StreamingIndicator):
+                current.set_state(value)
+            elif isinstance(current, deque):
+                setattr(self, key, deque((tuple(v) if isinstance(v, list) else v for v in value),
+                                         maxlen=current.maxlen))
+            else:
+                setattr(self, key, value)
+        return self
+
+
+class EMA(StreamingIndicator):
+    """等价于 pandas ewm(adjust=False, min_periods)，NaN 输入只衰减权重"""
+
+    def __init__(self, span=None, alpha=None, min_periods=0):
+        self.alpha = alpha if alpha is not None else 2.0 / (span + 1.0)
+        self.min_periods = max(min_periods, 1)
+        self.weighted = NAN
+        self.old_wt = 1.0
+        self.nobs = 0
+        self.value = NAN
+
+    def update(self, x):
+        is_obs = not math.isnan(x)
+        self.nobs += is_obs
+        if not math.isnan(self.weighted):
+            self.old_wt *= 1 - self.alpha
+            if is_obs:
+                self.weighted = (self.old_wt * self.weighted + self.alpha * x) / (self.old_wt + self.alpha)
+                self.old_wt = 1.0
+        elif is_obs:
+            self.weighted = x
+        self.value = self.weighted if self.nobs >= self.min_periods else NAN
+        return self.value
+
+
+class SMA(StreamingIndicator):
+    """滚动均值/标准差，窗口内有 NaN 或未满时输出 NaN"""
+
+    # 每隔多少次更新重新求和一次，消除累加误差
+    RESYNC = 1000
+
+    def __init__(self, window):
+        self.window = window
+        self.buffer = deque(maxlen=window)
+        self.base = NAN
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.nan_count = 0
+        self.updates = 0
+        self.value = NAN
+        self.std = NAN
+
+    def update(self, x):
+        if math.isnan(self.base) and not math.isnan(x):
+            self.base = x
+        if len(self.buffer) == self.window:
+            old = self.buffer[0]
+            if math.isnan(old):
+                self.nan_count -= 1
+            else:
+                self.total -= old - self.base
+                self.total_sq -= (old - self.base) ** 2
+        self.buffer.append(x)
+        if math.isnan(x):
+            self.nan_count += 1
+        else:
+            self.total += x - self.base
+            self.total_sq += (x - self.base) ** 2
+        self.updates += 1
+        if self.updates % self.RESYNC == 0:
+            valid = [v - self.base for v in self.buffer if not math.isnan(v)]
+            self.total = sum(valid)
+            self.total_sq = sum(v * v for v in valid)
+        if len(self.buffer) < self.window or self.nan_count:
+            self.value = self.std = NAN
+        else:
+            self.value = self.total / self.window + self.base
+            var = (self.total_sq - self.total * self.total / self.window) / self.window
+            self.std = math.sqrt(max(var, 0.0))
+        return self.value
+
+
+class RollingExtreme(StreamingIndicator):
+    """单调队列求滚动最大/最小值，均摊 O(1)"""
+
+    def __init__(self, window, mode='max'):
+        self.window = window
+        self.mode = mode
+        self.queue = deque()  # (序号, 值)
+        self.count = 0
+        self.last_nan = -1
+        self.value = NAN
+
+    def update(self, x):
+        i = self.count
+        self.count += 1
+        if math.isnan(x):
+            self.last_nan = i
+        else:
+            better = (lambda a, b: a <= b) if self.mode == 'max' else (lambda a, b: a >= b)
+            while self.queue and better(self.queue[-1][1], x):
+                self.queue.pop()
+            self.queue.append((i, x))
+        while self.queue and self.queue[0][0] <= i - self.window:
+            self.queue.popleft()
+        if self.count < self.window or self.last_nan > i - self.window:
+            self.value = NAN
+        else:
+            self.value = self.queue[0][1]
+        return self.value
+
+
+class MACD(StreamingIndicator):
+    def __init__(self, fast=12, slow=26, signal=9, min_periods=True):
+        self.fast = EMA(span=fast, min_periods=fast if min_periods else 0)
+        self.slow = EMA(span=slow, min_periods=slow if min_periods else 0)
+        self.signal = EMA(span=signal, min_periods=signal if min_periods else 0)
+        self.value = (NAN, NAN, NAN)
+
+    def update(self, close):
+        dif = self.fast.update(close) - self.slow.update(close)
+        dea = self.signal.update(dif)
+        self.value = (dif, dea, dif - dea)
+        return self.value
+
+
+class RSI(StreamingIndicator):
+    def __init__(self, window=14):
+        self.up = EMA(alpha=1.0 / window, min_periods=window)
+        self.dn = EMA(alpha=1.0 / window, min_periods=window)
+        self.prev = NAN
+        self.value = NAN
+
+    def update(self, close):
+        diff = close - self.prev
+        self.prev = close
+        if math.isnan(close):
+            # 停牌/缺失与 indicator_engine.rsi 一致：输入 NaN，EMA 只衰减权重
+            up = self.up.update(NAN)
+            dn = self.dn.update(NAN)
+        else:
+            up = self.up.update(diff if diff > 0 else 0.0)
+            dn = self.dn.update(-diff if diff < 0 else 0.0)
+        if math.isnan(up) or math.isnan(dn):
+            self.value = NAN
+        elif dn == 0:
+            self.value = 100.0
+        else:
+            self.value = 100 - 100 / (1 + up / dn)
+        return self.value
+
+
+class Stochastic(StreamingIndicator):
+    """KDJ，返回 (k, d, j)"""
+
+    def __init__(self, window=14, smooth_window=3):
+        self.high = RollingExtreme(window, 'max')
+        self.low = RollingExtreme(window, 'min')
+        self.smooth = SMA(smooth_window)
+        self.value = (NAN, NAN, NAN)
+
+    def update(self, high, low, close):
+        smax = self.high.update(high)
+        smin = self.low.update(low)
+        if math.isnan(smax) or math.isnan(smin):
+            k = NAN
+        elif smax == smin:
+            k = NAN if close == smin else math.copysign(math.inf, close - smin)
+        else:
+            k = 100 * (close - smin) / (smax - smin)
+        d = self.smooth.update(k)
+        self.value = (k, d, 3 * k - 2 * d)
+        return self.value
+
+
+class Bollinger(StreamingIndicator):
+    """返回 (upper, middle, lower)"""
+
+    def __init__(self, window=20, window_dev=2):
+        self.window_dev = window_dev
+        self.sma = SMA(window)
+        self.value = (NAN, NAN, NAN)
+
+    def update(self, close):
+        mid = self.sma.update(close)
+        std = self.sma.std
+        self.value = (mid + self.window_dev * std, mid, mid - self.window_dev * std)
+        return self.value
+
+
+class IndicatorSet(StreamingIndicator):
+    """
+    单只股票的一组增量指标，输出字段与 calculate_technical_indicators 相同
+    final=False 表示这根K线还没走完（盘中），下一次 update 会先回滚再更新
+    """
+
+    def __init__(self, ma_windows=(5, 10, 20, 60)):
+        self.macd = MACD()
+        self.stoch = Stochastic()
+        self.rsi = RSI()
+        self.bollinger = Bollinger()
+        self.mas = {window: SMA(window) for window in ma_windows}
+        self.pending = None
+
+    def get_state(self):
+        state = super().get_state()
+        state['mas'] = {str(window): sma.get_state() for window, sma in self.mas.items()}
+        return state
+
+    def set_state(self, state):
+        state = dict(state)
+        mas = state.pop('mas')
+        super().set_state(state)
+        self.mas = {int(window): SMA(int(window)).set_state(s) for window, s in mas.items()}
+        return self
+
+    def update(self, high, low, close, final=True):
+        if self.pending is not None:
+            self.set_state(self.pending)
+            self.pending = None
+        if not final:
+            self.pending = self.get_state()
+        row = {}
+        row['macd'], row['macd_signal'], row['macd_hist'] = self.macd.update(close)
+        row['k'], row['d'], row['j'] = self.stoch.update(high, low, close)
+        row['rsi'] = self.rsi.update(close)
+        row['upper'], row['middle'], row['lower'] = self.bollinger.update(close)
+        for window, sma in self.mas.items():
+            row[f'ma{window}'] = sma.update(close)
+        return row
+
+    def checkpoint(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.get_state(), f)
+
+    @classmethod
+    def restore(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls().set_state(json.load(f))
+
+
+def verify_against_batch(df):
+    """逐根K线增量计算，与批量引擎比较，返回每列最大绝对误差"""
+    import numpy as np
+    import pandas as pd
+    from indicator_engine import compute_indicators
+    df = df.astype('float64')
+    batch = compute_indicators(df['high'], df['low'], df['close'])
+    ind = IndicatorSet()
+    rows = [ind.update(h, l, c) for h, l, c in zip(df['high'], df['low'], df['close'])]
+    stream = pd.DataFrame(rows, index=df.index)
+    errors = {}
+    for name, values in batch.items():
+        a, b = values.to_numpy(), stream[name].to_numpy()
+        if not np.array_equal(np.isnan(a), np.isnan(b)):
+            errors[name] = math.inf
+        else:
+            mask = ~np.isnan(a)
+            errors[name] = float(np.max(np.abs(a[mask] - b[mask]))) if mask.any() else 0.0
+    return errors
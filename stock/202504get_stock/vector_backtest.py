@@ -0,0 +1,317 @@
+"""
+向量化回测引擎：不走 backtrader 的事件循环，直接用 NumPy 数组回测信号策略
+
+输入为 (日期 × 股票) 的价格和买卖信号数组，所有股票在一次时间循环中同时回测，
+每只股票各自独立记账。成交规则与 backtrader 默认撮合保持一致：
+  - 第 t 根K线收盘产生买入信号，以收盘价挂限价单（一直有效直到成交），
+    之后开盘价 <= 限价按开盘价成交，最低价 <= 限价按限价成交
+  - 持仓时收盘价触及止损/止盈或出现卖出信号，下一根K线开盘市价卖出
+  - 止损止盈价按信号K线的收盘价计算（与 DualMovingAverageStrategy 相同）
+另外支持 A 股 T+1（当天买入不能当天卖出）、整手交易和佣金/印花税，
+也可以传入 fee_model.make_fee_fn 生成的费用函数按实际费率表计费
+指标口径与 backtrader 的 SharpeRatio / DrawDown / Returns 分析器一致
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from indicator_engine import rolling_mean
+from profiler import timed
+
+TRADING_DAYS = 252
+
+
+def _as_2d(x):
+    a = np.asarray(x)
+    return a[:, None] if a.ndim == 1 else a
+
+
+def _broadcast(value, n):
+    return np.broadcast_to(np.asarray(value if value is not None else np.nan, dtype='f8'), (n,)).copy()
+
+
+@timed('backtest.vector')
+def run_backtest(open_, high, low, close, entries, exits, stop_loss=None, take_profit=None,
+                 cash=20000.0, size=None, lot_size=1, limit_entry=True, commission=0.0,
+                 min_commission=0.0, stamp_duty=0.0, dates=None, t_plus_one=True, fee_fn=None):
+    """
+    open_/high/low/close/entries/exits: (T,) 或 (T, N) 数组/DataFrame
+    stop_loss/take_profit: 比例，可为标量或每只股票一个值，None 表示不设
+    size: 每次买入股数；None 表示按可用资金全仓买入（按 lot_size 取整）
+    lot_size: 每手股数，可为每只股票一个值（A股100，港股按每手股数）
+    commission/min_commission: 佣金费率和最低佣金；stamp_duty: 卖出印花税率
+    fee_fn: fee_fn(amounts, is_sell) -> 每只股票的费用，给出时代替上面三个费率
+    返回 dict：value（每日资产 T×N）、trades（成交明细 DataFrame）
+    """
+    index = close.index if isinstance(close, (pd.Series, pd.DataFrame)) else None
+    columns = close.columns if isinstance(close, pd.DataFrame) else None
+    o, h, l, c = (_as_2d(x).astype('f8') for x in (open_, high, low, close))
+    ent, ext = _as_2d(entries).astype(bool), _as_2d(exits).astype(bool)
+    T, N = c.shape
+    # T+1 按自然日判断；没有日期时把每根K线视为一个交易日
+    dates = index if dates is None else dates
+    days = pd.DatetimeIndex(dates).normalize().asi8 if dates is not None else np.arange(T)
+
+    sl, tp = _broadcast(stop_loss, N), _broadcast(take_profit, N)
+    lot = _broadcast(lot_size, N)
+    cash_ = np.full(N, float(cash))
+    shares = np.zeros(N)
+    pend_buy = np.zeros(N, dtype=bool)
+    pend_sell = np.zeros(N, dtype=bool)
+    limit = np.full(N, np.nan)
+    order_size = np.zeros(N)
+    stop = np.full(N, np.nan)
+    target = np.full(N, np.nan)
+    buy_day = np.full(N, -1, dtype='i8')
+    entry_px = np.full(N, np.nan)
+    entry_t = np.full(N, -1, dtype='i8')
+    entry_fee = np.zeros(N)
+    value = np.full((T, N), np.nan)
+    trades = []
+
+    def fee(amount, sell):
+        if fee_fn is not None:
+            return np.asarray(fee_fn(amount, sell), dtype='f8')
+        f = np.where(amount > 0, np.maximum(amount * commission, min_commission), 0.0)
+        return f + (amount * stamp_duty if sell else 0.0)
+
+    for t in range(T):
+        # 1. 开盘撮合挂单
+        if pend_sell.any():
+            can_sell = pend_sell & ~np.isnan(o[t])
+            if t_plus_one:
+                can_sell &= days[t] > buy_day
+            amount = shares * o[t]
+            f = fee(amount, True)
+            for i in np.flatnonzero(can_sell):
+                trades.append((i, entry_t[i], t, shares[i], entry_px[i], o[t, i],
+                               amount[i] - shares[i] * entry_px[i] - f[i] - entry_fee[i]))
+            cash_ = np.where(can_sell, cash_ + amount - f, cash_)
+            shares = np.where(can_sell, 0.0, shares)
+            pend_sell &= ~can_sell
+        if pend_buy.any():
+            if limit_entry:
+                px = np.where(o[t] <= limit, o[t], np.where(l[t] <= limit, limit, np.nan))
+            else:
+                px = o[t]
+            amount = order_size * px
+            f = fee(np.nan_to_num(amount), False)
+            filled = pend_buy & ~np.isnan(px) & (amount + f <= cash_)
+            cash_ = np.where(filled, cash_ - amount - f, cash_)
+            shares = np.where(filled, order_size, shares)
+            entry_px = np.where(filled, px, entry_px)
+            entry_t = np.where(filled, t, entry_t)
+            entry_fee = np.where(filled, f, entry_fee)
+            buy_day = np.where(filled, days[t], buy_day)
+            # 资金不足的单子撤销，价格没到的限价单继续挂着
+            pend_buy &= np.isnan(px)
+
+        # 2. 收盘记账
+        value[t] = cash_ + shares * np.nan_to_num(c[t])
+
+        # 3. 收盘决策（有挂单时不再下单）
+        free = ~pend_buy & ~pend_sell & ~np.isnan(c[t])
+        holding = free & (shares > 0)
+        with np.errstate(invalid='ignore'):
+            hit = ext[t] | (c[t] <= stop) | (c[t] >= target)
+        pend_sell |= holding & hit
+        new = free & (shares == 0) & ent[t]
+        if new.any():
+            if size is None and fee_fn is not None:
+                # 费用随金额单调递增，先扣掉全仓金额的费用再取整，保证买得起
+                qty = np.floor((cash_ - fee(cash_, False)) / c[t] / lot) * lot
+            elif size is None:
+                qty = np.floor(cash_ / (c[t] * (1 + commission)) / lot) * lot
+            else:
+                qty = np.floor(_broadcast(size, N) / lot) * lot
+            new &= qty > 0
+            pend_buy |= new
+            order_size = np.where(new, qty, order_size)
+            limit = np.where(new, c[t], limit)
+            stop = np.where(new, np.where(np.isnan(sl), -np.inf, c[t] * (1 - sl)), stop)
+            target = np.where(new, np.where(np.isnan(tp), np.inf, c[t] * (1 + tp)), target)
+
+    trades = pd.DataFrame(trades, columns=['symbol', 'entry_bar', 'exit_bar', 'shares',
+                                           'entry_price', 'exit_price', 'pnl'])
+    if columns is not None:
+        trades['symbol'] = columns[trades['symbol']] if len(trades) else trades['symbol']
+        value = pd.DataFrame(value, index=index, columns=columns)
+    elif index is not None:
+        value = pd.DataFrame(value, index=index)
+    if index is not None and len(trades):
+        trades['entry_date'] = index[trades['entry_bar']]
+        trades['exit_date'] = index[trades['exit_bar']]
+    return {'value': value, 'trades': trades, 'cash': float(cash)}
+
+
+def max_drawdown(value):
+    """最大回撤（%），与 backtrader DrawDown 分析器相同"""
+    v = _as_2d(value).astype('f8')
+    peak = np.maximum.accumulate(v, axis=0)
+    return np.max(100.0 * (peak - v) / peak, axis=0)
+
+
+def annual_return(value, cash):
+    """年化收益率（%），与 backtrader Returns 分析器的 rnorm100 相同"""
+    v = _as_2d(value).astype('f8')
+    rtot = np.log(v[-1] / cash)
+    return 100.0 * (np.exp(rtot / len(v) * TRADING_DAYS) - 1)
+
+
+def sharpe_ratio(value, dates, cash, riskfreerate=0.01):
+    """
+    与 backtrader SharpeRatio 默认参数一致：按自然年收益计算，不年化
+    只有一个年度时标准差为 0，返回 None（backtrader 同样返回 None）
+    """
+    v = pd.DataFrame(_as_2d(value), index=pd.DatetimeIndex(dates))
+    year_end = v.groupby(v.index.year).last()
+    prev = year_end.shift(1)
+    prev.iloc[0] = cash
+    rets = (year_end / prev - 1 - riskfreerate).to_numpy()
+    out = []
+    for col in rets.T:
+        std = col.std()
+        out.append(None if len(col) < 2 or std == 0 else float(col.mean() / std))
+    return out
+
+
+def summarize(result, dates=None):
+    """每只股票一行：最终资产、夏普、最大回撤、年化收益、交易次数、胜率"""
+    value, cash = result['value'], result['cash']
+    dates = value.index if dates is None else dates
+    names = value.columns if isinstance(value, pd.DataFrame) else range(_as_2d(value).shape[1])
+    trades = result['trades']
+    counts = trades.groupby('symbol').size() if len(trades) else pd.Series(dtype='i8')
+    wins = trades[trades['pnl'] > 0].groupby('symbol').size() if len(trades) else pd.Series(dtype='i8')
+    summary = pd.DataFrame({
+        'final_value': _as_2d(value)[-1],
+        'sharpe': sharpe_ratio(value, dates, cash),
+        'max_drawdown': max_drawdown(value),
+        'annual_return': annual_return(value, cash),
+    }, index=list(names))
+    summary['trades'] = counts.reindex(summary.index).fillna(0).astype(int)
+    summary['win_rate'] = (wins.reindex(summary.index).fillna(0) / summary['trades'].replace(0, np.nan))
+    return summary
+
+
+def crossover(fast, slow):
+    """与 backtrader CrossOver 一致：1 上穿，-1 下穿（相等时沿用上一次非零差值）"""
+    diff = pd.DataFrame(_as_2d(fast) - _as_2d(slow))
+    nzd = diff.where(diff != 0).ffill()
+    prev = nzd.shift(1)
+    up = (prev < 0) & (diff > 0)
+    down = (prev > 0) & (diff < 0)
+    out = up.astype(int) - down.astype(int)
+    return out.to_numpy() if np.ndim(fast) > 1 else out[0].to_numpy()
+
+
+def dual_ma_signals(close, volume, fast=5, slow=20, volume_filter=1.5, entry_price=None):
+    """
+    DualMovingAverageStrategy 的信号，返回 (entries, exits)
+    entry_price=None 时金叉+放量买入，否则收盘价 <= entry_price 买入；死叉卖出
+    """
+    c = _as_2d(close).astype('f8')
+    fast_ma = rolling_mean(c, fast)
+    slow_ma = rolling_mean(c, slow)
+    cross = _as_2d(crossover(fast_ma, slow_ma))
+    if entry_price is None:
+        entries = cross > 0
+        if volume_filter:
+            v = _as_2d(volume).astype('f8')
+            with np.errstate(invalid='ignore'):
+                entries &= v >= volume_filter * rolling_mean(v, slow)
+    else:
+        entries = c <= entry_price
+    exits = cross < 0
+    # backtrader 在所有指标都有值（slow 根K线之后）才开始调用 next
+    entries[:slow] = False
+    exits[:slow] = False
+    return entries, exits
+
+
+def combo_signals(df, divergence, ma_periods=(5, 10, 20), macd_params=(12, 26, 9)):
+    """
+    5201.py 的组合买点：量价背离 + MACD 金叉 + 均线多头排列
+    df 为单只股票 open/high/low/close 的 DataFrame，divergence 为背离信号序列
+    """
+    from indicator_engine import macd
+    close = df['close'].astype('float64')
+    dif, dea, _ = macd(close, *macd_params, min_periods=False)
+    golden = (dif > dea) & (dif.shift(1) <= dea.shift(1))
+    fast, mid, slow = (rolling_mean(close, w) for w in ma_periods)
+    bull = (fast > mid) & (mid > slow)
+    entries = (divergence.reindex(df.index) == 1) & golden & bull
+    return entries.to_numpy()
+
+
+def cross_check(stock_code, market='HK', fees=False, scale=100, cash=20000.0, **params):
+    """
+    用 backtrader 和本引擎回测同一份数据（quant_trading_strategy.load_frame），比较结果
+    params 传给 DualMovingAverageStrategy，未给出的使用策略默认值
+    fees=True 时两边都按 fee_model 的费率表计费
+    scale=1 时按实际价格和股数回测，本引擎按该市场的规则整手交易、A股 T+1
+    （scale=100 时 1 股代表 100 股，不按手取整）
+    """
+    from quant_trading_strategy import (load_frame, build_cerebro, collect_metrics, load_fee_fn,
+                                        DualMovingAverageStrategy)
+    from market_rules import lot_size, T_PLUS_ONE
+    p = dict(DualMovingAverageStrategy.params._getitems())
+    p.update(params)
+    p['verbose'] = False
+    df = load_frame(stock_code, market, scale)
+    bt_fee_fn = load_fee_fn(stock_code, market) if fees else None
+    # load_frame 把价格放大了 scale 倍，费用函数按实际金额计费
+    fee_fn = (lambda amount, sell: bt_fee_fn(np.asarray(amount) / scale, sell) * scale) if fees else None
+
+    cerebro = build_cerebro(df, cash=cash, stdstats=False, fee_fn=bt_fee_fn, scale=scale, **p)
+    bt_metrics = collect_metrics(cerebro, cerebro.run()[0])
+
+    entries, exits = dual_ma_signals(df['close'], df['volume'], p['fast'], p['slow'],
+                                     p['volume_filter'], p['entry_price'])
+    result = run_backtest(df['open'], df['high'], df['low'], df['close'], entries, exits,
+                          p['stop_loss'], p['take_profit'], cash=cash, size=p['size'],
+                          lot_size=lot_size(stock_code, market) if scale == 1 else 1,
+                          dates=df.index, t_plus_one=T_PLUS_ONE.get(market, False), fee_fn=fee_fn)
+    vec_metrics = summarize(result, df.index).iloc[0].to_dict()
+
+    print(f"{'指标':<14}{'backtrader':>16}{'向量化引擎':>16}")
+    for key in ['final_value', 'sharpe', 'max_drawdown', 'annual_return']:
+        print(f"{key:<14}{str(bt_metrics[key]):>16.12}{str(vec_metrics[key]):>16.12}")
+    print(f"{'trades':<14}{'':>16}{int(vec_metrics['trades']):>16}")
+    return bt_metrics, vec_metrics
+
+
+def cross_check_a_share(stock_code='sh.601985', start_date='20230101'):
+    """
+    A股核对：实际价格、每次买 1 手（100 股）、T+1、按费率表计费（佣金最低 5 元、卖出印花税、沪市过户费）
+    金叉建仓，保证区间内有成交；本地没有K线时先下载K线和复权因子
+    """
+    from bar_store import sync_bars, get_bars
+    from adjustment import sync_factors
+    if get_bars(stock_code, market='A') is None:
+        sync_bars(stock_code, start_date, market='A')
+        sync_factors(stock_code, 'A')
+    bt_metrics, vec_metrics = cross_check(stock_code, 'A', fees=True, scale=1, cash=100000.0,
+                                          size=100, entry_price=None)
+    if vec_metrics['trades'] == 0:
+        print(f"{stock_code} 在回测区间内没有成交，换一只股票或更长的区间再核对")
+    return bt_metrics, vec_metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量化回测引擎，与 backtrader 结果核对")
+    parser.add_argument('stock_code', nargs='?', default='09988')
+    parser.add_argument('--market', default='HK')
+    parser.add_argument('--golden-cross', action='store_true', help="使用金叉建仓（entry_price=None）")
+    parser.add_argument('--fees', action='store_true', help="按 fee_model 费率表计算交易费用")
+    parser.add_argument('--a-share', action='store_true',
+                        help="A股核对（T+1、整手、费率表）：stock_code 默认为 sh.601985")
+    args = parser.parse_args()
+    if args.a_share:
+        cross_check_a_share(args.stock_code if args.stock_code != '09988' else 'sh.601985')
+        return
+    params = {'entry_price': None} if args.golden_cross else {}
+    cross_check(args.stock_code, args.market, args.fees, **params)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+滚动窗口（walk-forward）样本外评估
+
+把历史按K线数切成若干折：每折用 train 根K线选参数（训练期夏普最高的一组），
+在紧接着的 test 根K线上用这组参数回测，只统计测试期（样本外）的表现；窗口每次向后移动 test 根
+
+策略：
+  dual_ma  DualMovingAverageStrategy（金叉+放量建仓，死叉/止损/止盈卖出），参数网格为 optimize_strategy.PARAM_GRID
+  combo    5201.py 的组合买点（量价背离 + MACD 金叉 + 均线多头），止损/止盈卖出，可选 MACD 死叉卖出
+
+指标在全部历史上只算一次（都只用当天及以前的数据，没有未来函数），每折直接切片；
+一折内全部参数组合作为 run_backtest 的列一次回测，不重建 backtrader 数据源
+各折在进程池中并行，数据和指标在 worker 初始化时准备好（fork 时直接共享主进程的）
+"""
+import time
+import itertools
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bar_store import resolve_symbol, get_bars
+from batch_fetch import read_symbols
+from indicator_engine import rolling_mean, macd
+from analyze_divergence import detect_divergence
+from vector_backtest import run_backtest, crossover, combo_signals, max_drawdown, TRADING_DAYS
+from optimize_strategy import PARAM_GRID, grid_params
+from market_rules import lot_size, T_PLUS_ONE
+from profiler import timed, snapshot, merge, add_profile_args, profile_from_args
+
+COMBO_GRID = {
+    'lookback': [14, 30, 60],
+    'stop_loss': [0.03, 0.05, 0.08],
+    'take_profit': [0.08, 0.12, 0.2],
+    'dead_cross_exit': [True, False],
+}
+
+# worker 进程内的数据和预先计算的指标，{代码: dict}
+_features = {}
+
+
+def daily_sharpe(value):
+    """按日收益率计算的年化夏普（无风险利率 0），value 为 T×N，没有波动的列为 NaN"""
+    v = np.asarray(value, dtype='f8')
+    v = v[:, None] if v.ndim == 1 else v
+    ret = v[1:] / v[:-1] - 1
+    std = ret.std(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(std > 0, ret.mean(axis=0) / std * np.sqrt(TRADING_DAYS), np.nan)
+
+
+# ---------- 指标预计算 ----------
+
+def dual_ma_features(df, grid):
+    """各周期均线、成交量均线、各 (fast, slow) 的交叉"""
+    close, volume = df['close'].to_numpy(), df['volume'].to_numpy()
+    windows = sorted(set(grid['fast']) | set(grid['slow']))
+    ma = {w: rolling_mean(close, w) for w in windows}
+    vol_ma = {w: rolling_mean(volume, w) for w in grid['slow']}
+    cross = {(f, s): crossover(ma[f], ma[s]) for f in grid['fast'] for s in grid['slow'] if f < s}
+    return {'vol_ma': vol_ma, 'cross': cross}
+
+
+def dual_ma_matrix(feat, df, combos):
+    """所有参数组合的 (entries, exits)，每个组合一列"""
+    volume = df['volume'].to_numpy()
+    entries = np.empty((len(df), len(combos)), dtype=bool)
+    exits = np.empty_like(entries)
+    for j, p in enumerate(combos):
+        cross = feat['cross'][(p['fast'], p['slow'])]
+        enter = cross > 0
+        if p['volume_filter']:
+            with np.errstate(invalid='ignore'):
+                enter = enter & (volume >= p['volume_filter'] * feat['vol_ma'][p['slow']])
+        entries[:, j] = enter
+        exits[:, j] = cross < 0
+        # 与 dual_ma_signals 相同：慢线有值之前不交易
+        entries[:p['slow'], j] = False
+        exits[:p['slow'], j] = False
+    return entries, exits
+
+
+def combo_features(df, grid):
+    """各回看窗口的组合买点，以及 MACD 死叉"""
+    divergence = detect_divergence(df, tuple(grid['lookback']))
+    entries = {n: combo_signals(df, divergence[f'vol_div_{n}']) for n in grid['lookback']}
+    dif, dea, _ = macd(df['close'].astype('float64'), min_periods=False)
+    dead = ((dif < dea) & (dif.shift(1) >= dea.shift(1))).to_numpy()
+    return {'entries': entries, 'dead': dead}
+
+
+def combo_matrix(feat, df, combos):
+    entries = np.column_stack([feat['entries'][p['lookback']] for p in combos])
+    exits = np.column_stack([feat['dead'] if p['dead_cross_exit'] else np.zeros(len(df), dtype=bool)
+                             for p in combos])
+    return entries, exits
+
+
+STRATEGIES = {
+    'dual_ma': {'grid': PARAM_GRID, 'features': dual_ma_features, 'matrix': dual_ma_matrix},
+    'combo': {'grid': COMBO_GRID, 'features': combo_features, 'matrix': combo_matrix},
+}
+
+
+def combos_of(strategy):
+    grid = STRATEGIES[strategy]['grid']
+    if strategy == 'dual_ma':
+        return list(grid_params(grid))
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+@timed('walk_forward.features')
+def _prepare(codes, strategies, fees=False):
+    for code in codes:
+        if code in _features:
+            continue
+        market, symbol = resolve_symbol(code)
+        df = get_bars(symbol, market=market, adjust='qfq')
+        if df is None or df.empty:
+            continue
+        df = df.astype('float64')
+        feat = {'df': df, 'market': market, 'symbol': symbol,
+                'fee_fn': _fee_fn(symbol, market) if fees else None}
+        for name in strategies:
+            feat[name] = STRATEGIES[name]['features'](df, STRATEGIES[name]['grid'])
+            feat[f'{name}_signals'] = STRATEGIES[name]['matrix'](feat[name], df, combos_of(name))
+        _features[code] = feat
+
+
+def _fee_fn(symbol, market):
+    from quant_trading_strategy import load_fee_fn
+    return load_fee_fn(symbol, market)
+
+
+def fold_ranges(n, train, test):
+    """[(train_start, train_end, test_end), ...]，按K线序号，左闭右开"""
+    return [(s, s + train, min(s + train + test, n)) for s in range(0, n - train - 1, test)]
+
+
+def _backtest(feat, entries, exits, sl, tp, start, end, cash):
+    df = feat['df'].iloc[start:end]
+    # 同一组价格，每个参数组合一列
+    shape = (end - start, entries.shape[1])
+    o, h, l, c = (np.broadcast_to(df[col].to_numpy()[:, None], shape) for col in ['open', 'high', 'low', 'close'])
+    return run_backtest(o, h, l, c, entries[start:end], exits[start:end], sl, tp, cash=cash,
+                        lot_size=lot_size(feat['symbol'], feat['market']), dates=df.index,
+                        t_plus_one=T_PLUS_ONE.get(feat['market'], False), fee_fn=feat['fee_fn'])
+
+
+def run_fold(strategy, code, fold, bounds, cash=20000.0, min_trades=1):
+    """一折：训练期回测全部参数组合选出最优，测试期用最优参数回测"""
+    feat = _features[code]
+    combos = combos_of(strategy)
+    entries, exits = feat[f'{strategy}_signals']
+    sl = np.array([p['stop_loss'] for p in combos])
+    tp = np.array([p['take_profit'] for p in combos])
+    train_start, train_end, test_end = bounds
+
+    train = _backtest(feat, entries, exits, sl, tp, train_start, train_end, cash)
+    score = daily_sharpe(train['value'])
+    trades = np.bincount(train['trades']['symbol'].to_numpy(dtype='i8'), minlength=len(combos)) \
+        if len(train['trades']) else np.zeros(len(combos))
+    score = np.where(np.isnan(score) | (trades < min_trades), -np.inf, score)
+    best = int(np.argmax(score))
+    selected = bool(np.isfinite(score[best]))
+
+    # 训练期没有一组参数满足条件时，测试期不交易
+    test_entries = entries[:, [best]] if selected else np.zeros((len(entries), 1), dtype=bool)
+    test = _backtest(feat, test_entries, exits[:, [best]], sl[[best]], tp[[best]], train_end, test_end, cash)
+    value = test['value'][:, 0]
+    dates = feat['df'].index
+    # 没有选出参数时参数列留空，is_return 也没有意义
+    params = combos[best] if selected else dict.fromkeys(combos[best], np.nan)
+    row = {'strategy': strategy, 'code': code, 'fold': fold,
+           'train_start': dates[train_start].date(), 'test_start': dates[train_end].date(),
+           'test_end': dates[test_end - 1].date(), 'selected': selected, **params,
+           'is_sharpe': float(score[best]) if selected else np.nan,
+           'is_return': 100.0 * float(train['value'][-1, best] / cash - 1) if selected else np.nan,
+           'oos_sharpe': float(daily_sharpe(value)[0]),
+           'oos_return': 100.0 * float(value[-1] / cash - 1),
+           'oos_trades': len(test['trades'])}
+    # 测试期的日收益率，用于拼接样本外资金曲线（第一天相对初始资金）
+    returns = pd.Series(np.diff(np.r_[cash, value]) / np.r_[cash, value[:-1]], index=dates[train_end:test_end])
+    return row, returns, snapshot(reset=True)
+
+
+def _run_batch(tasks, cash, min_trades):
+    return [run_fold(*task, cash=cash, min_trades=min_trades) for task in tasks]
+
+
+def aggregate(folds, returns):
+    """
+    每个策略一行：各股票样本外资金曲线的平均表现；收益率、回撤都以 % 表示（与 max_drawdown 相同）
+    样本外没有波动（一直空仓）的折夏普记为 0 计入平均，flat_folds 为这类折数
+    """
+    rows = []
+    for strategy, part in folds.groupby('strategy'):
+        curves = {code: (1 + r).cumprod() for (s, code), r in returns.items() if s == strategy}
+        total = np.array([c.iloc[-1] - 1 for c in curves.values()])
+        years = np.array([len(c) / TRADING_DAYS for c in curves.values()])
+        rows.append({
+            'strategy': strategy,
+            'codes': len(curves),
+            'folds': len(part),
+            'is_sharpe': part['is_sharpe'].mean(),
+            'oos_sharpe': part['oos_sharpe'].fillna(0.0).mean(),
+            'flat_folds': int(part['oos_sharpe'].isna().sum()),
+            'oos_total_return': 100.0 * total.mean(),
+            'oos_annual_return': 100.0 * np.mean((1 + total) ** (1 / years) - 1),
+            'oos_max_drawdown': np.mean([max_drawdown(c.to_numpy())[0] for c in curves.values()]),
+            'positive_folds': (part['oos_return'] > 0).mean(),
+            'oos_trades': int(part['oos_trades'].sum()),
+        })
+    return pd.DataFrame(rows)
+
+
+def walk_forward(codes, strategies=('dual_ma', 'combo'), train=500, test=125, workers=None, cash=20000.0,
+                 min_trades=1, fees=False, batch_size=4):
+    """返回 (每折明细, 每个策略的样本外汇总)"""
+    _prepare(codes, strategies, fees)
+    tasks = [(strategy, code, fold, bounds)
+             for code, feat in _features.items() if code in codes
+             for strategy in strategies
+             for fold, bounds in enumerate(fold_ranges(len(feat['df']), train, test))]
+    if not tasks:
+        print(f"没有足够的K线（每只股票至少需要 train + 2 = {train + 2} 根）")
+        return pd.DataFrame(), pd.DataFrame()
+    batches = [tasks[i:i + batch_size] for i in range(0, len(tasks), batch_size)]
+    rows, returns = [], {}
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_prepare, initargs=(codes, strategies, fees)) as pool:
+        futures = [pool.submit(_run_batch, batch, cash, min_trades) for batch in batches]
+        for done, future in enumerate(as_completed(futures), 1):
+            for row, r, stats in future.result():
+                rows.append(row)
+                returns.setdefault((row['strategy'], row['code']), []).append(r)
+                merge(stats)
+            print(f"[{done}/{len(batches)}] 耗时 {time.time() - started:.1f} 秒")
+    folds = pd.DataFrame(rows).sort_values(['strategy', 'code', 'fold']).reset_index(drop=True)
+    returns = {key: pd.concat(parts).sort_index() for key, parts in returns.items()}
+    return folds, aggregate(folds, returns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="滚动窗口样本外评估（DualMovingAverageStrategy、5201 组合买点）")
+    parser.add_argument('symbols', nargs='+', help="股票代码，或以 @ 开头的代码列表文件")
+    parser.add_argument('--strategy', nargs='+', choices=sorted(STRATEGIES), default=sorted(STRATEGIES))
+    parser.add_argument('--train', type=int, default=500, help="训练期K线数")
+    parser.add_argument('--test', type=int, default=125, help="测试期K线数（窗口每次移动的距离）")
+    parser.add_argument('--workers', type=int, help="进程数，默认使用全部 CPU")
+    parser.add_argument('--cash', type=float, default=20000.0)
+    parser.add_argument('--min-trades', type=int, default=1, help="训练期交易次数少于该值的参数不参与选择")
+    parser.add_argument('--fees', action='store_true', help="按 fee_model 费率表计算交易费用")
+    parser.add_argument('--output', default='walk_forward_folds.csv', help="每折明细")
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    codes = []
+    for item in args.symbols:
+        codes.extend(read_symbols(item[1:]) if item.startswith('@') else [item])
+    with profile_from_args('walk_forward', args):
+        folds, summary = walk_forward(codes, tuple(args.strategy), args.train, args.test, args.workers, args.cash,
+                                      args.min_trades, args.fees)
+    if folds.empty:
+        return
+    folds.to_csv(args.output, index=False, encoding='utf-8-sig')
+    print(summary.to_string(index=False))
+    print(f"每折明细已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()